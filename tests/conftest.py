@@ -0,0 +1,31 @@
+"""Shared fixtures: the app module is loaded once per test session."""
+
+import importlib.util
+import os
+
+import pytest
+
+MODULE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "whatsflow-real.py")
+
+
+@pytest.fixture(scope="session")
+def whatsflow(tmp_path_factory):
+    # Importing the app touches DB_FILE relative to the working directory
+    previous = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp("whatsflow"))
+    try:
+        spec = importlib.util.spec_from_file_location("whatsflow_real", MODULE_PATH)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        yield module
+    finally:
+        os.chdir(previous)
+
+
+@pytest.fixture
+def db_file(whatsflow, tmp_path, monkeypatch):
+    """A fresh database that the module-level DB_FILE points at."""
+    path = str(tmp_path / "whatsflow.db")
+    monkeypatch.setattr(whatsflow, "DB_FILE", path)
+    whatsflow.init_db(path)
+    return path
@@ -0,0 +1,97 @@
+"""Cursor and resync semantics of the /api/events ring buffer."""
+
+import json
+import threading
+import time
+
+
+def _types(events):
+    return [json.loads(message)['type'] for _, message in events]
+
+
+def test_wait_returns_events_after_cursor(whatsflow):
+    log = whatsflow.EventLog(size=10)
+    first = log.append({'type': 'a'})
+    log.append({'type': 'b'})
+
+    events, cursor, missed = log.wait(first, timeout=0)
+
+    assert _types(events) == ['b']
+    assert cursor == log.cursor == 2
+    assert missed is False
+    # Caught up: nothing new, same cursor
+    assert log.wait(cursor, timeout=0) == ([], 2, False)
+
+
+def test_topic_filter_still_advances_cursor(whatsflow):
+    log = whatsflow.EventLog(size=10)
+    log.append({'type': 'msg'}, 'chat:inst-1:5511')
+    log.append({'type': 'stats_delta'}, 'stats')
+    log.append({'type': 'global'})
+
+    events, cursor, missed = log.wait(0, {'chat:inst-1:*'}, timeout=0)
+
+    # Untopiced events reach every reader; other topics are filtered out
+    assert _types(events) == ['msg', 'global']
+    assert json.loads(events[0][1])['topic'] == 'chat:inst-1:5511'
+    assert cursor == 3
+    assert not missed
+
+    log.append({'type': 'stats_delta'}, 'stats')
+    events, cursor, missed = log.wait(cursor, {'chat:inst-1:*'}, timeout=0)
+    assert events == []
+    assert cursor == 4
+    assert not missed
+
+
+def test_missed_when_events_fell_out_of_the_ring(whatsflow):
+    log = whatsflow.EventLog(size=3)
+    for index in range(5):
+        log.append({'type': f'e{index}'})
+
+    events, cursor, missed = log.wait(1, timeout=0)
+
+    assert missed is True
+    assert _types(events) == ['e2', 'e3', 'e4']
+    assert cursor == 5
+    # The oldest buffered event directly follows the cursor: nothing lost
+    assert log.wait(2, timeout=0)[2] is False
+
+
+def test_missed_when_cursor_is_ahead_after_restart(whatsflow):
+    log = whatsflow.EventLog(size=10)
+    log.append({'type': 'a'})
+
+    events, cursor, missed = log.wait(42, timeout=0)
+
+    assert events == []
+    assert cursor == 1
+    assert missed is True
+
+
+def test_wait_times_out_with_nothing_new(whatsflow):
+    log = whatsflow.EventLog(size=10)
+
+    started = time.monotonic()
+    assert log.wait(0, timeout=0.05) == ([], 0, False)
+    assert time.monotonic() - started >= 0.04
+    assert log.stats()['waiting'] == 0
+
+
+def test_wait_wakes_on_append_from_another_thread(whatsflow):
+    log = whatsflow.EventLog(size=10)
+    timer = threading.Timer(0.05, lambda: (
+        log.append({'type': 'other'}, 'stats'),
+        log.append({'type': 'wanted'}, 'chat:inst-1:5511'),
+    ))
+    timer.start()
+    try:
+        started = time.monotonic()
+        events, cursor, missed = log.wait(0, {'chat:*'}, timeout=5)
+    finally:
+        timer.join()
+
+    assert _types(events) == ['wanted']
+    assert cursor == 2
+    assert not missed
+    assert time.monotonic() - started < 5
@@ -0,0 +1,91 @@
+"""Deduplication of inbound messages delivered by the Baileys webhook."""
+
+import sqlite3
+
+import pytest
+
+
+@pytest.fixture
+def handler(whatsflow, db_file, monkeypatch):
+    monkeypatch.setattr(whatsflow, "_CONTACT_NAME_CACHE", whatsflow.ContactNameCache())
+    # The ingest path does not touch the socket, so skip the request machinery
+    return whatsflow.WhatsFlowRealHandler.__new__(whatsflow.WhatsFlowRealHandler)
+
+
+def _message(message_id, text="oi", instance="inst-1", sender="5511999990000@s.whatsapp.net"):
+    return {
+        'instanceId': instance,
+        'from': sender,
+        'pushName': "Maria",
+        'message': text,
+        'messageId': message_id,
+        'timestamp': "2024-05-01T12:00:00+00:00",
+    }
+
+
+def _chat(db_file, instance="inst-1"):
+    conn = sqlite3.connect(db_file)
+    try:
+        return conn.execute(
+            "SELECT unread_count, last_message FROM chats WHERE instance_id = ?", (instance,)
+        ).fetchone()
+    finally:
+        conn.close()
+
+
+def _message_count(db_file):
+    conn = sqlite3.connect(db_file)
+    try:
+        return conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_duplicate_inside_one_batch_is_stored_once(handler, db_file):
+    stored, duplicates, invalid = handler._ingest_inbound_messages([
+        _message("ABC1", "primeira"),
+        _message("ABC1", "primeira"),
+        _message("ABC2", "segunda"),
+    ])
+
+    assert [record['whatsapp_id'] for record in stored] == ["ABC1", "ABC2"]
+    assert duplicates == 1
+    assert invalid == []
+    assert _message_count(db_file) == 2
+    assert _chat(db_file) == (2, "segunda")
+
+
+def test_redelivery_leaves_chat_untouched(handler, db_file):
+    handler._ingest_inbound_messages([_message("ABC1", "primeira"), _message("ABC2", "segunda")])
+
+    stored, duplicates, _ = handler._ingest_inbound_messages([
+        _message("ABC1", "editada"),
+        _message("ABC2", "editada"),
+    ])
+
+    assert stored == []
+    assert duplicates == 2
+    assert _message_count(db_file) == 2
+    assert _chat(db_file) == (2, "segunda")
+
+
+def test_same_message_id_on_another_instance_is_new(handler, db_file):
+    handler._ingest_inbound_messages([_message("ABC1")])
+
+    stored, duplicates, _ = handler._ingest_inbound_messages([_message("ABC1", instance="inst-2")])
+
+    assert len(stored) == 1
+    assert duplicates == 0
+    assert _chat(db_file, "inst-2") == (1, "oi")
+
+
+def test_invalid_items_are_reported_by_position(handler, db_file):
+    stored, duplicates, invalid = handler._ingest_inbound_messages([
+        "not an object",
+        _message("ABC1"),
+        {'instanceId': "inst-1", 'message': "sem remetente"},
+    ])
+
+    assert len(stored) == 1
+    assert duplicates == 0
+    assert invalid == [0, 2]
@@ -0,0 +1,109 @@
+"""Range handling of the loopback /media-cache/<key> endpoint."""
+
+import http.client
+import json
+import os
+import threading
+
+import pytest
+
+CONTENT = b"0123456789abcdef"  # 16 bytes
+URL = "https://cdn.example.com/foto.jpg"
+
+
+@pytest.fixture(scope="module")
+def server(whatsflow, tmp_path_factory):
+    directory = str(tmp_path_factory.mktemp("media") / "cache")
+    os.makedirs(directory, mode=0o700)
+    os.chmod(directory, 0o700)
+    key = whatsflow.MediaCache.key_for(URL)
+    with open(os.path.join(directory, key), 'wb') as handle:
+        handle.write(CONTENT)
+    with open(os.path.join(directory, key + '.json'), 'w', encoding='utf-8') as handle:
+        json.dump({'url': URL, 'content_type': 'image/jpeg', 'fetched_at': 0}, handle)
+
+    previous = whatsflow._MEDIA_CACHE
+    whatsflow._MEDIA_CACHE = whatsflow.MediaCache(directory, max_bytes=1024 * 1024)
+
+    class QuietHandler(whatsflow.WhatsFlowRealHandler):
+        def log_message(self, format, *args):
+            pass
+
+    httpd = whatsflow.ThreadingHTTPServer(('127.0.0.1', 0), QuietHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield httpd.server_address[1], key
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+        whatsflow._MEDIA_CACHE = previous
+
+
+def _request(server, range_header=None, method='GET', key=None):
+    port, cached_key = server
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+    try:
+        headers = {'Range': range_header} if range_header else {}
+        conn.request(method, f"/media-cache/{key or cached_key}", headers=headers)
+        response = conn.getresponse()
+        return response.status, dict(response.getheaders()), response.read()
+    finally:
+        conn.close()
+
+
+def test_full_object_without_range(server):
+    status, headers, body = _request(server)
+
+    assert status == 200
+    assert body == CONTENT
+    assert headers['Content-Type'] == 'image/jpeg'
+    assert headers['Accept-Ranges'] == 'bytes'
+    assert 'Content-Range' not in headers
+
+
+@pytest.mark.parametrize("range_header, expected, content_range", [
+    ("bytes=0-3", CONTENT[0:4], "bytes 0-3/16"),
+    ("bytes=5-", CONTENT[5:], "bytes 5-15/16"),
+    ("bytes=-4", CONTENT[-4:], "bytes 12-15/16"),
+    ("bytes=-100", CONTENT, "bytes 0-15/16"),
+    ("bytes=10-99", CONTENT[10:], "bytes 10-15/16"),
+    ("bytes=15-15", CONTENT[15:], "bytes 15-15/16"),
+])
+def test_single_range_is_partial(server, range_header, expected, content_range):
+    status, headers, body = _request(server, range_header)
+
+    assert status == 206
+    assert body == expected
+    assert headers['Content-Range'] == content_range
+    assert headers['Content-Length'] == str(len(expected))
+
+
+@pytest.mark.parametrize("range_header", ["bytes=16-", "bytes=20-30", "bytes=5-2"])
+def test_unsatisfiable_range(server, range_header):
+    status, headers, body = _request(server, range_header)
+
+    assert status == 416
+    assert headers['Content-Range'] == "bytes */16"
+    assert body == b""
+
+
+@pytest.mark.parametrize("range_header", ["bytes=abc-", "bytes=0-1,4-5", "items=0-3"])
+def test_unsupported_range_serves_everything(server, range_header):
+    status, _, body = _request(server, range_header)
+
+    assert status == 200
+    assert body == CONTENT
+
+
+def test_head_sends_headers_only(server):
+    status, headers, body = _request(server, "bytes=0-3", method='HEAD')
+
+    assert status == 206
+    assert headers['Content-Length'] == '4'
+    assert body == b""
+
+
+def test_unknown_key_is_not_found(server):
+    assert _request(server, key="0" * 64)[0] == 404
+    assert _request(server, key="not-a-key")[0] == 404
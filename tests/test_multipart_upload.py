@@ -0,0 +1,104 @@
+"""Streaming multipart parser used by the media upload endpoint."""
+
+import hashlib
+import io
+
+import pytest
+
+BOUNDARY = "----whatsflowBoundary42"
+CONTENT_TYPE = f"multipart/form-data; boundary={BOUNDARY}"
+# Contains a near-miss of the delimiter so a naive split would cut it short
+PAYLOAD = b"\x89PNG\r\n" + b"\r\n--" + BOUNDARY[:-2].encode() + b"\x00" * 5 + bytes(range(256)) * 40
+
+
+def _body(payload=PAYLOAD):
+    return (
+        f"--{BOUNDARY}\r\n"
+        'Content-Disposition: form-data; name="instanceId"\r\n'
+        "\r\n"
+        "inst-1\r\n"
+        f"--{BOUNDARY}\r\n"
+        'Content-Disposition: form-data; name="file"; filename="foto.png"\r\n'
+        "Content-Type: image/png\r\n"
+        "\r\n"
+    ).encode() + payload + f"\r\n--{BOUNDARY}--\r\n".encode()
+
+
+class ShortReader(io.RawIOBase):
+    """Returns at most ``limit`` bytes per read, like a slow socket."""
+
+    def __init__(self, data, limit):
+        self._data = io.BytesIO(data)
+        self._limit = limit
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self._limit
+        return self._data.read(min(size, self._limit))
+
+
+@pytest.mark.parametrize("chunk, limit", [(1, 1), (7, 3), (7, 64 * 1024), (64 * 1024, 5)])
+def test_boundaries_split_across_reads(whatsflow, monkeypatch, chunk, limit):
+    monkeypatch.setattr(whatsflow, "UPLOAD_READ_CHUNK", chunk)
+    body = _body()
+
+    files, fields = whatsflow.read_multipart_upload(ShortReader(body, limit), CONTENT_TYPE, len(body))
+
+    assert fields == {'instanceId': 'inst-1'}
+    upload = files['file']
+    assert upload.filename == 'foto.png'
+    assert upload.content_type == 'image/png'
+    assert upload.size == len(PAYLOAD)
+    assert upload.file.read() == PAYLOAD
+    assert upload.sha256 == hashlib.sha256(PAYLOAD).hexdigest()
+    upload.close()
+
+
+def test_declared_length_over_limit_is_rejected_before_reading(whatsflow):
+    rfile = io.BytesIO(b"")
+
+    with pytest.raises(whatsflow.UploadError) as excinfo:
+        whatsflow.read_multipart_upload(
+            rfile, CONTENT_TYPE, 1024 + whatsflow.UPLOAD_FORM_OVERHEAD + 1, max_file_bytes=1024
+        )
+
+    assert excinfo.value.status_code == 413
+    assert rfile.tell() == 0
+
+
+def test_streamed_part_over_limit_is_rejected(whatsflow, monkeypatch):
+    monkeypatch.setattr(whatsflow, "UPLOAD_READ_CHUNK", 512)
+    body = _body()
+    rfile = io.BytesIO(body)
+
+    with pytest.raises(whatsflow.UploadError) as excinfo:
+        whatsflow.read_multipart_upload(rfile, CONTENT_TYPE, len(body), max_file_bytes=4096)
+
+    assert excinfo.value.status_code == 413
+    # Reading stops at the limit instead of consuming the whole body
+    assert rfile.tell() < len(body)
+
+
+def test_missing_length_and_wrong_type(whatsflow):
+    with pytest.raises(whatsflow.UploadError) as excinfo:
+        whatsflow.read_multipart_upload(io.BytesIO(b""), CONTENT_TYPE, 0)
+    assert excinfo.value.status_code == 411
+
+    with pytest.raises(whatsflow.UploadError) as excinfo:
+        whatsflow.read_multipart_upload(io.BytesIO(b"{}"), "application/json", 2)
+    assert excinfo.value.status_code == 400
+
+    with pytest.raises(whatsflow.UploadError) as excinfo:
+        whatsflow.read_multipart_upload(io.BytesIO(b""), "multipart/form-data", 10)
+    assert excinfo.value.status_code == 400
+
+
+def test_truncated_body_is_incomplete(whatsflow):
+    body = _body()
+    truncated = body[: len(body) // 2]
+
+    with pytest.raises(whatsflow.UploadError) as excinfo:
+        # The client announced the full length but the connection ended early
+        whatsflow.read_multipart_upload(io.BytesIO(truncated), CONTENT_TYPE, len(body))
+
+    assert excinfo.value.status_code == 400
@@ -0,0 +1,180 @@
+"""Recurrence rules across DST transitions and the scheduler catch-up policies."""
+
+import sqlite3
+from datetime import date, datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+import pytest
+
+NEW_YORK = ZoneInfo("America/New_York")
+
+
+def test_cron_parses_ranges_steps_and_names(whatsflow):
+    cron = whatsflow.CronExpression("*/15 9-17 * * mon-fri")
+
+    assert cron.minutes == {0, 15, 30, 45}
+    assert cron.hours == set(range(9, 18))
+    assert cron.weekdays == {0, 1, 2, 3, 4}
+    # Cron accepts both 0 and 7 for Sunday, Python calls it 6
+    assert whatsflow.CronExpression("0 0 * * 0").weekdays == {6}
+    assert whatsflow.CronExpression("0 0 * * 7").weekdays == {6}
+
+
+@pytest.mark.parametrize("expression", ["61 * * * *", "* * *", "*/0 * * * *", "0 0 * * xyz", "5-1 * * * *"])
+def test_cron_rejects_invalid_expressions(whatsflow, expression):
+    with pytest.raises(ValueError):
+        whatsflow.CronExpression(expression)
+
+
+def test_cron_day_fields_use_or_when_both_restricted(whatsflow):
+    cron = whatsflow.CronExpression("0 12 13 * fri")
+
+    assert cron.matches_day(date(2024, 5, 13))  # the 13th, a Monday
+    assert cron.matches_day(date(2024, 5, 17))  # a Friday
+    assert not cron.matches_day(date(2024, 5, 14))
+    # Only one field restricted: it alone decides
+    assert not whatsflow.CronExpression("0 12 * * fri").matches_day(date(2024, 5, 13))
+
+
+def test_daily_time_in_spring_forward_gap_shifts_forward(whatsflow):
+    rule = whatsflow.RecurrenceRule('daily', '02:30', tz_name="America/New_York")
+
+    occurrence = rule.next_after(datetime(2024, 3, 10, 0, 0, tzinfo=NEW_YORK))
+
+    # 02:30 does not exist on 2024-03-10; the wall clock reads 03:30 EDT then
+    assert occurrence.isoformat() == "2024-03-10T03:30:00-04:00"
+    assert rule.next_after(occurrence).isoformat() == "2024-03-11T02:30:00-04:00"
+
+
+def test_daily_time_in_fall_back_overlap_fires_once(whatsflow):
+    rule = whatsflow.RecurrenceRule('daily', '01:30', tz_name="America/New_York")
+
+    occurrence = rule.next_after(datetime(2024, 11, 3, 0, 0, tzinfo=NEW_YORK))
+
+    assert occurrence.isoformat() == "2024-11-03T01:30:00-04:00"
+    # The repeated 01:30 EST an hour later must not fire again
+    assert rule.next_after(occurrence).isoformat() == "2024-11-04T01:30:00-05:00"
+
+
+def test_daily_time_keeps_wall_clock_across_dst(whatsflow):
+    rule = whatsflow.RecurrenceRule('daily', '09:00', tz_name="America/New_York")
+
+    before = rule.next_after(datetime(2024, 3, 9, 12, 0, tzinfo=NEW_YORK))
+    after = rule.next_after(before)
+
+    assert before.isoformat() == "2024-03-10T09:00:00-04:00"
+    assert after.isoformat() == "2024-03-11T09:00:00-04:00"
+    assert (after - before) == timedelta(days=1)
+    assert rule.next_after(datetime(2024, 3, 9, 8, 0, tzinfo=NEW_YORK)).isoformat() == (
+        "2024-03-09T09:00:00-05:00"
+    )
+
+
+def test_cron_sequence_is_strictly_increasing_across_gap(whatsflow):
+    rule = whatsflow.RecurrenceRule('cron', cron_expression="*/30 * * * *", tz_name="America/New_York")
+
+    current = datetime(2024, 3, 10, 1, 45, tzinfo=NEW_YORK)
+    occurrences = []
+    for _ in range(3):
+        current = rule.next_after(current)
+        occurrences.append(current.isoformat())
+
+    assert occurrences == [
+        "2024-03-10T03:00:00-04:00",
+        "2024-03-10T03:30:00-04:00",
+        "2024-03-10T04:00:00-04:00",
+    ]
+
+
+def test_monthly_day_clamps_to_month_length(whatsflow):
+    rule = whatsflow.RecurrenceRule('monthly', '10:00', ['31'], tz_name='UTC')
+
+    occurrence = rule.next_after(datetime(2024, 2, 1, tzinfo=timezone.utc))
+
+    assert occurrence.isoformat() == "2024-02-29T10:00:00+00:00"
+    assert rule.next_after(occurrence).isoformat() == "2024-03-31T10:00:00+00:00"
+
+
+SPIKE_START = datetime(2024, 3, 4, 8, 55, tzinfo=timezone.utc)
+OUTAGE_END = datetime(2024, 3, 4, 11, 0, tzinfo=timezone.utc)
+
+
+def _overdue_scheduler(whatsflow, tmp_path, policy, schedules=4):
+    """Schedules due at 09:00 UTC and a scheduler that only wakes at 11:00."""
+
+    db_file = str(tmp_path / "catch-up.db")
+    whatsflow.generate_simulation_dataset(
+        db_file, schedules, SPIKE_START, spike_fraction=1.0, spike_time="09:00", tz_name='UTC'
+    )
+    conn = sqlite3.connect(db_file)
+    conn.execute("UPDATE scheduled_messages SET catch_up_policy = ?", (policy,))
+    conn.commit()
+    conn.close()
+
+    clock = whatsflow.TimeWarpClock(OUTAGE_END)
+    scheduler = whatsflow.MessageScheduler(
+        "http://127.0.0.1:9", node_id="test", require_leadership=False, clock=clock, db_file=db_file
+    )
+    sent = []
+    scheduler._send_message_to_group = lambda instance_id, group_id, *args: (
+        sent.append(group_id) or (True, None, 1)
+    )
+    return scheduler, clock, sent, db_file
+
+
+def _history(db_file):
+    conn = sqlite3.connect(db_file)
+    try:
+        return conn.execute("SELECT status, COUNT(*) FROM message_history GROUP BY status").fetchall()
+    finally:
+        conn.close()
+
+
+def _next_runs(db_file):
+    conn = sqlite3.connect(db_file)
+    try:
+        return {row[0] for row in conn.execute("SELECT next_run FROM scheduled_messages")}
+    finally:
+        conn.close()
+
+
+def test_catch_up_once_sends_everything_in_one_tick(whatsflow, tmp_path):
+    scheduler, _, sent, db_file = _overdue_scheduler(whatsflow, tmp_path, 'once')
+
+    scheduler._check_and_send_scheduled_messages()
+
+    assert len(sent) == 4
+    assert _history(db_file) == [('sent', 4)]
+    assert _next_runs(db_file) == {"2024-03-05T09:00:00+00:00"}
+
+
+def test_catch_up_skip_drops_missed_runs(whatsflow, tmp_path):
+    scheduler, _, sent, db_file = _overdue_scheduler(whatsflow, tmp_path, 'skip')
+
+    scheduler._check_and_send_scheduled_messages()
+
+    assert sent == []
+    assert _history(db_file) == [('skipped', 4)]
+    assert _next_runs(db_file) == {"2024-03-05T09:00:00+00:00"}
+
+
+def test_catch_up_spread_staggers_missed_runs(whatsflow, tmp_path):
+    scheduler, clock, sent, db_file = _overdue_scheduler(whatsflow, tmp_path, 'spread')
+
+    scheduler._check_and_send_scheduled_messages()
+
+    # The first slot has no delay; the others are pushed over the spread window
+    assert len(sent) == 1
+    pending = _next_runs(db_file) - {"2024-03-05T09:00:00+00:00"}
+    assert len(pending) == 3
+    for value in pending:
+        slot = datetime.fromisoformat(value)
+        assert OUTAGE_END < slot <= OUTAGE_END + timedelta(seconds=whatsflow.CATCH_UP_SPREAD_SECONDS)
+
+    for _ in range(whatsflow.CATCH_UP_SPREAD_SECONDS // 30 + 1):
+        clock.advance(30)
+        scheduler._check_and_send_scheduled_messages()
+
+    assert len(sent) == 4
+    assert _history(db_file) == [('sent', 4)]
+    assert _next_runs(db_file) == {"2024-03-05T09:00:00+00:00"}
@@ -0,0 +1,57 @@
+"""Smoke check for the time-warp scheduler simulation (``simulate-scheduler``)."""
+
+
+def test_warp_run_sends_every_schedule(whatsflow, tmp_path):
+    report = whatsflow.run_scheduler_simulation(
+        schedules=50,
+        duration_minutes=30,
+        latency_ms=1.0,
+        jitter_ms=0.0,
+        db_file=str(tmp_path / "simulation.db"),
+    )
+
+    assert report['dispatches'] == 50
+    assert report['sent'] == 50
+    assert report['failed'] == 0
+    assert report['pending_at_end'] == 0
+    # The warp clock must not fall back to real sleeps: 30 simulated minutes
+    # of ticks should finish in seconds.
+    assert report['real_seconds'] < 30
+
+
+def test_warp_run_reports_lag_percentiles(whatsflow, tmp_path):
+    report = whatsflow.run_scheduler_simulation(
+        schedules=40,
+        duration_minutes=20,
+        tick_interval=30.0,
+        latency_ms=1.0,
+        jitter_ms=0.0,
+        db_file=str(tmp_path / "simulation.db"),
+    )
+
+    assert report['dispatches'] == 40
+    assert 0.0 <= report['lag_p50'] <= report['lag_p90'] <= report['lag_p99'] <= report['lag_max']
+    # Every schedule is picked up by the first tick after it is due
+    assert report['lag_max'] < 30.0 + 5.0
+
+
+def test_percentile_uses_nearest_rank(whatsflow):
+    values = list(range(1, 11))
+
+    assert whatsflow._percentile([], 50) == 0.0
+    assert whatsflow._percentile(values, 50) == 5.0
+    assert whatsflow._percentile(values, 90) == 9.0
+    assert whatsflow._percentile(values, 99) == 10.0
+    assert whatsflow._percentile([7], 99) == 7.0
+
+
+def test_compare_reports_flags_only_real_regressions(whatsflow):
+    baseline = {'lag_p50': 1.0, 'lag_p99': 2.0, 'throughput_per_second': 100.0}
+
+    assert whatsflow.compare_simulation_reports(dict(baseline), baseline) == []
+    # Within the absolute floor: noise, not a regression
+    assert whatsflow.compare_simulation_reports(dict(baseline, lag_p50=1.04), baseline) == []
+    regressions = whatsflow.compare_simulation_reports(
+        dict(baseline, lag_p99=3.0, throughput_per_second=50.0), baseline
+    )
+    assert regressions == ["lag_p99: 2.0 -> 3.0", "throughput_per_second: 100.0 -> 50.0"]
@@ -19,18 +19,28 @@ import sys
 import threading
 import time
 import signal
-from http.server import HTTPServer, BaseHTTPRequestHandler
+import socket
+import stat
+import socketserver
+import struct
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 import urllib.parse
 import logging
-import warnings
-from typing import Set, Dict, Any, Optional, Tuple
+from typing import Set, Dict, Any, List, Optional, Tuple
 from datetime import timedelta
-import pytz
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+import calendar
+import math
+import hashlib
+import contextlib
+import random
+import shutil
+import tempfile
 import io
 import importlib
-import cgi
-
-warnings.filterwarnings("ignore", category=DeprecationWarning, module="cgi")
+import mimetypes
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 requests = None
 
@@ -67,6 +77,32 @@ except ImportError:
     WEBSOCKETS_AVAILABLE = False
     print("⚠️ WebSocket não disponível - executando sem tempo real")
 
+def _env_int(name: str, default: int) -> int:
+    """Read an integer setting from the environment, ignoring invalid values."""
+
+    raw = os.environ.get(name)
+    if raw is None or not raw.strip():
+        return default
+    try:
+        return int(raw)
+    except ValueError:
+        print(f"⚠️ Valor inválido para {name}: {raw!r}. Usando {default}.")
+        return default
+
+
+def _env_float(name: str, default: float) -> float:
+    """Read a float setting from the environment, ignoring invalid values."""
+
+    raw = os.environ.get(name)
+    if raw is None or not raw.strip():
+        return default
+    try:
+        return float(raw)
+    except ValueError:
+        print(f"⚠️ Valor inválido para {name}: {raw!r}. Usando {default}.")
+        return default
+
+
 # Configurações
 DB_FILE = "whatsflow.db"
 PORT = 8889
@@ -400,48 +436,6 @@ def get_minio_client():
     )
     return _MINIO_CLIENT
 
-# Candidate URLs for the Baileys service. We try to auto-discover the machine's
-# public IP so the script works even when the server address changes.
-
-def guess_public_baileys_url() -> Optional[str]:
-    """Return Baileys URL using the machine's public IP if available."""
-    try:
-        ip = requests.get("https://api.ipify.org", timeout=5).text.strip()
-        return f"http://{ip}:3002"
-    except requests.RequestException:
-        return None
-
-
-DEFAULT_BAILEYS_URLS = [
-    "http://127.0.0.1:3002",
-    "http://localhost:3002",
-    os.environ.get("API_BASE_URL"),
-    guess_public_baileys_url(),
-    "http://78.46.250.112:3002",
-]
-
-
-def resolve_baileys_url() -> str:
-    """Return the first reachable Baileys service URL."""
-    for url in [u for u in DEFAULT_BAILEYS_URLS if u]:
-        try:
-            response = requests.get(f"{url}/health", timeout=5)
-            if response.status_code == 200:
-                print(f"✅ Baileys service disponível em {url}")
-                return url
-            else:
-                print(
-                    f"⚠️ Baileys service respondeu com status {response.status_code} ({url}/health)"
-                )
-        except requests.RequestException as e:
-            print(f"⚠️ Falha ao acessar Baileys em {url}/health: {e}")
-    print("❌ Baileys service não acessível em nenhuma URL. Usando http://78.46.250.112:3002")
-    return "http://78.46.250.112:3002"
-
-
-API_BASE_URL = resolve_baileys_url()
-
-
 def ensure_minio_bucket(client=None):
     global _MINIO_BUCKET_POLICY_APPLIED, _MINIO_FORCE_PRESIGNED_URLS
     client = client or get_minio_client()
@@ -480,36 +474,133 @@ def ensure_minio_bucket(client=None):
     return client
 
 
-def upload_to_minio(filename: str, data: bytes) -> str:
-    client = ensure_minio_bucket()
+# Objects larger than one part go up as a multipart upload (5 MiB is the S3 minimum)
+MINIO_PART_SIZE = max(_env_int("MINIO_PART_SIZE", 5 * 1024 * 1024), 5 * 1024 * 1024)
+
+
+# Objects are named by the SHA-256 of their content. media_objects remembers
+# which hashes are already in each endpoint's bucket so a repeated upload skips
+# the transfer; a hit is confirmed with a HEAD (stat_object) before it is reused.
+_MEDIA_DEDUP_STATS = {'uploads': 0, 'deduplicated': 0, 'bytes_uploaded': 0, 'bytes_saved': 0}
+_MEDIA_DEDUP_LOCK = threading.Lock()
+_MINIO_MISSING_OBJECT_CODES = {'NoSuchKey', 'NoSuchObject', 'NoSuchBucket', 'NotFound', 'ResourceNotFound'}
+
+
+def _minio_endpoint_key() -> str:
+    """The MinIO server the current client talks to, as stored in media_objects."""
+    scheme = "https" if _MINIO_SECURE_DEFAULT else "http"
+    return f"{scheme}://{_MINIO_ENDPOINT}"
+
+
+def _sha256_of_stream(stream) -> str:
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: stream.read(1024 * 1024), b""):
+        digest.update(chunk)
+    stream.seek(0)
+    return digest.hexdigest()
+
+
+def store_media_object(filename: str, data, length: Optional[int] = None,
+                       content_type: Optional[str] = None,
+                       sha256: Optional[str] = None) -> Dict[str, Any]:
+    """Store ``data`` under its content hash unless the bucket already has it.
+
+    ``data`` is bytes or a seekable file object of ``length`` bytes; pass
+    ``sha256`` when it was computed while receiving the file. Returns the
+    URL, hash, size and whether the transfer was skipped.
+    """
     name = filename or "arquivo"
-    object_name = f"{int(time.time() * 1000)}{os.path.splitext(name)[1]}"
-    data_stream = io.BytesIO(data)
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        length = len(data)
+        sha256 = sha256 or hashlib.sha256(data).hexdigest()
+        data = io.BytesIO(data)
+    elif length is None:
+        raise ValueError("length é obrigatório para envio em streaming")
+    elif sha256 is None:
+        sha256 = _sha256_of_stream(data)
+
+    client = ensure_minio_bucket()
+    endpoint = _minio_endpoint_key()
+    now = datetime.now(timezone.utc).isoformat()
+    key = (endpoint, MINIO_BUCKET, sha256)
+    with sqlite3.connect(DB_FILE, timeout=30) as conn:
+        row = conn.execute(
+            "SELECT object_name FROM media_objects WHERE endpoint = ? AND bucket = ? AND sha256 = ?", key
+        ).fetchone()
+    if row:
+        # The bucket may have been emptied or the object deleted behind our back
+        try:
+            client.stat_object(MINIO_BUCKET, row[0])
+        except Exception as exc:
+            if getattr(exc, 'code', None) in _MINIO_MISSING_OBJECT_CODES:
+                with sqlite3.connect(DB_FILE, timeout=30) as conn:
+                    conn.execute(
+                        "DELETE FROM media_objects WHERE endpoint = ? AND bucket = ? AND sha256 = ?", key
+                    )
+            else:
+                logging.getLogger(__name__).warning(
+                    "Não foi possível confirmar o objeto '%s' no MinIO; reenviando: %s", row[0], exc
+                )
+            row = None
+    if row:
+        with sqlite3.connect(DB_FILE, timeout=30) as conn:
+            conn.execute(
+                "UPDATE media_objects SET hits = hits + 1, last_used_at = ? "
+                "WHERE endpoint = ? AND bucket = ? AND sha256 = ?",
+                (now, *key),
+            )
+        with _MEDIA_DEDUP_LOCK:
+            _MEDIA_DEDUP_STATS['uploads'] += 1
+            _MEDIA_DEDUP_STATS['deduplicated'] += 1
+            _MEDIA_DEDUP_STATS['bytes_saved'] += length
+        return {
+            'url': _build_minio_object_url(client, row[0]),
+            'sha256': sha256,
+            'size': length,
+            'deduplicated': True,
+        }
+
+    object_name = f"{sha256}{os.path.splitext(name)[1].lower()}"
     try:
-        client.put_object(MINIO_BUCKET, object_name, data_stream, len(data))
+        client.put_object(
+            MINIO_BUCKET,
+            object_name,
+            data,
+            length,
+            content_type=content_type or "application/octet-stream",
+            part_size=MINIO_PART_SIZE,
+        )
     except Exception as exc:
         raise RuntimeError(f"Falha ao enviar arquivo para o MinIO: {exc}") from exc
-    return _build_minio_object_url(client, object_name)
 
-# WebSocket clients management
-if WEBSOCKETS_AVAILABLE:
-    websocket_clients: Set[websockets.WebSocketServerProtocol] = set()
+    with sqlite3.connect(DB_FILE, timeout=30) as conn:
+        conn.execute("""
+            INSERT INTO media_objects (endpoint, bucket, sha256, object_name, size, content_type, created_at, last_used_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(endpoint, bucket, sha256) DO UPDATE SET
+                object_name = excluded.object_name,
+                last_used_at = excluded.last_used_at
+        """, (endpoint, MINIO_BUCKET, sha256, object_name, length, content_type, now, now))
+    with _MEDIA_DEDUP_LOCK:
+        _MEDIA_DEDUP_STATS['uploads'] += 1
+        _MEDIA_DEDUP_STATS['bytes_uploaded'] += length
+    return {
+        'url': _build_minio_object_url(client, object_name),
+        'sha256': sha256,
+        'size': length,
+        'deduplicated': False,
+    }
+
+
+def upload_to_minio(filename: str, data, length: Optional[int] = None,
+                    content_type: Optional[str] = None) -> str:
+    """Store ``data`` (bytes or a readable file object of ``length`` bytes) and return its URL."""
+    return store_media_object(filename, data, length, content_type)['url']
 
 # Health check for Baileys service
-def check_service_health(api_base_url: str) -> bool:
-    """Check if the Baileys service is reachable."""
-    url = f"{api_base_url}/health"
-    try:
-        response = requests.get(url, timeout=5)
-        if response.status_code == 200:
-            print(f"✅ Baileys service disponível em {api_base_url}")
-            return True
-        else:
-            print(f"⚠️ Baileys service respondeu com status {response.status_code} ({url})")
-            return False
-    except requests.RequestException as e:
-        print(f"❌ Não foi possível acessar Baileys em {url}: {e}")
-        return False
+def check_service_health(api_base_url: Optional[str] = None, *, force: bool = False) -> bool:
+    """Check if the Baileys service is reachable (cached, see ``BaileysClient.health``)."""
+    return _BAILEYS_CLIENT.health(api_base_url, force=force)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -517,6 +608,187 @@ logger = logging.getLogger(__name__)
 
 MAX_MEDIA_BYTES = 15 * 1024 * 1024  # 15 MB limit accepted by Baileys payloads
 REMOTE_MEDIA_TIMEOUT = (5, 15)
+# Validation results are reused for this many seconds (0 disables the cache).
+REMOTE_MEDIA_CACHE_TTL = _env_float("REMOTE_MEDIA_CACHE_TTL", 300.0)
+# Failed validations are cached for a shorter period so fixed URLs recover quickly.
+REMOTE_MEDIA_CACHE_NEGATIVE_TTL = _env_float("REMOTE_MEDIA_CACHE_NEGATIVE_TTL", 30.0)
+REMOTE_MEDIA_CACHE_MAX_ENTRIES = _env_int("REMOTE_MEDIA_CACHE_MAX_ENTRIES", 1024)
+# Uploads stay in memory up to this size and spill to a temp file beyond it.
+UPLOAD_SPOOL_THRESHOLD = _env_int("UPLOAD_SPOOL_THRESHOLD", 1024 * 1024)
+UPLOAD_READ_CHUNK = 64 * 1024
+# Room for boundaries, part headers and small text fields around the file.
+UPLOAD_FORM_OVERHEAD = 64 * 1024
+UPLOAD_MAX_HEADER_BYTES = 16 * 1024
+
+
+class UploadError(Exception):
+    """A multipart upload was rejected; ``status_code`` is the HTTP answer."""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class UploadedFile:
+    """File part of a multipart form, spooled to disk past UPLOAD_SPOOL_THRESHOLD."""
+
+    def __init__(self, field: str, filename: str, content_type: Optional[str]):
+        self.field = field
+        self.filename = filename
+        self.content_type = content_type
+        self.file = tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_THRESHOLD)
+        self.size = 0
+        self.digest = hashlib.sha256()
+
+    @property
+    def sha256(self) -> str:
+        return self.digest.hexdigest()
+
+    @property
+    def spooled_to_disk(self) -> bool:
+        return bool(getattr(self.file, '_rolled', False))
+
+    def close(self) -> None:
+        self.file.close()
+
+
+def _parse_header_params(value: str) -> Tuple[str, Dict[str, str]]:
+    """Split ``form-data; name="file"; filename="a.jpg"`` into value and parameters."""
+    parts = value.split(';')
+    params: Dict[str, str] = {}
+    for part in parts[1:]:
+        key, sep, val = part.strip().partition('=')
+        if not sep:
+            continue
+        val = val.strip()
+        if len(val) >= 2 and val[0] == val[-1] == '"':
+            val = val[1:-1].replace('\\"', '"')
+        params[key.strip().lower()] = val
+    return parts[0].strip().lower(), params
+
+
+def read_multipart_upload(rfile, content_type: Optional[str], content_length: int,
+                          max_file_bytes: int = MAX_MEDIA_BYTES):
+    """Stream a ``multipart/form-data`` body from ``rfile``.
+
+    Returns ``(files, fields)``: ``UploadedFile`` objects keyed by field name
+    (rewound, ready to read) and small text fields. File parts are written
+    chunk by chunk to spooled temp files and the read stops with a 413
+    ``UploadError`` as soon as one exceeds ``max_file_bytes``.
+    """
+    mime, params = _parse_header_params(content_type or '')
+    boundary = params.get('boundary')
+    if mime != 'multipart/form-data' or not boundary:
+        raise UploadError("Envie o arquivo como multipart/form-data")
+    if content_length <= 0:
+        raise UploadError("Content-Length obrigatório", 411)
+    if content_length > max_file_bytes + UPLOAD_FORM_OVERHEAD:
+        raise UploadError(
+            f"Arquivo excede o limite de {max_file_bytes // (1024 * 1024)} MB", 413
+        )
+
+    delimiter = b"\r\n--" + boundary.encode('latin-1')
+    files: Dict[str, UploadedFile] = {}
+    fields: Dict[str, str] = {}
+    # A leading CRLF lets the first boundary match the same delimiter as the others
+    buffer = bytearray(b"\r\n")
+    remaining = content_length
+    state = 'preamble'
+    part = None
+    field_name = None
+    field_value = bytearray()
+
+    def fill() -> bool:
+        nonlocal remaining
+        if remaining <= 0:
+            return False
+        chunk = rfile.read(min(UPLOAD_READ_CHUNK, remaining))
+        if not chunk:
+            remaining = 0
+            return False
+        remaining -= len(chunk)
+        buffer.extend(chunk)
+        return True
+
+    def write(data) -> None:
+        if part is not None:
+            part.size += len(data)
+            if part.size > max_file_bytes:
+                raise UploadError(
+                    f"Arquivo excede o limite de {max_file_bytes // (1024 * 1024)} MB", 413
+                )
+            part.file.write(data)
+            part.digest.update(data)
+        else:
+            field_value.extend(data)
+            if len(field_value) > UPLOAD_FORM_OVERHEAD:
+                raise UploadError(f"Campo '{field_name}' muito grande", 413)
+
+    try:
+        while True:
+            if state in ('preamble', 'body'):
+                index = buffer.find(delimiter)
+                if index < 0:
+                    # Keep a tail that could be the start of a split delimiter
+                    keep = len(delimiter) - 1
+                    if state == 'body' and len(buffer) > keep:
+                        write(bytes(buffer[:-keep]))
+                        del buffer[:-keep]
+                    elif state == 'preamble' and len(buffer) > keep:
+                        del buffer[:-keep]
+                    if not fill():
+                        raise UploadError("Corpo multipart incompleto")
+                    continue
+                if state == 'body':
+                    write(bytes(buffer[:index]))
+                    if part is not None:
+                        part.file.seek(0)
+                        files[part.field] = part
+                    else:
+                        fields[field_name] = field_value.decode('utf-8', 'replace')
+                    part = None
+                del buffer[:index + len(delimiter)]
+                state = 'delimiter'
+            elif state == 'delimiter':
+                if len(buffer) < 2 and fill():
+                    continue
+                if buffer[:2] == b"--":
+                    break
+                state = 'headers'
+            elif state == 'headers':
+                end = buffer.find(b"\r\n\r\n")
+                if end < 0:
+                    if len(buffer) > UPLOAD_MAX_HEADER_BYTES:
+                        raise UploadError("Cabeçalhos multipart muito grandes")
+                    if not fill():
+                        raise UploadError("Corpo multipart incompleto")
+                    continue
+                # Everything up to the first CRLF is transport padding after the boundary
+                header_block = bytes(buffer[:end]).decode('utf-8', 'replace').split("\r\n")[1:]
+                del buffer[:end + 4]
+                headers: Dict[str, str] = {}
+                for line in header_block:
+                    key, _, value = line.partition(':')
+                    headers[key.strip().lower()] = value.strip()
+                _, disposition = _parse_header_params(headers.get('content-disposition', ''))
+                field_name = disposition.get('name', '')
+                field_value = bytearray()
+                if 'filename' in disposition:
+                    part = UploadedFile(field_name, disposition['filename'], headers.get('content-type'))
+                state = 'body'
+    except BaseException:
+        if part is not None:
+            part.close()
+        for uploaded in files.values():
+            uploaded.close()
+        raise
+
+    # Drain the epilogue so the connection stays usable
+    while remaining > 0 and fill():
+        buffer.clear()
+    return files, fields
+
+
 _BASE64_ALLOWED_CHARS = set("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/=\n\r\t ")
 
 
@@ -550,31 +822,262 @@ def _looks_like_base64_payload(value: str) -> bool:
     return len(trimmed.replace("\n", "").replace("\r", "")) % 4 == 0
 
 
-def validate_remote_media_url(media_url: str) -> tuple[str, Optional[str], Optional[int]]:
-    """Validate that the provided media URL is remotely accessible and lightweight."""
+class _SingleFlightCall:
+    __slots__ = ("event", "result", "error")
 
-    trimmed = (media_url or "").strip()
-    if not trimmed:
-        return "", "URL de mídia não fornecida", None
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
 
-    lowered = trimmed.lower()
-    if not lowered.startswith(("http://", "https://")):
-        if _looks_like_base64_payload(trimmed):
-            return trimmed, (
-                "Conteúdo base64 detectado. Faça o upload da mídia e informe apenas a URL "
-                "HTTP/HTTPS acessível pelo Baileys."
-            ), None
-        return trimmed, "URL de mídia deve começar com http:// ou https://", None
+
+class _SingleFlight:
+    """Collapse concurrent calls for the same key into a single execution.
+
+    The first caller runs ``fn``; callers arriving while it is in flight wait
+    for that result (or exception) instead of repeating the work.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Any, _SingleFlightCall] = {}
+
+    def do(self, key: Any, fn) -> Tuple[Any, bool]:
+        """Run ``fn`` once per key and return ``(result, shared)``."""
+
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                leader = False
+            else:
+                leader = True
+                call = _SingleFlightCall()
+                self._calls[key] = call
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except BaseException as exc:
+            call.error = exc
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.event.set()
+        return call.result, False
+
+
+class _Histogram:
+    """Fixed-bucket histogram with count, sum and max."""
+
+    def __init__(self, bounds, counts=None):
+        self.bounds = tuple(bounds)
+        self.counts = list(counts) if counts else [0] * (len(self.bounds) + 1)
+        self.count = sum(self.counts)
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        value = max(0.0, float(value))
+        index = len(self.bounds)
+        for position, bound in enumerate(self.bounds):
+            if value <= bound:
+                index = position
+                break
+        self.counts[index] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def merge(self, other: "_Histogram") -> None:
+        for index, value in enumerate(other.counts):
+            self.counts[index] += value
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding quantile ``q`` (capped at ``max``)."""
+
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for index, value in enumerate(self.counts):
+            seen += value
+            if value and seen >= target:
+                bound = self.bounds[index] if index < len(self.bounds) else self.max
+                return min(bound, self.max)
+        return self.max
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            'count': self.count,
+            'avg': round(self.total / self.count, 4) if self.count else 0.0,
+            'p50': round(self.quantile(0.50), 4),
+            'p90': round(self.quantile(0.90), 4),
+            'p99': round(self.quantile(0.99), 4),
+            'max': round(self.max, 4),
+            'buckets': dict(zip([str(bound) for bound in self.bounds] + ['+Inf'], self.counts)),
+        }
+
+
+class _RateLimiter:
+    """Token bucket: ``acquire`` blocks until a token is available."""
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = max(rate, 0.001)
+        self.burst = max(burst if burst is not None else rate, 1.0)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """Take one token and return how long the caller waited for it."""
+
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+
+def _normalize_media_cache_key(url: str) -> str:
+    """Normalize a media URL so equivalent spellings share a cache entry.
+
+    Raises ``ValueError`` for malformed URLs (bad port, unbalanced brackets).
+    """
+
+    parsed = urllib.parse.urlsplit(url.strip())
+    scheme = parsed.scheme.lower()
+    host = (parsed.hostname or "").lower()
+    port = parsed.port
+    if port and not ((scheme == "http" and port == 80) or (scheme == "https" and port == 443)):
+        host = f"{host}:{port}"
+    if parsed.username or parsed.password:
+        host = f"{parsed.username or ''}:{parsed.password or ''}@{host}"
+    return urllib.parse.urlunsplit((scheme, host, parsed.path or "/", parsed.query, ""))
+
+
+class RemoteMediaValidationCache:
+    """Bounded TTL cache of remote media validation results keyed by URL.
+
+    Each entry stores the reported content length and the validation error
+    (if any). Failures are cached for ``negative_ttl``
+    seconds, and concurrent validations of the same URL are deduplicated.
+    """
+
+    def __init__(self, ttl: float, negative_ttl: float, max_entries: int):
+        self.ttl = max(0.0, ttl)
+        self.negative_ttl = max(0.0, negative_ttl)
+        self.max_entries = max(1, max_entries)
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._single_flight = _SingleFlight()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def lookup(self, url: str, validator) -> Tuple[Optional[str], Optional[int]]:
+        """Return ``(error, content_length)`` for ``url``, validating on a miss."""
+
+        key = _normalize_media_cache_key(url)
+        cached = self._get(key)
+        if cached is not None:
+            return cached["error"], cached["content_length"]
+
+        (error, content_length), shared = self._single_flight.do(
+            key, lambda: self._validate_and_store(key, url, validator)
+        )
+        if shared:
+            with self._lock:
+                self.coalesced += 1
+        return error, content_length
+
+    def invalidate(self, url: Optional[str] = None) -> None:
+        """Drop one URL (or every entry when ``url`` is ``None``)."""
+
+        with self._lock:
+            if url is None:
+                self._entries.clear()
+            else:
+                with contextlib.suppress(ValueError):
+                    self._entries.pop(_normalize_media_cache_key(url), None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "negative_ttl": self.negative_ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+            }
+
+    def _get(self, key: str) -> Optional[Dict[str, Any]]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry["expires_at"] <= now:
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def _validate_and_store(self, key: str, url: str, validator) -> Tuple[Optional[str], Optional[int]]:
+        error, content_length = validator(url)
+        ttl = self.negative_ttl if error else self.ttl
+        if ttl > 0:
+            with self._lock:
+                self._entries[key] = {
+                    "content_length": content_length,
+                    "error": error,
+                    "expires_at": time.monotonic() + ttl,
+                }
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return error, content_length
+
+
+_REMOTE_MEDIA_VALIDATION_CACHE = RemoteMediaValidationCache(
+    REMOTE_MEDIA_CACHE_TTL,
+    REMOTE_MEDIA_CACHE_NEGATIVE_TTL,
+    REMOTE_MEDIA_CACHE_MAX_ENTRIES,
+)
+
+
+def _probe_remote_media(url: str) -> Tuple[Optional[str], Optional[int]]:
+    """Fetch headers for ``url`` and return ``(error, content_length)``."""
 
     http = _ensure_requests_dependency()
 
     response = None
     try:
-        response = http.head(trimmed, allow_redirects=True, timeout=REMOTE_MEDIA_TIMEOUT)
+        response = http.head(url, allow_redirects=True, timeout=REMOTE_MEDIA_TIMEOUT)
         if response.status_code in (405, 501):  # Method not allowed or not implemented
             response.close()
             response = http.get(
-                trimmed,
+                url,
                 allow_redirects=True,
                 stream=True,
                 timeout=REMOTE_MEDIA_TIMEOUT,
@@ -582,11 +1085,11 @@ def validate_remote_media_url(media_url: str) -> tuple[str, Optional[str], Optio
     except http.exceptions.RequestException as exc:  # type: ignore[attr-defined]
         if response is not None:
             response.close()
-        return trimmed, f"Não foi possível acessar a mídia remota: {exc}", None
+        return f"Não foi possível acessar a mídia remota: {exc}", None
 
     if response.status_code >= 400:
         response.close()
-        return trimmed, (
+        return (
             f"Não foi possível acessar a mídia remota (status {response.status_code})."
         ), None
 
@@ -597,53 +1100,927 @@ def validate_remote_media_url(media_url: str) -> tuple[str, Optional[str], Optio
         try:
             content_length = int(content_length_header)
         except (TypeError, ValueError):
-            logger.debug("Content-Length não numérico informado pela URL %s", trimmed)
-            return trimmed, None, None
+            logger.debug("Content-Length não numérico informado pela URL %s", url)
+            return None, None
 
         if content_length > MAX_MEDIA_BYTES:
             size_mb = content_length / (1024 * 1024)
-            return trimmed, (
+            return (
                 f"A mídia remota possui {size_mb:.2f} MB, excedendo o limite seguro de 15 MB "
                 "aceito pelo Baileys."
             ), content_length
 
-        return trimmed, None, content_length
+        return None, content_length
 
     logger.debug(
         "URL de mídia %s sem cabeçalho Content-Length; prosseguindo mesmo assim.",
-        trimmed,
+        url,
     )
-    return trimmed, None, None
+    return None, None
 
-# HTML da aplicação (mesmo do Pure, mas com conexão real)
-HTML_APP = '''<!DOCTYPE html>
-<html lang="pt-BR">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>WhatsFlow Real - Sistema Profissional</title>
-    <style>
-        /* Professional WhatsFlow Design - Ultra Modern */
-        * { margin: 0; padding: 0; box-sizing: border-box; }
-        
-        :root {
-            --primary: #128c7e;
-            --primary-color: var(--primary);
-            --primary-dark: #075e54;
-            --primary-light: #25d366;
-            --bg-primary: #f0f2f5;
-            --bg-secondary: #ffffff;
-            --bg-chat: #e5ddd5;
-            --text-primary: #111b21;
-            --text-secondary: #667781;
-            --border: #e9edef;
-            --shadow: 0 1px 3px rgba(11,20,26,.13);
-            --shadow-lg: 0 2px 10px rgba(11,20,26,.2);
-            --gradient-primary: linear-gradient(135deg, var(--primary-dark) 0%, var(--primary) 100%);
-            --gradient-success: linear-gradient(135deg, var(--primary-light) 0%, var(--primary) 100%);
+
+def validate_remote_media_url(
+    media_url: str, *, use_cache: bool = True
+) -> tuple[str, Optional[str], Optional[int]]:
+    """Validate that the provided media URL is remotely accessible and lightweight.
+
+    Results for HTTP/HTTPS URLs are served from ``_REMOTE_MEDIA_VALIDATION_CACHE``
+    unless ``use_cache`` is false.
+    """
+
+    trimmed = (media_url or "").strip()
+    if not trimmed:
+        return "", "URL de mídia não fornecida", None
+
+    lowered = trimmed.lower()
+    if not lowered.startswith(("http://", "https://")):
+        if _looks_like_base64_payload(trimmed):
+            return trimmed, (
+                "Conteúdo base64 detectado. Faça o upload da mídia e informe apenas a URL "
+                "HTTP/HTTPS acessível pelo Baileys."
+            ), None
+        return trimmed, "URL de mídia deve começar com http:// ou https://", None
+
+    try:
+        _normalize_media_cache_key(trimmed)
+    except ValueError as exc:
+        # Malformed URLs are answered directly and never cached
+        return trimmed, f"URL de mídia inválida: {exc}", None
+
+    if use_cache:
+        error, content_length = _REMOTE_MEDIA_VALIDATION_CACHE.lookup(trimmed, _probe_remote_media)
+    else:
+        error, content_length = _probe_remote_media(trimmed)
+    return trimmed, error, content_length
+
+# Shared HTTP client for the Baileys service. A single requests.Session keeps a
+# keep-alive connection pool, so proxy handlers and the scheduler stop paying a
+# TCP handshake per call. Each operation has its own timeout, and latency per
+# endpoint is tracked for the admin stats endpoint.
+BAILEYS_POOL_SIZE = _env_int("BAILEYS_POOL_SIZE", 16)
+BAILEYS_MAX_RETRIES = _env_int("BAILEYS_MAX_RETRIES", 2)
+BAILEYS_RETRY_BACKOFF = _env_float("BAILEYS_RETRY_BACKOFF", 0.5)
+BAILEYS_HEALTH_CACHE_TTL = _env_float("BAILEYS_HEALTH_CACHE_TTL", 5.0)
+# (connect, read) timeouts in seconds per operation.
+BAILEYS_TIMEOUTS = {
+    'health': (2, 5),
+    'status': (3, 5),
+    'qr': (3, 5),
+    'connect': (3, 10),
+    'disconnect': (3, 10),
+    'groups': (3, 30),
+    'send': (10, 180),
+}
+BAILEYS_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60, 180)
+
+
+class BaileysError(Exception):
+    """Baileys answered with an error status or an unusable payload."""
+
+    def __init__(self, message: str, status_code: Optional[int] = None, payload=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.payload = payload
+
+
+class BaileysUnavailableError(BaileysError):
+    """The Baileys service could not be reached."""
+
+
+class BaileysTimeoutError(BaileysUnavailableError):
+    """The Baileys service did not answer within the operation timeout."""
+
+
+UNIX_SOCKET_SCHEME = "http+unix://"
+
+
+def unix_socket_url(path: str) -> str:
+    """Base URL (``http+unix://<quoted path>``) of a service listening on a Unix socket."""
+    return UNIX_SOCKET_SCHEME + urllib.parse.quote(path, safe='')
+
+
+def _unix_socket_adapter(**kwargs):
+    """requests adapter that sends ``http+unix://`` URLs over Unix-domain sockets.
+
+    The quoted socket path takes the place of the host; the rest of the URL is
+    sent as usual. Connections are pooled per socket path like TCP ones.
+    """
+
+    adapters = importlib.import_module("requests.adapters")
+    connection = importlib.import_module("urllib3.connection")
+    connectionpool = importlib.import_module("urllib3.connectionpool")
+    exceptions = importlib.import_module("urllib3.exceptions")
+
+    class UnixHTTPConnection(connection.HTTPConnection):
+        def __init__(self, socket_path: str, **conn_kwargs):
+            super().__init__("localhost", **conn_kwargs)
+            self.socket_path = socket_path
+
+        def _new_conn(self):
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            if isinstance(self.timeout, (int, float)):
+                sock.settimeout(self.timeout)
+            try:
+                sock.connect(self.socket_path)
+            except socket.timeout as exc:
+                sock.close()
+                raise exceptions.ConnectTimeoutError(self, f"Timeout ao conectar em {self.socket_path}") from exc
+            except OSError as exc:
+                sock.close()
+                raise exceptions.NewConnectionError(self, f"Falha ao conectar em {self.socket_path}: {exc}") from exc
+            return sock
+
+    class UnixHTTPConnectionPool(connectionpool.HTTPConnectionPool):
+        def __init__(self, socket_path: str, **pool_kwargs):
+            super().__init__("localhost", **pool_kwargs)
+            self.socket_path = socket_path
+
+        def _new_conn(self):
+            self.num_connections += 1
+            return UnixHTTPConnection(self.socket_path, timeout=self.timeout.connect_timeout)
+
+    class UnixSocketAdapter(adapters.HTTPAdapter):
+        def __init__(self, **adapter_kwargs):
+            super().__init__(**adapter_kwargs)
+            self._unix_pools: Dict[str, Any] = {}
+            self._unix_pools_lock = threading.Lock()
+
+        def get_connection_with_tls_context(self, request, verify, proxies=None, cert=None):
+            return self.get_connection(request.url, proxies)
+
+        def get_connection(self, url, proxies=None):
+            socket_path = urllib.parse.unquote(urllib.parse.urlsplit(url).netloc)
+            with self._unix_pools_lock:
+                pool = self._unix_pools.get(socket_path)
+                if pool is None:
+                    pool = self._unix_pools[socket_path] = UnixHTTPConnectionPool(
+                        socket_path, maxsize=self._pool_maxsize, block=self._pool_block
+                    )
+            return pool
+
+        def request_url(self, request, proxies):
+            return request.path_url
+
+        def close(self):
+            super().close()
+            with self._unix_pools_lock:
+                for pool in self._unix_pools.values():
+                    pool.close()
+                self._unix_pools.clear()
+
+    return UnixSocketAdapter(**kwargs)
+
+
+class BaileysClient:
+    """Pooled client for the Baileys HTTP API.
+
+    ``base_url`` defaults to ``transport_url`` (the local service's Unix socket,
+    when enabled) and then to ``API_BASE_URL`` at call time; every method also
+    accepts an explicit ``base_url`` so one pool can serve several services.
+    ``http+unix://`` URLs are sent over Unix-domain sockets.
+    Idempotent GETs are retried by the adapter on connection errors and 502/503/504;
+    sends are retried on timeouts, as the previous per-handler loops did.
+    """
+
+    def __init__(self, base_url: Optional[str] = None, pool_size: int = BAILEYS_POOL_SIZE,
+                 max_retries: int = BAILEYS_MAX_RETRIES, backoff: float = BAILEYS_RETRY_BACKOFF,
+                 timeouts: Optional[Dict[str, Tuple[float, float]]] = None,
+                 health_ttl: float = BAILEYS_HEALTH_CACHE_TTL):
+        self._base_url = base_url
+        self.pool_size = pool_size
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeouts = dict(BAILEYS_TIMEOUTS, **(timeouts or {}))
+        self.health_ttl = health_ttl
+        self._session = None
+        self._session_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, Any]] = {}
+        self._health: Dict[str, Tuple[bool, float]] = {}
+        self._health_flight = _SingleFlight()
+        # Set to a BaileysRouter when instances are sharded across workers.
+        self.router = None
+        # Set by BaileysManager to the local service's Unix socket URL.
+        self.transport_url: Optional[str] = None
+
+    @property
+    def base_url(self) -> str:
+        return (self._base_url or self.transport_url or API_BASE_URL).rstrip('/')
+
+    def url_for(self, instance_id: Optional[str] = None) -> str:
+        """Base URL of the service that owns ``instance_id``."""
+
+        if self.router is not None and instance_id:
+            return self.router.url_for(instance_id)
+        return self.base_url
+
+    def service_urls(self) -> list:
+        """Every Baileys service this client talks to (one per worker when sharded)."""
+
+        if self.router is not None:
+            return self.router.worker_urls()
+        return [self.base_url]
+
+    @property
+    def session(self):
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    self._session = self._build_session()
+        return self._session
+
+    def _build_session(self):
+        http = _ensure_requests_dependency()
+        adapters = importlib.import_module("requests.adapters")
+        retry_module = importlib.import_module("urllib3.util.retry")
+
+        retry = retry_module.Retry(
+            total=self.max_retries,
+            connect=self.max_retries,
+            read=0,
+            status=self.max_retries,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset({"GET", "HEAD"}),
+            backoff_factor=self.backoff,
+            raise_on_status=False,
+        )
+        adapter = adapters.HTTPAdapter(
+            pool_connections=self.pool_size,
+            pool_maxsize=self.pool_size,
+            max_retries=retry,
+        )
+        session = http.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        if hasattr(socket, "AF_UNIX"):
+            session.mount(UNIX_SOCKET_SCHEME, _unix_socket_adapter(
+                pool_connections=self.pool_size,
+                pool_maxsize=self.pool_size,
+                max_retries=retry,
+            ))
+        session.headers.update({"User-Agent": "WhatsFlow-Real/1.0"})
+        return session
+
+    def close(self) -> None:
+        with self._session_lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+    def _record(self, operation: str, elapsed: float, ok: bool) -> None:
+        with self._stats_lock:
+            entry = self._stats.get(operation)
+            if entry is None:
+                entry = self._stats[operation] = {
+                    'calls': 0,
+                    'errors': 0,
+                    'latency': _Histogram(BAILEYS_LATENCY_BUCKETS),
+                }
+            entry['calls'] += 1
+            if not ok:
+                entry['errors'] += 1
+            entry['latency'].observe(elapsed)
+
+    def stats(self) -> Dict[str, Any]:
+        """Per-endpoint call count, error count and latency histogram (seconds)."""
+
+        with self._stats_lock:
+            return {
+                operation: {
+                    'calls': entry['calls'],
+                    'errors': entry['errors'],
+                    'latency_seconds': entry['latency'].snapshot(),
+                }
+                for operation, entry in self._stats.items()
+            }
+
+    def request(self, operation: str, method: str, path: str, *, base_url: Optional[str] = None,
+                timeout_retries: int = 0, sleep=None, **kwargs):
+        """Issue a request and return the ``requests.Response``.
+
+        Raises ``BaileysTimeoutError``/``BaileysUnavailableError`` when the
+        service cannot be reached; HTTP error statuses are left to the caller.
+        The backoff between timeout retries goes through ``sleep`` (default
+        ``time.sleep``) so callers with their own clock can drive it.
+        """
+
+        http = _ensure_requests_dependency()
+        url = f"{(base_url or self.base_url).rstrip('/')}{path}"
+        kwargs.setdefault('timeout', self.timeouts.get(operation, (5, 30)))
+
+        for attempt in range(timeout_retries + 1):
+            started = time.perf_counter()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except http.exceptions.Timeout as exc:  # type: ignore[attr-defined]
+                self._record(operation, time.perf_counter() - started, False)
+                if attempt < timeout_retries:
+                    (sleep or time.sleep)(2 ** attempt)
+                    continue
+                error = BaileysTimeoutError(f"Timeout ao acessar Baileys em {url}")
+                error.attempts = attempt + 1
+                raise error from exc
+            except http.exceptions.RequestException as exc:  # type: ignore[attr-defined]
+                self._record(operation, time.perf_counter() - started, False)
+                raise BaileysUnavailableError(
+                    f"Não foi possível acessar Baileys em {url}: {exc}"
+                ) from exc
+            self._record(operation, time.perf_counter() - started, response.status_code < 500)
+            response.attempts = attempt + 1
+            return response
+
+    def _json(self, operation: str, method: str, path: str, **kwargs):
+        response = self.request(operation, method, path, **kwargs)
+        try:
+            payload = response.json()
+        except ValueError:
+            payload = None
+        if response.status_code != 200:
+            detail = payload.get('error') if isinstance(payload, dict) else None
+            raise BaileysError(
+                detail or response.text or f"HTTP {response.status_code}",
+                response.status_code,
+                payload,
+            )
+        if payload is None:
+            raise BaileysError("Resposta inválida do serviço Baileys", response.status_code)
+        return payload
+
+    @staticmethod
+    def _instance_path(prefix: str, instance_id: Optional[str]) -> str:
+        if instance_id:
+            return f"{prefix}/{urllib.parse.quote(str(instance_id), safe='')}"
+        return prefix
+
+    def health(self, base_url: Optional[str] = None, *, force: bool = False) -> bool:
+        """Return whether ``/health`` answers 200; cached for ``health_ttl`` seconds."""
+
+        target = (base_url or self.base_url).rstrip('/')
+        if not force:
+            cached = self._health.get(target)
+            if cached and time.monotonic() - cached[1] < self.health_ttl:
+                return cached[0]
+
+        def probe():
+            previous = self._health.get(target)
+            # Only state changes are printed; repeated probes stay quiet.
+            changed = previous is None or previous[0] is not True
+            try:
+                response = self.request('health', 'GET', '/health', base_url=target)
+                healthy = response.status_code == 200
+                if healthy and changed:
+                    print(f"✅ Baileys service disponível em {target}")
+                elif not healthy and (previous is None or previous[0]):
+                    print(f"⚠️ Baileys service respondeu com status {response.status_code} ({target}/health)")
+            except BaileysUnavailableError as exc:
+                if previous is None or previous[0]:
+                    print(f"❌ {exc}")
+                healthy = False
+            self._health[target] = (healthy, time.monotonic())
+            return healthy
+
+        healthy, _ = self._health_flight.do(target, probe)
+        return healthy
+
+    def _routed(self, instance_id: Optional[str], kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        if not kwargs.get('base_url'):
+            kwargs['base_url'] = self.url_for(instance_id)
+        return kwargs
+
+    def status(self, instance_id: Optional[str] = None, **kwargs) -> Dict[str, Any]:
+        return self._json('status', 'GET', self._instance_path('/status', instance_id),
+                          **self._routed(instance_id, kwargs))
+
+    def status_all(self) -> Tuple[Dict[str, Any], List[str]]:
+        """Bulk ``/status`` merged across every worker, plus the URLs that failed.
+
+        The merged states say nothing about the instances of a failed worker.
+        Raises if no worker answers.
+        """
+
+        merged: Dict[str, Any] = {}
+        errors = []
+        failed = []
+        urls = self.service_urls()
+        for url in urls:
+            try:
+                states = self._json('status', 'GET', '/status', base_url=url)
+            except BaileysError as exc:
+                errors.append(exc)
+                failed.append(url)
+                continue
+            if isinstance(states, dict):
+                merged.update(states)
+        if errors and len(errors) == len(urls):
+            raise errors[0]
+        return merged, failed
+
+    def instances_on(self, urls) -> Set[str]:
+        """Instance ids routed to the services at ``urls`` (empty when not sharded)."""
+
+        if self.router is None or not urls:
+            return set()
+        return self.router.instances_on(urls)
+
+    def qr(self, instance_id: Optional[str] = None, **kwargs) -> Dict[str, Any]:
+        return self._json('qr', 'GET', self._instance_path('/qr', instance_id),
+                          **self._routed(instance_id, kwargs))
+
+    def connect(self, instance_id: Optional[str] = None, **kwargs) -> Dict[str, Any]:
+        return self._json('connect', 'POST', self._instance_path('/connect', instance_id), json={},
+                          **self._routed(instance_id, kwargs))
+
+    def disconnect(self, instance_id: str, **kwargs) -> Dict[str, Any]:
+        return self._json('disconnect', 'POST', self._instance_path('/disconnect', instance_id), json={},
+                          **self._routed(instance_id, kwargs))
+
+    def groups(self, instance_id: str, **kwargs):
+        return self._json('groups', 'GET', self._instance_path('/groups', instance_id),
+                          **self._routed(instance_id, kwargs))
+
+    def send(self, instance_id: str, payload: Dict[str, Any], *, retries: int = 2, **kwargs):
+        """POST ``/send/<instance>`` and return the raw response (retried on timeouts)."""
+
+        self._routed(instance_id, kwargs)
+        return self.request(
+            'send',
+            'POST',
+            self._instance_path('/send', instance_id),
+            json=payload,
+            timeout_retries=retries,
+            **kwargs,
+        )
+
+
+_BAILEYS_CLIENT = BaileysClient()
+
+
+# Candidate URLs for the Baileys service. We try to auto-discover the machine's
+# public IP so the script works even when the server address changes.
+# Discovery is lazy: importing the module only reads the env/disk cache, and
+# the candidates are probed concurrently by BaileysUrlResolver in background.
+LEGACY_BAILEYS_URL = "http://78.46.250.112:3002"
+BAILEYS_URL_CACHE_FILE = os.environ.get("BAILEYS_URL_CACHE_FILE", "baileys_url.json")
+BAILEYS_DISCOVERY_TIMEOUT = _env_float("BAILEYS_DISCOVERY_TIMEOUT", 2.0)
+BAILEYS_REDISCOVERY_INTERVAL = _env_float("BAILEYS_REDISCOVERY_INTERVAL", 30.0)
+# Consecutive failed health checks before failing over to another candidate.
+BAILEYS_FAILOVER_THRESHOLD = _env_int("BAILEYS_FAILOVER_THRESHOLD", 2)
+
+
+def guess_public_baileys_url() -> Optional[str]:
+    """Return Baileys URL using the machine's public IP if available."""
+    try:
+        ip = requests.get("https://api.ipify.org", timeout=BAILEYS_DISCOVERY_TIMEOUT).text.strip()
+        return f"http://{ip}:3002"
+    except requests.RequestException:
+        return None
+
+
+def baileys_url_candidates() -> list:
+    """Candidates in priority order; callables are evaluated during discovery."""
+
+    return [
+        os.environ.get("API_BASE_URL"),
+        "http://127.0.0.1:3002",
+        "http://localhost:3002",
+        guess_public_baileys_url,
+        LEGACY_BAILEYS_URL,
+    ]
+
+
+class BaileysUrlResolver:
+    """Finds a healthy Baileys URL and keeps ``API_BASE_URL`` pointing at it.
+
+    ``initial_url`` never touches the network. ``resolve`` probes every
+    candidate in parallel and picks the highest-priority healthy one; the
+    winner is cached on disk only as the start-up hint for ``initial_url``,
+    so a healthy local service always wins over a remembered remote URL.
+    ``start`` runs discovery in a thread and re-resolves when the current
+    URL fails its health checks.
+    """
+
+    def __init__(self, candidates=None, cache_file: Optional[str] = BAILEYS_URL_CACHE_FILE,
+                 timeout: float = BAILEYS_DISCOVERY_TIMEOUT,
+                 interval: float = BAILEYS_REDISCOVERY_INTERVAL,
+                 failover_threshold: int = BAILEYS_FAILOVER_THRESHOLD):
+        self._candidates = candidates
+        self.cache_file = cache_file
+        self.timeout = timeout
+        self.interval = interval
+        self.failover_threshold = max(1, failover_threshold)
+        self.current: Optional[str] = None
+        self.resolved_at: Optional[str] = None
+        self.healthy = False
+        self.failovers = 0
+        self._failures = 0
+        self._listeners = []
+        self._lock = threading.Lock()
+        self._flight = _SingleFlight()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def candidates(self) -> list:
+        return list(self._candidates if self._candidates is not None else baileys_url_candidates())
+
+    def _read_cache(self) -> Optional[str]:
+        if not self.cache_file:
+            return None
+        try:
+            with open(self.cache_file, "r", encoding="utf-8") as handle:
+                url = json.load(handle).get("url")
+            return url if isinstance(url, str) and url.startswith(("http://", "https://")) else None
+        except (OSError, ValueError, AttributeError):
+            return None
+
+    def _write_cache(self, url: str) -> None:
+        if not self.cache_file:
+            return
+        try:
+            temp_path = f"{self.cache_file}.tmp"
+            with open(temp_path, "w", encoding="utf-8") as handle:
+                json.dump({"url": url, "resolved_at": datetime.now(timezone.utc).isoformat()}, handle)
+            os.replace(temp_path, self.cache_file)
+        except OSError as exc:
+            logger.debug("Não foi possível gravar cache da URL do Baileys: %s", exc)
+
+    def initial_url(self) -> str:
+        """Best guess without network access: env override, disk cache, then localhost."""
+
+        candidates = self.candidates()
+        cached = self._read_cache()
+        if cached:
+            candidates.insert(1 if candidates and candidates[0] else 0, cached)
+        for candidate in candidates:
+            if isinstance(candidate, str) and candidate:
+                self._set_current(candidate.rstrip('/'), announce=False)
+                return self.current
+        return LEGACY_BAILEYS_URL
+
+    def add_listener(self, callback) -> None:
+        """Register ``callback(old_url, new_url)`` for URL changes."""
+
+        self._listeners.append(callback)
+
+    def _set_current(self, url: str, announce: bool = True) -> None:
+        global API_BASE_URL
+        with self._lock:
+            previous = self.current
+            self.current = url
+            self.resolved_at = datetime.now(timezone.utc).isoformat()
+        API_BASE_URL = url
+        if announce and previous != url:
+            print(f"🔀 URL do Baileys: {previous} → {url}")
+            for callback in list(self._listeners):
+                try:
+                    callback(previous, url)
+                except Exception as exc:  # pragma: no cover - defensive logging
+                    logger.warning("Listener de URL do Baileys falhou: %s", exc)
+
+    def _probe(self, candidate) -> Optional[str]:
+        url = candidate() if callable(candidate) else candidate
+        if not url:
+            return None
+        url = url.rstrip('/')
+        http = _ensure_requests_dependency()
+        try:
+            response = http.get(f"{url}/health", timeout=self.timeout)
+        except http.RequestException:
+            return None
+        return url if response.status_code == 200 else None
+
+    def resolve(self, exclude: Optional[str] = None) -> Optional[str]:
+        """Probe all candidates concurrently and switch to the best healthy one.
+
+        Returns the selected URL, or ``None`` (keeping the current one) when no
+        candidate answered. Concurrent calls share one discovery round.
+        """
+
+        def discover():
+            candidates = []
+            for candidate in self.candidates():
+                if candidate and candidate not in candidates:
+                    candidates.append(candidate)
+            with ThreadPoolExecutor(max_workers=len(candidates) or 1,
+                                    thread_name_prefix="baileys-discovery") as pool:
+                futures = [pool.submit(self._probe, candidate) for candidate in candidates]
+                healthy = [future.result() for future in futures]
+            ordered = [url for url in healthy if url]
+            preferred = [url for url in ordered if url != exclude]
+            return (preferred or ordered or [None])[0]
+
+        url, _ = self._flight.do('resolve', discover)
+        if url:
+            self.healthy = True
+            self._failures = 0
+            self._set_current(url)
+            self._write_cache(url)
+            print(f"✅ Baileys service disponível em {url}")
+        else:
+            self.healthy = False
+            print(
+                "⚠️ Baileys service não acessível em nenhuma URL candidata; "
+                f"mantendo {self.current} e tentando novamente em segundo plano."
+            )
+        return url
+
+    def check(self) -> bool:
+        """Health-check the current URL and fail over after repeated failures."""
+
+        if self.current and _BAILEYS_CLIENT.health(self.current, force=True):
+            self.healthy = True
+            self._failures = 0
+            return True
+        self._failures += 1
+        if not self.healthy or self._failures >= self.failover_threshold:
+            previous = self.current
+            url = self.resolve(exclude=previous)
+            if url and url != previous:
+                self.failovers += 1
+            return bool(url)
+        return False
+
+    def start(self) -> None:
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="baileys-resolver", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _run(self) -> None:
+        self.resolve()
+        while not self._stop.wait(self.interval):
+            try:
+                self.check()
+            except Exception as exc:  # pragma: no cover - defensive logging
+                logger.warning("Falha ao verificar URL do Baileys: %s", exc)
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            'url': self.current,
+            'healthy': self.healthy,
+            'resolved_at': self.resolved_at,
+            'failovers': self.failovers,
+            'consecutive_failures': self._failures,
         }
-        
-        body {
+
+
+_BAILEYS_URL_RESOLVER = BaileysUrlResolver()
+
+
+def resolve_baileys_url() -> str:
+    """Probe the candidates now and return the selected Baileys URL."""
+    return _BAILEYS_URL_RESOLVER.resolve() or API_BASE_URL
+
+
+API_BASE_URL = _BAILEYS_URL_RESOLVER.initial_url()
+
+
+# Instance status monitor: one GET /status sweep fetches every instance state
+# from Baileys. The /api/whatsapp/status and /qr proxies are served from that
+# snapshot while it is younger than STATUS_CACHE_TTL; concurrent refreshes are
+# coalesced. The background loop keeps instances.connected in sync.
+STATUS_CACHE_TTL = _env_float("STATUS_CACHE_TTL", 0.75)
+STATUS_MONITOR_INTERVAL = _env_float("STATUS_MONITOR_INTERVAL", 2.0)
+STATUS_MONITOR_MAX_BACKOFF = _env_float("STATUS_MONITOR_MAX_BACKOFF", 30.0)
+
+
+class StatusMonitor:
+    """Caches the bulk Baileys ``/status`` answer and mirrors it into the DB."""
+
+    def __init__(self, client: Optional[BaileysClient] = None, ttl: float = STATUS_CACHE_TTL,
+                 interval: float = STATUS_MONITOR_INTERVAL, db_file: Optional[str] = None):
+        self.client = client or _BAILEYS_CLIENT
+        self.ttl = ttl
+        self.interval = interval
+        self.db_file = db_file
+        self._lock = threading.Lock()
+        self._flight = _SingleFlight()
+        self._snapshot: Dict[str, Dict[str, Any]] = {}
+        self._snapshot_error: Optional[str] = None
+        self._fetched_at = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+        self._counters = {'sweeps': 0, 'sweep_errors': 0, 'hits': 0, 'refreshes': 0, 'coalesced': 0}
+
+    def start(self) -> None:
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="status-monitor", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _run(self) -> None:
+        delay = self.interval
+        while not self._stop.is_set():
+            self.refresh(force=True)
+            if self._snapshot_error:
+                delay = min(max(delay, self.interval) * 2, STATUS_MONITOR_MAX_BACKOFF)
+            else:
+                delay = self.interval
+            self._stop.wait(delay)
+
+    def sweep(self) -> Dict[str, Dict[str, Any]]:
+        """Fetch all instance states from Baileys and store them as the snapshot."""
+
+        unknown: Set[str] = set()
+        try:
+            states, failed = self.client.status_all()
+            if not isinstance(states, dict):
+                raise BaileysError("Resposta inválida do serviço Baileys")
+            error = None
+            # A worker that did not answer has not lost its sessions
+            unknown = self.client.instances_on(failed)
+            if failed:
+                logger.warning("Status indisponível em %s; mantendo o último estado de %s instâncias",
+                               ", ".join(failed), len(unknown))
+        except BaileysError as exc:
+            states, error = None, str(exc)
+
+        with self._lock:
+            self._counters['sweeps'] += 1
+            self._fetched_at = time.monotonic()
+            self._snapshot_error = error
+            previous = self._snapshot
+            if error:
+                self._counters['sweep_errors'] += 1
+            else:
+                for instance_id in unknown:
+                    if instance_id in previous and instance_id not in states:
+                        states[instance_id] = previous[instance_id]
+                self._snapshot = states
+        if states is not None:
+            self._sync_database(states, unknown)
+            self._publish_changes(previous, states)
+        return self._snapshot
+
+    def _publish_changes(self, previous: Dict[str, Dict[str, Any]], states: Dict[str, Dict[str, Any]]) -> None:
+        """Push ``instance_status``/``qr`` events for instances whose state changed."""
+
+        for instance_id in set(previous) | set(states):
+            old = previous.get(instance_id) or {}
+            new = states.get(instance_id) or {}
+            if not isinstance(old, dict) or not isinstance(new, dict):
+                continue
+            if any(old.get(key) != new.get(key) for key in ('connected', 'connecting', 'user')):
+                publish_event({
+                    'type': 'instance_status',
+                    'instanceId': instance_id,
+                    'connected': bool(new.get('connected')),
+                    'connecting': bool(new.get('connecting')),
+                    'user': new.get('user'),
+                }, f"instance:{instance_id}")
+            if old.get('qr') != new.get('qr'):
+                publish_event({
+                    'type': 'qr',
+                    'instanceId': instance_id,
+                    'qr': new.get('qr'),
+                    'connected': bool(new.get('connected')),
+                    'expiresIn': 60 if new.get('qr') else 0,
+                }, f"qr:{instance_id}")
+
+    def refresh(self, force: bool = False) -> None:
+        """Sweep unless the snapshot is fresh; concurrent callers share one sweep."""
+
+        with self._lock:
+            fresh = time.monotonic() - self._fetched_at < self.ttl
+        if fresh and not force:
+            with self._lock:
+                self._counters['hits'] += 1
+            return
+        _, shared = self._flight.do('sweep', self.sweep)
+        with self._lock:
+            self._counters['coalesced' if shared else 'refreshes'] += 1
+
+    def _sync_database(self, states: Dict[str, Dict[str, Any]], unknown: Set[str] = frozenset()) -> None:
+        """Mirror ``connected`` into the instances table.
+
+        Instances in ``unknown`` (routed to a worker that did not answer) are
+        never marked disconnected.
+        """
+        connected_ids = json.dumps([
+            instance_id for instance_id, state in states.items()
+            if isinstance(state, dict) and state.get('connected')
+        ])
+        unknown_ids = json.dumps(sorted(unknown))
+        conn = None
+        try:
+            conn = get_db_connection(db_file=self.db_file)
+            changed = conn.execute(
+                """
+                UPDATE instances SET connected = 1
+                WHERE IFNULL(connected, 0) != 1 AND id IN (SELECT value FROM json_each(?))
+                """,
+                (connected_ids,),
+            ).rowcount
+            changed += conn.execute(
+                """
+                UPDATE instances SET connected = 0
+                WHERE IFNULL(connected, 0) != 0 AND id NOT IN (SELECT value FROM json_each(?))
+                AND id NOT IN (SELECT value FROM json_each(?))
+                """,
+                (connected_ids, unknown_ids),
+            ).rowcount
+            conn.commit()
+            if changed:
+                logger.info("🔄 Estado de conexão atualizado para %s instâncias", changed)
+        except sqlite3.Error as exc:
+            logger.warning("Não foi possível sincronizar instances.connected: %s", exc)
+        finally:
+            if conn:
+                conn.close()
+
+    def _state(self, instance_id: str) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        self.refresh()
+        with self._lock:
+            if self._snapshot_error:
+                return None, self._snapshot_error
+            return self._snapshot.get(instance_id), None
+
+    def get_status(self, instance_id: str) -> Dict[str, Any]:
+        """Status payload for ``instance_id`` in the shape of Baileys ``/status/<id>``."""
+
+        state, error = self._state(instance_id)
+        if error:
+            return {"connected": False, "connecting": False, "instanceId": instance_id}
+        state = state or {}
+        return {
+            "connected": bool(state.get('connected')),
+            "connecting": bool(state.get('connecting')),
+            "user": state.get('user'),
+            "instanceId": instance_id,
+            "lastSeen": state.get('lastSeen'),
+        }
+
+    def get_qr(self, instance_id: str) -> Dict[str, Any]:
+        """QR payload for ``instance_id`` in the shape of Baileys ``/qr/<id>``."""
+
+        state, error = self._state(instance_id)
+        if error:
+            return {"qr": None, "connected": False, "instanceId": instance_id}
+        if state is not None and 'qr' not in state:
+            # Older Baileys service without QR in the bulk status.
+            return self.client.qr(instance_id)
+        state = state or {}
+        qr = state.get('qr')
+        return {
+            "qr": qr,
+            "connected": bool(state.get('connected')),
+            "instanceId": instance_id,
+            "expiresIn": 60 if qr else 0,
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(
+                self._counters,
+                instances=len(self._snapshot),
+                age_seconds=round(time.monotonic() - self._fetched_at, 3) if self._fetched_at else None,
+                last_error=self._snapshot_error,
+                ttl=self.ttl,
+            )
+
+
+_STATUS_MONITOR = StatusMonitor()
+
+
+# HTML da aplicação (mesmo do Pure, mas com conexão real)
+HTML_APP = '''<!DOCTYPE html>
+<html lang="pt-BR">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>WhatsFlow Real - Sistema Profissional</title>
+    <style>
+        /* Professional WhatsFlow Design - Ultra Modern */
+        * { margin: 0; padding: 0; box-sizing: border-box; }
+        
+        :root {
+            --primary: #128c7e;
+            --primary-color: var(--primary);
+            --primary-dark: #075e54;
+            --primary-light: #25d366;
+            --bg-primary: #f0f2f5;
+            --bg-secondary: #ffffff;
+            --bg-chat: #e5ddd5;
+            --text-primary: #111b21;
+            --text-secondary: #667781;
+            --border: #e9edef;
+            --shadow: 0 1px 3px rgba(11,20,26,.13);
+            --shadow-lg: 0 2px 10px rgba(11,20,26,.2);
+            --gradient-primary: linear-gradient(135deg, var(--primary-dark) 0%, var(--primary) 100%);
+            --gradient-success: linear-gradient(135deg, var(--primary-light) 0%, var(--primary) 100%);
+        }
+        
+        body {
             font-family: 'Inter', -apple-system, BlinkMacSystemFont, 'Segoe UI', system-ui, sans-serif;
             background: #f8fafc;
             min-height: 100vh;
@@ -3867,6 +5244,7 @@ HTML_APP = '''<!DOCTYPE html>
                 <label style="display: block; margin-bottom: 5px; font-weight: 500;">Tipo de Agendamento:</label>
                 <select id="scheduleTypeSelect" class="form-input" onchange="handleGroupScheduleTypeChange()">
                     <option value="once">📅 Envio Único</option>
+                    <option value="daily">🔄 Diário (Recorrente)</option>
                     <option value="weekly">📅 Semanal (Recorrente)</option>
                 </select>
             </div>
@@ -4060,7 +5438,343 @@ HTML_APP = '''<!DOCTYPE html>
         let currentInstanceId = null;
         let qrPollingInterval = null;
         let statusPollingInterval = null;
+        let statsPollingInterval = null;
         let minioSettingsLoaded = false;
+
+        // Decoder for the binary (MessagePack) frames of the realtime channel
+        const msgpackText = new TextDecoder('utf-8');
+
+        function decodeMsgpack(buffer) {
+            const view = new DataView(buffer);
+            const bytes = new Uint8Array(buffer);
+            let offset = 0;
+
+            function text(length) {
+                const value = msgpackText.decode(bytes.subarray(offset, offset + length));
+                offset += length;
+                return value;
+            }
+
+            function binary(length) {
+                const value = bytes.slice(offset, offset + length);
+                offset += length;
+                return value;
+            }
+
+            function list(length) {
+                const value = new Array(length);
+                for (let i = 0; i < length; i++) value[i] = read();
+                return value;
+            }
+
+            function map(length) {
+                const value = {};
+                for (let i = 0; i < length; i++) {
+                    const key = read();
+                    value[key] = read();
+                }
+                return value;
+            }
+
+            function read() {
+                const type = bytes[offset++];
+                let value;
+                if (type < 0x80) return type;
+                if (type < 0x90) return map(type & 0x0f);
+                if (type < 0xa0) return list(type & 0x0f);
+                if (type < 0xc0) return text(type & 0x1f);
+                if (type >= 0xe0) return type - 0x100;
+                switch (type) {
+                    case 0xc0: return null;
+                    case 0xc2: return false;
+                    case 0xc3: return true;
+                    case 0xc4: value = view.getUint8(offset); offset += 1; return binary(value);
+                    case 0xc5: value = view.getUint16(offset); offset += 2; return binary(value);
+                    case 0xc6: value = view.getUint32(offset); offset += 4; return binary(value);
+                    case 0xca: value = view.getFloat32(offset); offset += 4; return value;
+                    case 0xcb: value = view.getFloat64(offset); offset += 8; return value;
+                    case 0xcc: value = view.getUint8(offset); offset += 1; return value;
+                    case 0xcd: value = view.getUint16(offset); offset += 2; return value;
+                    case 0xce: value = view.getUint32(offset); offset += 4; return value;
+                    case 0xcf: value = Number(view.getBigUint64(offset)); offset += 8; return value;
+                    case 0xd0: value = view.getInt8(offset); offset += 1; return value;
+                    case 0xd1: value = view.getInt16(offset); offset += 2; return value;
+                    case 0xd2: value = view.getInt32(offset); offset += 4; return value;
+                    case 0xd3: value = Number(view.getBigInt64(offset)); offset += 8; return value;
+                    case 0xd9: value = view.getUint8(offset); offset += 1; return text(value);
+                    case 0xda: value = view.getUint16(offset); offset += 2; return text(value);
+                    case 0xdb: value = view.getUint32(offset); offset += 4; return text(value);
+                    case 0xdc: value = view.getUint16(offset); offset += 2; return list(value);
+                    case 0xdd: value = view.getUint32(offset); offset += 4; return list(value);
+                    case 0xde: value = view.getUint16(offset); offset += 2; return map(value);
+                    case 0xdf: value = view.getUint32(offset); offset += 4; return map(value);
+                    default: throw new Error('Tipo MessagePack não suportado: ' + type);
+                }
+            }
+
+            return read();
+        }
+
+        // Realtime channel: topic subscriptions on the WebSocket server, or the
+        // /api/events SSE stream when WebSockets are unavailable. While it is
+        // open the polling timers stay off; they come back when it drops.
+        const realtime = {
+            socket: null,
+            stream: null,
+            mode: null,
+            connected: false,
+            topics: new Set(['instance:*', 'stats']),
+            handlers: {},
+            retryDelay: 1000,
+            socketFailures: 0,
+            lastEventId: null,
+            reopenTimer: null,
+
+            url() {
+                const scheme = window.location.protocol === 'https:' ? 'wss' : 'ws';
+                return `${scheme}://${window.location.hostname}:${window.WHATSFLOW_WS_PORT}`;
+            },
+
+            connect() {
+                // Fall back to SSE when there is no WebSocket server or it is unreachable
+                const useSocket = window.WHATSFLOW_WS_PORT && ('WebSocket' in window) && this.socketFailures < 3;
+                if (useSocket) {
+                    this.connectSocket();
+                } else if ('EventSource' in window) {
+                    this.connectStream();
+                }
+            },
+
+            connectSocket() {
+                let socket;
+                this.mode = 'ws';
+                try {
+                    socket = new WebSocket(this.url());
+                } catch (error) {
+                    this.socketFailures += 1;
+                    this.scheduleReconnect();
+                    return;
+                }
+                this.socket = socket;
+                socket.binaryType = 'arraybuffer';
+                socket.onopen = () => {
+                    this.socketFailures = 0;
+                    this.retryDelay = 1000;
+                    // Binary frames are smaller and cheaper to decode than JSON text
+                    if (typeof TextDecoder !== 'undefined' && typeof DataView.prototype.getBigUint64 === 'function') {
+                        this.send({ action: 'encoding', value: 'msgpack' });
+                    }
+                    this.send({ action: 'subscribe', topics: Array.from(this.topics) });
+                    this.setConnected(true);
+                };
+                socket.onmessage = (event) => this.dispatch(event.data);
+                socket.onclose = () => {
+                    if (!this.connected) this.socketFailures += 1;
+                    this.socket = null;
+                    this.setConnected(false);
+                    this.scheduleReconnect();
+                };
+            },
+
+            connectStream() {
+                if (this.stream) this.stream.close();
+                this.mode = 'sse';
+                let url = '/api/events?topics=' + encodeURIComponent(Array.from(this.topics).join(','));
+                if (this.lastEventId) url += '&since=' + encodeURIComponent(this.lastEventId);
+                const stream = new EventSource(url);
+                this.stream = stream;
+                stream.onopen = () => {
+                    this.retryDelay = 1000;
+                    this.setConnected(true);
+                };
+                stream.onmessage = (event) => {
+                    if (event.lastEventId) this.lastEventId = event.lastEventId;
+                    this.dispatch(event.data);
+                };
+                stream.addEventListener('ready', (event) => {
+                    // Never move the cursor backwards, or stats deltas get re-applied
+                    const cursor = Number(event.lastEventId);
+                    if (event.lastEventId && !(Number(this.lastEventId) > cursor)) {
+                        this.lastEventId = event.lastEventId;
+                    }
+                });
+                stream.addEventListener('reset', () => this.emit('open', {}));
+                stream.onerror = () => {
+                    // EventSource retries by itself unless the stream was closed for good
+                    this.setConnected(false);
+                    if (stream.readyState === EventSource.CLOSED && this.stream === stream) {
+                        this.stream = null;
+                        this.scheduleReconnect();
+                    }
+                };
+            },
+
+            setConnected(connected) {
+                if (this.connected === connected) return;
+                this.connected = connected;
+                this.emit(connected ? 'open' : 'close', {});
+            },
+
+            dispatch(raw) {
+                let data;
+                try {
+                    data = raw instanceof ArrayBuffer ? decodeMsgpack(raw) : JSON.parse(raw);
+                } catch (error) {
+                    return;
+                }
+                if (!data) return;
+                // Bursts arrive coalesced into a single batch frame
+                const events = data.type === 'batch' ? (data.events || []) : [data];
+                events.forEach(event => this.emit(event.type, event));
+            },
+
+            scheduleReconnect() {
+                setTimeout(() => this.connect(), this.retryDelay);
+                this.retryDelay = Math.min(this.retryDelay * 2, 30000);
+            },
+
+            send(payload) {
+                if (this.socket && this.socket.readyState === WebSocket.OPEN) {
+                    this.socket.send(JSON.stringify(payload));
+                }
+            },
+
+            reopenStream() {
+                // SSE topics live in the URL: reopen once after a burst of changes
+                if (this.mode !== 'sse' || !this.stream || this.reopenTimer) return;
+                this.reopenTimer = setTimeout(() => {
+                    this.reopenTimer = null;
+                    this.connectStream();
+                }, 0);
+            },
+
+            subscribe(topic) {
+                if (this.topics.has(topic)) return;
+                this.topics.add(topic);
+                this.send({ action: 'subscribe', topics: [topic] });
+                this.reopenStream();
+            },
+
+            unsubscribe(topic) {
+                if (topic && this.topics.delete(topic)) {
+                    this.send({ action: 'unsubscribe', topics: [topic] });
+                    this.reopenStream();
+                }
+            },
+
+            on(type, handler) {
+                (this.handlers[type] = this.handlers[type] || []).push(handler);
+            },
+
+            emit(type, data) {
+                (this.handlers[type] || []).forEach(handler => {
+                    try {
+                        handler(data);
+                    } catch (error) {
+                        console.error('Erro no evento em tempo real:', type, error);
+                    }
+                });
+            }
+        };
+
+        function startStatusPolling() {
+            if (realtime.connected || statusPollingInterval) return;
+            statusPollingInterval = setInterval(checkConnectionStatus, 5000);
+        }
+
+        function stopStatusPolling() {
+            if (statusPollingInterval) {
+                clearInterval(statusPollingInterval);
+                statusPollingInterval = null;
+            }
+        }
+
+        function startStatsPolling() {
+            if (realtime.connected || statsPollingInterval) return;
+            statsPollingInterval = setInterval(loadStats, 30000);
+        }
+
+        function stopStatsPolling() {
+            if (statsPollingInterval) {
+                clearInterval(statsPollingInterval);
+                statsPollingInterval = null;
+            }
+        }
+
+        function applyStatsDelta(delta) {
+            const fields = {
+                contacts_count: 'contacts-count',
+                conversations_count: 'conversations-count',
+                messages_count: 'messages-count'
+            };
+            Object.entries(fields).forEach(([key, elementId]) => {
+                const element = document.getElementById(elementId);
+                if (element && delta[key]) {
+                    element.textContent = (parseInt(element.textContent, 10) || 0) + delta[key];
+                }
+            });
+        }
+
+        realtime.on('open', () => {
+            stopStatusPolling();
+            stopStatsPolling();
+            if (qrInterval) {
+                clearInterval(qrInterval);
+                qrInterval = null;
+            }
+            if (messagesPollingInterval) {
+                clearInterval(messagesPollingInterval);
+                messagesPollingInterval = null;
+            }
+            // Catch up on whatever changed while polling was the only source
+            loadStats();
+            checkConnectionStatus();
+        });
+
+        realtime.on('close', () => {
+            startStatusPolling();
+            startStatsPolling();
+            if (currentQRInstance && !qrInterval) {
+                qrInterval = setInterval(loadQRCode, 3000);
+            }
+            if (currentChat) {
+                startMessagesAutoRefresh();
+            }
+        });
+
+        realtime.on('instance_status', (event) => {
+            checkConnectionStatus();
+            if (event.instanceId === currentQRInstance) {
+                loadQRCode();
+            }
+        });
+
+        realtime.on('qr', (event) => {
+            if (event.instanceId === currentQRInstance) {
+                loadQRCode();
+            }
+        });
+
+        realtime.on('stats_delta', (event) => applyStatsDelta(event.delta || {}));
+
+        let chatRefreshPending = false;
+
+        realtime.on('new_message', (event) => {
+            const message = event.message || {};
+            if (!currentChat || message.phone !== currentChat.phone || message.instance_id !== currentChat.instanceId) {
+                return;
+            }
+            // A batch frame can carry many messages of the open chat: reload once
+            if (chatRefreshPending) return;
+            chatRefreshPending = true;
+            setTimeout(() => {
+                chatRefreshPending = false;
+                if (currentChat) {
+                    loadChatMessages(currentChat.phone, currentChat.instanceId);
+                    loadConversations();
+                }
+            }, 0);
+        });
         let minioSettingsLoading = false;
 
         function selectSettingsTab(tabName) {
@@ -4337,9 +6051,12 @@ HTML_APP = '''<!DOCTYPE html>
                 console.error('❌ qrModal element not found');
             }
             
-            // Start QR polling
+            // QR and status changes are pushed over the realtime channel; poll only without it
+            realtime.subscribe(`qr:${instanceId}`);
             loadQRCode();
-            qrInterval = setInterval(loadQRCode, 3000); // Check every 3 seconds
+            if (!realtime.connected) {
+                qrInterval = setInterval(loadQRCode, 3000); // Check every 3 seconds
+            }
         }
 
         async function loadQRCode() {
@@ -4460,6 +6177,9 @@ HTML_APP = '''<!DOCTYPE html>
 
         function closeQRModal() {
             document.getElementById('qrModal').classList.remove('show');
+            if (currentQRInstance) {
+                realtime.unsubscribe(`qr:${currentQRInstance}`);
+            }
             currentQRInstance = null;
             
             // Stop QR polling
@@ -4628,6 +6348,7 @@ HTML_APP = '''<!DOCTYPE html>
         }
 
         let currentChat = null;
+        let currentChatTopic = null;
         let messagesPollingInterval = null;
 
         async function openChat(phone, contactName, instanceId) {
@@ -4647,7 +6368,7 @@ HTML_APP = '''<!DOCTYPE html>
             document.getElementById('messageInputArea').classList.add('active');
             
             // Load messages for this chat
-            await loadChatMessages(phone, instanceId);
+            await loadChatMessages(phone, instanceId, { full: true });
             
             // Start auto-refresh for this chat
             startMessagesAutoRefresh();
@@ -4657,13 +6378,32 @@ HTML_APP = '''<!DOCTYPE html>
             // Clear existing interval
             if (messagesPollingInterval) {
                 clearInterval(messagesPollingInterval);
+                messagesPollingInterval = null;
+            }
+
+            // New messages of the open chat are pushed over the realtime channel
+            const topic = currentChat ? `chat:${currentChat.instanceId}:${currentChat.phone}` : null;
+            if (topic !== currentChatTopic) {
+                realtime.unsubscribe(currentChatTopic);
+                currentChatTopic = topic;
+                if (topic) realtime.subscribe(topic);
             }
+            if (realtime.connected) return;
             
-            // Start polling every 3 seconds
-            messagesPollingInterval = setInterval(() => {
-                if (currentChat) {
-                    loadChatMessages(currentChat.phone, currentChat.instanceId);
+            // Start polling every 3 seconds; a tick only asks whether the chat moved
+            messagesPollingInterval = setInterval(async () => {
+                if (!currentChat) return;
+                const chat = currentChat;
+                try {
+                    const params = new URLSearchParams({ phone: chat.phone, instance_id: chat.instanceId, since: chatMessagesCursor });
+                    const response = await fetch(`/api/messages/changes?${params}`);
+                    const status = await response.json();
+                    if (!status.changed || chat !== currentChat) return;
+                    // Fewer messages than before: reload the whole conversation
+                    await loadChatMessages(chat.phone, chat.instanceId, { full: status.cursor < chatMessagesCursor });
                     loadConversations(); // Also refresh conversations list
+                } catch (error) {
+                    console.error('❌ Erro ao verificar mensagens novas:', error);
                 }
             }, 3000);
         }
@@ -4673,14 +6413,53 @@ HTML_APP = '''<!DOCTYPE html>
                 clearInterval(messagesPollingInterval);
                 messagesPollingInterval = null;
             }
+            realtime.unsubscribe(currentChatTopic);
+            currentChatTopic = null;
         }
         
-        async function loadChatMessages(phone, instanceId) {
+        // Delta sync of the open conversation: the highest message cursor shown
+        let chatMessagesKey = null;
+        let chatMessagesCursor = 0;
+
+        function renderMessageBubble(msg) {
+            return `
+                        <div class="message-bubble ${msg.direction}">
+                            <div class="message-content ${msg.direction}">
+                                <div class="message-text">${msg.message}</div>
+                                <div class="message-time">
+                                    ${new Date(msg.created_at).toLocaleTimeString('pt-BR', { 
+                                        hour: '2-digit', 
+                                        minute: '2-digit' 
+                                    })}
+                                </div>
+                            </div>
+                        </div>
+                    `;
+        }
+
+        async function loadChatMessages(phone, instanceId, options = {}) {
+            const key = `${instanceId}:${phone}`;
+            const incremental = !options.full && key === chatMessagesKey && chatMessagesCursor > 0;
             try {
-                const response = await fetch(`/api/messages?phone=${phone}&instance_id=${instanceId}`);
+                const params = new URLSearchParams({ phone, instance_id: instanceId });
+                if (incremental) params.set('since', chatMessagesCursor);
+                const response = await fetch(`/api/messages?${params}`);
                 const messages = await response.json();
                 
                 const container = document.getElementById('messagesContainer');
+                const newestCursor = messages.reduce((max, msg) => Math.max(max, msg.cursor || 0), 0);
+
+                if (incremental) {
+                    if (messages.length > 0) {
+                        container.insertAdjacentHTML('beforeend', messages.map(renderMessageBubble).join(''));
+                        chatMessagesCursor = Math.max(chatMessagesCursor, newestCursor);
+                        container.scrollTop = container.scrollHeight;
+                    }
+                    return;
+                }
+
+                chatMessagesKey = key;
+                chatMessagesCursor = newestCursor;
                 
                 if (messages.length === 0) {
                     container.innerHTML = `
@@ -4691,25 +6470,14 @@ HTML_APP = '''<!DOCTYPE html>
                         </div>
                     `;
                 } else {
-                    container.innerHTML = messages.map(msg => `
-                        <div class="message-bubble ${msg.direction}">
-                            <div class="message-content ${msg.direction}">
-                                <div class="message-text">${msg.message}</div>
-                                <div class="message-time">
-                                    ${new Date(msg.created_at).toLocaleTimeString('pt-BR', { 
-                                        hour: '2-digit', 
-                                        minute: '2-digit' 
-                                    })}
-                                </div>
-                            </div>
-                        </div>
-                    `).join('');
+                    container.innerHTML = messages.map(renderMessageBubble).join('');
                     
                     container.scrollTop = container.scrollHeight;
                 }
                 
             } catch (error) {
                 console.error('❌ Erro ao carregar mensagens:', error);
+                chatMessagesKey = null;
                 document.getElementById('messagesContainer').innerHTML = `
                     <div class="empty-chat-state">
                         <div style="color: red;">❌ Erro ao carregar mensagens</div>
@@ -4818,13 +6586,13 @@ HTML_APP = '''<!DOCTYPE html>
                         <div style="color: #9ca3af; font-size: 12px;">Adicionado: ${new Date(contact.created_at).toLocaleDateString()}</div>
                     </div>
                     <div style="display: flex; gap: 10px;">
-                        <button class="btn btn-primary" onclick="startChat('${contact.phone}', '${contact.name}')" style="padding: 8px 12px; font-size: 12px;">💬 Conversar</button>
+                        <button class="btn btn-primary" onclick="startChat('${contact.phone}', '${contact.name}', '${contact.instance_id || ''}')" style="padding: 8px 12px; font-size: 12px;">💬 Conversar</button>
                     </div>
                 </div>
             `).join('');
         }
 
-        function startChat(phone, name) {
+        function startChat(phone, name, instanceId = '') {
             const message = prompt(`💬 Enviar mensagem para ${name} (${phone}):`);
             if (message && message.trim()) {
                 const mediaUrl = prompt('🔗 URL da mídia (deixe em branco para enviar texto):', '')?.trim();
@@ -4832,13 +6600,16 @@ HTML_APP = '''<!DOCTYPE html>
                 if (mediaUrl) {
                     type = prompt('📎 Tipo da mídia (image, audio, video):', 'image') || 'image';
                 }
-                sendQuickMessage(phone, message.trim(), type, mediaUrl);
+                sendQuickMessage(phone, message.trim(), type, mediaUrl, instanceId);
             }
         }
 
-        async function sendQuickMessage(phone, message, type = 'text', mediaUrl = '') {
+        async function sendQuickMessage(phone, message, type = 'text', mediaUrl = '', instanceId = '') {
             try {
                 const payload = { to: phone, message: message, type: type };
+                if (instanceId) {
+                    payload.instanceId = instanceId;
+                }
                 if (mediaUrl && type !== 'text') {
                     payload.mediaUrl = mediaUrl;
                 }
@@ -5218,8 +6989,11 @@ HTML_APP = '''<!DOCTYPE html>
                 }
 
                 if (statusElement) {
+                    const speed = data.deduplicated
+                        ? ' (já estava armazenado)'
+                        : (data.throughputMBps ? ` (${data.throughputMBps} MB/s)` : '');
                     statusElement.style.color = '#16a34a';
-                    statusElement.textContent = `✅ ${file.name} enviado com sucesso!`;
+                    statusElement.textContent = `✅ ${file.name} enviado com sucesso!${speed}`;
                 } else {
                     alert('✅ Arquivo enviado');
                 }
@@ -5583,11 +7357,10 @@ HTML_APP = '''<!DOCTYPE html>
             checkConnectionStatus();
             loadInstancesForSelect(); // Load instances for message selector
             
-            // Start status polling
-            statusPollingInterval = setInterval(checkConnectionStatus, 5000);
-            
-            // Update stats every 30 seconds
-            setInterval(loadStats, 30000);
+            // Status and stats are pushed over the realtime channel; poll until it connects
+            startStatusPolling();
+            startStatsPolling();
+            realtime.connect();
             
             document.getElementById('createModal').addEventListener('click', function(e) {
                 if (e.target === this) this.classList.remove('show');
@@ -5601,7 +7374,8 @@ HTML_APP = '''<!DOCTYPE html>
         // Cleanup on page unload
         window.addEventListener('beforeunload', function() {
             if (qrPollingInterval) clearInterval(qrPollingInterval);
-            if (statusPollingInterval) clearInterval(statusPollingInterval);
+            stopStatusPolling();
+            stopStatsPolling();
         });
         
         // Groups Management Functions
@@ -6841,6 +8615,9 @@ HTML_APP = '''<!DOCTYPE html>
             } else if (scheduleType === 'weekly') {
                 dateDiv.style.display = 'none';
                 daysDiv.style.display = 'block';
+            } else {
+                dateDiv.style.display = 'none';
+                daysDiv.style.display = 'none';
             }
         }
         
@@ -7242,6 +9019,13 @@ HTML_APP = '''<!DOCTYPE html>
                 };
                 const dayLabels = days.map(day => dayNames[day] || day).join(', ');
                 return `🔄 Toda semana: ${dayLabels}`;
+            } else if (msg.schedule_type === 'daily') {
+                return `🔄 Todos os dias às ${msg.schedule_time}`;
+            } else if (msg.schedule_type === 'monthly') {
+                const days = JSON.parse(msg.schedule_days || '[]');
+                return `🔄 Todo mês: dia(s) ${days.join(', ')}`;
+            } else if (msg.schedule_type === 'cron') {
+                return `⏱️ Cron: ${msg.cron_expression || ''}`;
             }
             return 'Agendamento não definido';
         }
@@ -7871,16 +9655,82 @@ transform-api-response-and-mark-selected-groups-z0tcv8
 </html>'''
 
 # Inject API base URL from environment into the frontend
-HTML_APP = HTML_APP.replace(
-    "<body>",
-    f"<body><script>window.API_BASE_URL = {json.dumps(API_BASE_URL)}; window.WHATSFLOW_API_URL = window.location.origin;</script>",
-    1,
-)
+def render_html_app() -> str:
+    """Return HTML_APP with the Baileys URL selected at request time."""
+    if _BAILEYS_ROUTER is not None:
+        # Sharded workers are reached through the backend proxy.
+        base_url = "window.location.origin + '/api/baileys'"
+    else:
+        base_url = json.dumps(API_BASE_URL)
+    return HTML_APP.replace(
+        "<body>",
+        f"<body><script>window.API_BASE_URL = {base_url}; window.WHATSFLOW_API_URL = window.location.origin; "
+        f"window.WHATSFLOW_WS_PORT = {WEBSOCKET_PORT if WEBSOCKETS_AVAILABLE else 'null'};</script>",
+        1,
+    )
+
+def _ensure_columns(cursor, table: str, columns: Dict[str, str]) -> None:
+    """Add missing columns to an existing table (lightweight migration)."""
+
+    cursor.execute(f"PRAGMA table_info({table})")
+    existing = {row[1] for row in cursor.fetchall()}
+    for name, definition in columns.items():
+        if name not in existing:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {name} {definition}")
+
+
+def _ensure_unique_index(cursor, table: str, name: str, columns: Tuple[str, ...],
+                         where: Optional[str] = None, merge=None) -> None:
+    """Create a unique index, first dropping duplicate rows (the newest row is kept).
+
+    ``where`` limits the de-duplication to matching rows. ``merge(cursor)``,
+    when given, runs first to fold the duplicates into the row that is kept.
+    """
+
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?", (name,))
+    if cursor.fetchone():
+        return
+    column_list = ", ".join(columns)
+    condition = f"({where})" if where else "1"
+    if merge is not None:
+        merge(cursor)
+    cursor.execute(
+        f"DELETE FROM {table} WHERE {condition} AND rowid NOT IN "
+        f"(SELECT MAX(rowid) FROM {table} WHERE {condition} GROUP BY {column_list})"
+    )
+    if cursor.rowcount > 0:
+        logger.info("🧹 %s registros duplicados removidos de %s (%s)", cursor.rowcount, table, column_list)
+    cursor.execute(f"CREATE UNIQUE INDEX {name} ON {table} ({column_list})")
+
+
+def _merge_duplicate_chats(cursor) -> None:
+    """Fold duplicate chats into the newest row before the others are dropped.
+
+    Older imports keyed chats on uuids while the receive path used
+    ``{phone}_{instance}``, so one conversation can have several rows: the kept
+    row gets the most recent last message and the sum of the unread counts.
+    """
+    cursor.execute("""
+        SELECT instance_id, contact_phone, MAX(rowid), SUM(IFNULL(unread_count, 0))
+        FROM chats GROUP BY instance_id, contact_phone HAVING COUNT(*) > 1
+    """)
+    for instance_id, phone, keep_rowid, unread in cursor.fetchall():
+        last_message, last_message_time = cursor.execute("""
+            SELECT last_message, last_message_time FROM chats
+            WHERE instance_id IS ? AND contact_phone IS ?
+            ORDER BY last_message_time IS NULL, last_message_time DESC, rowid DESC
+            LIMIT 1
+        """, (instance_id, phone)).fetchone()
+        cursor.execute(
+            "UPDATE chats SET last_message = ?, last_message_time = ?, unread_count = ? WHERE rowid = ?",
+            (last_message, last_message_time, unread, keep_rowid),
+        )
+
 
 # Database setup (same as before but with WebSocket integration)
-def init_db():
+def init_db(db_file=None):
     """Initialize SQLite database with WAL mode for better concurrency"""
-    conn = sqlite3.connect(DB_FILE)
+    conn = sqlite3.connect(db_file or DB_FILE)
     cursor = conn.cursor()
     
     # Enable WAL mode for better concurrent access
@@ -7996,7 +9846,7 @@ def init_db():
             message_text TEXT,
             message_type TEXT DEFAULT 'text', -- text, image, audio, video
             media_url TEXT, -- URL for media files
-            schedule_type TEXT NOT NULL, -- once, weekly
+            schedule_type TEXT NOT NULL, -- once, daily, weekly, monthly, cron
             schedule_time TEXT NOT NULL, -- HH:MM format
             schedule_days TEXT, -- JSON array for weekly: ["monday", "tuesday"] or null for once
             schedule_date TEXT, -- YYYY-MM-DD for 'once' type
@@ -8006,6 +9856,56 @@ def init_db():
         )
     """)
     
+    _ensure_columns(cursor, "scheduled_messages", {
+        "cron_expression": "TEXT",  # five-field cron rule for schedule_type = 'cron'
+        "timezone": "TEXT",  # IANA zone; NULL uses SCHEDULER_TIMEZONE
+        "catch_up_policy": "TEXT",  # once, skip, spread; NULL uses SCHEDULER_CATCH_UP_POLICY
+        "claimed_by": "TEXT",  # scheduler node currently dispatching the row
+        "claimed_at": "REAL",  # unix time of the claim, used to recover stale claims
+        "claim_token": "INTEGER",  # fencing token of the claim
+    })
+
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS scheduler_leases (
+            name TEXT PRIMARY KEY,
+            holder TEXT,
+            fencing_token INTEGER NOT NULL DEFAULT 0,
+            expires_at REAL NOT NULL DEFAULT 0, -- unix time
+            renewed_at TEXT
+        )
+    """)
+
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS baileys_instance_routes (
+            instance_id TEXT PRIMARY KEY,
+            worker_id INTEGER NOT NULL, -- index of the Baileys worker process
+            assigned_at TEXT,
+            updated_at TEXT
+        )
+    """)
+
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS scheduler_metrics_hourly (
+            hour TEXT NOT NULL, -- UTC hour, ISO format
+            scope TEXT NOT NULL, -- all, instance, campaign
+            scope_id TEXT NOT NULL DEFAULT '',
+            dispatches INTEGER DEFAULT 0,
+            sent INTEGER DEFAULT 0,
+            failed INTEGER DEFAULT 0,
+            retries INTEGER DEFAULT 0,
+            lag_sum REAL DEFAULT 0,
+            lag_max REAL DEFAULT 0,
+            lag_p50 REAL DEFAULT 0,
+            lag_p99 REAL DEFAULT 0,
+            latency_sum REAL DEFAULT 0,
+            latency_max REAL DEFAULT 0,
+            lag_buckets TEXT, -- JSON counts per SCHEDULER_LAG_BUCKETS bucket
+            latency_buckets TEXT, -- JSON counts per SCHEDULER_LATENCY_BUCKETS bucket
+            updated_at TEXT,
+            PRIMARY KEY (hour, scope, scope_id)
+        )
+    """)
+
     # Create table for scheduled message groups relationship
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS scheduled_message_groups (
@@ -8032,10 +9932,38 @@ def init_db():
         )
     """)
 
-    try:
-        cursor.execute(
-            "SELECT key, value FROM settings WHERE key LIKE 'minio.%'"
-        )
+    # Content-addressed media per MinIO endpoint and bucket (see store_media_object)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS media_objects (
+            endpoint TEXT NOT NULL,
+            bucket TEXT NOT NULL,
+            sha256 TEXT NOT NULL,
+            object_name TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            content_type TEXT,
+            hits INTEGER DEFAULT 0, -- uploads answered without a transfer
+            created_at TEXT,
+            last_used_at TEXT,
+            PRIMARY KEY (endpoint, bucket, sha256)
+        )
+    """)
+
+    # One contact and one chat per number and instance; imports and inbound
+    # messages upsert on these keys.
+    _ensure_unique_index(cursor, "contacts", "idx_contacts_instance_phone", ("instance_id", "phone"))
+    _ensure_unique_index(cursor, "chats", "idx_chats_instance_phone", ("instance_id", "contact_phone"),
+                         merge=_merge_duplicate_chats)
+    # Redelivered inbound messages are skipped on this key (NULL ids never collide).
+    _ensure_unique_index(cursor, "messages", "idx_messages_instance_whatsapp_id",
+                         ("instance_id", "whatsapp_id"), where="whatsapp_id IS NOT NULL")
+    # Conversation reads and their ``since`` rowid cursor: the index carries the
+    # rowid, so "newer than N in this chat" is a range seek.
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_messages_phone_instance ON messages (phone, instance_id)")
+
+    try:
+        cursor.execute(
+            "SELECT key, value FROM settings WHERE key LIKE 'minio.%'"
+        )
         stored_settings = cursor.fetchall()
         if stored_settings:
             settings_map = {row[0]: row[1] for row in stored_settings}
@@ -8057,11 +9985,11 @@ def init_db():
     conn.close()
     print("✅ Banco de dados inicializado com suporte para Campanhas e WebSocket")
 
-def get_db_connection(timeout=60, max_retries=3):
+def get_db_connection(timeout=60, max_retries=3, db_file=None):
     """Get a standardized database connection with WAL mode and retry logic"""
     for attempt in range(max_retries):
         try:
-            conn = sqlite3.connect(DB_FILE, timeout=timeout)
+            conn = sqlite3.connect(db_file or DB_FILE, timeout=timeout)
             conn.execute('PRAGMA journal_mode=WAL')
             conn.execute('PRAGMA synchronous=NORMAL')
             conn.execute('PRAGMA cache_size=10000')
@@ -8078,40 +10006,435 @@ def get_db_connection(timeout=60, max_retries=3):
     raise sqlite3.OperationalError("Não foi possível conectar ao banco de dados após múltiplas tentativas")
 
 # WebSocket Server Functions
-if WEBSOCKETS_AVAILABLE:
-    async def websocket_handler(websocket, path):
-        """Handle WebSocket connections"""
-        websocket_clients.add(websocket)
-        logger.info(f"📱 Cliente WebSocket conectado. Total: {len(websocket_clients)}")
-        
+# Events are published from HTTP handler and worker threads and handed to the
+# WebSocket loop with call_soon_threadsafe. Each client has a bounded queue
+# drained by its own writer task: a full queue drops its oldest event, and a
+# client that cannot take a message within WEBSOCKET_SEND_TIMEOUT is closed.
+#
+# Clients pick what they receive by sending
+# {"action": "subscribe" | "unsubscribe", "topics": [...]}. Topics:
+#   instance:<id>              connection status changes (instance_status)
+#   qr:<id>                    QR code changes (qr)
+#   chat:<instance>:<phone>    messages of one conversation (new_message)
+#   campaign:<id>              scheduled dispatch results (campaign_progress)
+#   import:<instance>          chat import progress (chat_import_progress)
+#   stats                      dashboard counter deltas (stats_delta)
+# A trailing "*" matches by prefix ("chat:*"). Clients that never subscribe
+# receive every event, as before topics existed.
+#
+# Events published within WEBSOCKET_COALESCE_MS are flushed together: a client
+# gets one frame per flush, {"type": "batch", "events": [...]} when more than
+# one event matched, and stats deltas of the window are summed into one.
+# Frames are JSON text unless the client sends {"action": "encoding",
+# "value": "msgpack"}, after which they are binary MessagePack. Per-message
+# deflate is negotiated unless WEBSOCKET_COMPRESSION=none.
+WEBSOCKET_HOST = os.environ.get("WEBSOCKET_HOST", "0.0.0.0")
+WEBSOCKET_MAX_TOPICS = 100
+WEBSOCKET_CLIENT_QUEUE_SIZE = _env_int("WEBSOCKET_CLIENT_QUEUE_SIZE", 256)
+WEBSOCKET_SEND_TIMEOUT = _env_float("WEBSOCKET_SEND_TIMEOUT", 5.0)
+WEBSOCKET_COALESCE_MS = _env_int("WEBSOCKET_COALESCE_MS", 100)
+WEBSOCKET_COMPRESSION = os.environ.get("WEBSOCKET_COMPRESSION", "deflate").lower()
+WEBSOCKET_ENCODINGS = ("json", "msgpack")
+
+# The same events are kept in a ring buffer served by GET /api/events on the
+# HTTP port (SSE, or long-poll with a ``since`` cursor) for deployments
+# without the websockets package and for clients behind proxies.
+EVENT_LOG_SIZE = _env_int("EVENT_LOG_SIZE", 1000)
+EVENT_LONG_POLL_TIMEOUT = _env_float("EVENT_LONG_POLL_TIMEOUT", 25.0)
+EVENT_SSE_HEARTBEAT = _env_float("EVENT_SSE_HEARTBEAT", 15.0)
+
+
+def _topic_matches(patterns, topic: Optional[str]) -> bool:
+    """Exact or trailing-``*`` prefix match of ``topic`` against ``patterns``."""
+    if topic is None or topic in patterns:
+        return True
+    return any(pattern.endswith('*') and topic.startswith(pattern[:-1]) for pattern in patterns)
+
+
+def _msgpack_pack(obj: Any, out: bytearray) -> None:
+    """Append ``obj`` to ``out`` as MessagePack (the subset JSON values need)."""
+    if obj is None:
+        out.append(0xc0)
+    elif obj is True:
+        out.append(0xc3)
+    elif obj is False:
+        out.append(0xc2)
+    elif isinstance(obj, int) and -(1 << 63) <= obj < (1 << 64):
+        if 0 <= obj < 0x80:
+            out.append(obj)
+        elif -32 <= obj < 0:
+            out.append(obj & 0xff)
+        elif 0 <= obj < 0x100:
+            out += b'\xcc' + struct.pack('>B', obj)
+        elif 0 <= obj < 0x10000:
+            out += b'\xcd' + struct.pack('>H', obj)
+        elif 0 <= obj < 0x100000000:
+            out += b'\xce' + struct.pack('>I', obj)
+        elif obj >= 0:
+            out += b'\xcf' + struct.pack('>Q', obj)
+        elif -0x80 <= obj:
+            out += b'\xd0' + struct.pack('>b', obj)
+        elif -0x8000 <= obj:
+            out += b'\xd1' + struct.pack('>h', obj)
+        elif -0x80000000 <= obj:
+            out += b'\xd2' + struct.pack('>i', obj)
+        else:
+            out += b'\xd3' + struct.pack('>q', obj)
+    elif isinstance(obj, float):
+        out += b'\xcb' + struct.pack('>d', obj)
+    elif isinstance(obj, (bytes, bytearray)):
+        size = len(obj)
+        if size < 0x100:
+            out += b'\xc4' + struct.pack('>B', size)
+        elif size < 0x10000:
+            out += b'\xc5' + struct.pack('>H', size)
+        else:
+            out += b'\xc6' + struct.pack('>I', size)
+        out += obj
+    elif isinstance(obj, (list, tuple)):
+        size = len(obj)
+        if size < 16:
+            out.append(0x90 | size)
+        elif size < 0x10000:
+            out += b'\xdc' + struct.pack('>H', size)
+        else:
+            out += b'\xdd' + struct.pack('>I', size)
+        for item in obj:
+            _msgpack_pack(item, out)
+    elif isinstance(obj, dict):
+        size = len(obj)
+        if size < 16:
+            out.append(0x80 | size)
+        elif size < 0x10000:
+            out += b'\xde' + struct.pack('>H', size)
+        else:
+            out += b'\xdf' + struct.pack('>I', size)
+        for key, value in obj.items():
+            _msgpack_pack(key if isinstance(key, str) else str(key), out)
+            _msgpack_pack(value, out)
+    else:
+        # Same fallback as json.dumps(default=str)
+        data = (obj if isinstance(obj, str) else str(obj)).encode('utf-8')
+        size = len(data)
+        if size < 32:
+            out.append(0xa0 | size)
+        elif size < 0x100:
+            out += b'\xd9' + struct.pack('>B', size)
+        elif size < 0x10000:
+            out += b'\xda' + struct.pack('>H', size)
+        else:
+            out += b'\xdb' + struct.pack('>I', size)
+        out += data
+
+
+def encode_event_frame(event: Dict[str, Any], encoding: str = 'json'):
+    """Serialize one WebSocket frame: JSON text or MessagePack bytes."""
+    if encoding == 'msgpack':
+        out = bytearray()
+        _msgpack_pack(event, out)
+        return bytes(out)
+    return json.dumps(event, ensure_ascii=False, default=str)
+
+
+def _coalesce_events(pending: List[Tuple[Dict[str, Any], Optional[str]]]):
+    """Sum the ``stats_delta`` events of a flush window into the last one."""
+    totals: Dict[str, int] = {}
+    last_delta = None
+    for index, (event, _topic) in enumerate(pending):
+        if event.get('type') == 'stats_delta':
+            for key, value in (event.get('delta') or {}).items():
+                totals[key] = totals.get(key, 0) + value
+            last_delta = index
+    if last_delta is None:
+        return pending
+    merged = []
+    for index, (event, topic) in enumerate(pending):
+        if event.get('type') != 'stats_delta':
+            merged.append((event, topic))
+        elif index == last_delta:
+            merged.append((dict(event, delta=totals), topic))
+    return merged
+
+
+class _EventSubscriber:
+    """One WebSocket client with its outbound queue."""
+
+    def __init__(self, websocket, queue_size: int):
+        self.websocket = websocket
+        self.queue: "asyncio.Queue[str]" = asyncio.Queue(maxsize=max(1, queue_size))
+        self.topics: Set[str] = set()
+        self.subscribed = False
+        self.encoding = 'json'
+        self.sent = 0
+        self.dropped = 0
+
+    def wants(self, topic: Optional[str]) -> bool:
+        return not self.subscribed or _topic_matches(self.topics, topic)
+
+    def offer(self, message) -> bool:
+        """Queue ``message``, dropping the oldest one when full. False if one was dropped."""
+        dropped = False
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+            dropped = True
+        self.queue.put_nowait(message)
+        return not dropped
+
+
+class EventBus:
+    """Fans events out from any thread to the connected WebSocket clients."""
+
+    def __init__(self, queue_size: int = WEBSOCKET_CLIENT_QUEUE_SIZE,
+                 send_timeout: float = WEBSOCKET_SEND_TIMEOUT,
+                 coalesce_ms: int = WEBSOCKET_COALESCE_MS):
+        self.queue_size = queue_size
+        self.send_timeout = send_timeout
+        self.coalesce = max(0, coalesce_ms) / 1000.0
+        self.loop: Optional["asyncio.AbstractEventLoop"] = None
+        self._subscribers: Dict[Any, _EventSubscriber] = {}
+        self._pending: List[Tuple[Dict[str, Any], Optional[str]]] = []
+        self._flush_handle = None
+        self.published = 0
+        self.frames = 0
+        self.batched = 0
+        self.delivered = 0
+        self.dropped = 0
+        self.slow_disconnects = 0
+
+    def bind(self, loop) -> None:
+        self.loop = loop
+
+    @property
+    def client_count(self) -> int:
+        return len(self._subscribers)
+
+    def has_subscribers(self, topic: Optional[str] = None) -> bool:
+        """True when some connected client would receive an event on ``topic``."""
+        return any(subscriber.wants(topic) for subscriber in list(self._subscribers.values()))
+
+    def publish(self, event: Dict[str, Any], topic: Optional[str] = None) -> None:
+        """Queue ``event`` for the clients subscribed to ``topic``; safe from any thread."""
+        loop = self.loop
+        if loop is None or not self._subscribers or loop.is_closed():
+            return
+        if topic is not None:
+            event = dict(event, topic=topic)
+        self.published += 1
+        loop.call_soon_threadsafe(self._enqueue, event, topic)
+
+    def _enqueue(self, event: Dict[str, Any], topic: Optional[str]) -> None:
+        self._pending.append((event, topic))
+        if self.coalesce <= 0:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = self.loop.call_later(self.coalesce, self._flush)
+
+    def _flush(self) -> None:
+        self._flush_handle = None
+        pending, self._pending = _coalesce_events(self._pending), []
+        # Clients with the same subscriptions and encoding share one encoded frame
+        frames: Dict[Tuple[str, Tuple[int, ...]], Any] = {}
+        for subscriber in list(self._subscribers.values()):
+            selected = tuple(index for index, (_, topic) in enumerate(pending) if subscriber.wants(topic))
+            if not selected:
+                continue
+            key = (subscriber.encoding, selected)
+            frame = frames.get(key)
+            if frame is None:
+                if len(selected) == 1:
+                    payload = pending[selected[0]][0]
+                else:
+                    payload = {'type': 'batch', 'events': [pending[index][0] for index in selected]}
+                    self.batched += len(selected)
+                frame = frames[key] = encode_event_frame(payload, subscriber.encoding)
+                self.frames += 1
+            if not subscriber.offer(frame):
+                self.dropped += 1
+
+    def _handle_command(self, subscriber: _EventSubscriber, raw) -> None:
+        try:
+            command = json.loads(raw)
+        except (TypeError, ValueError):
+            return
+        if not isinstance(command, dict):
+            return
+        action = command.get('action')
+        topics = command.get('topics') or []
+        if isinstance(topics, str):
+            topics = [topics]
+        topics = {str(topic) for topic in topics if topic}
+        if action == 'subscribe':
+            subscriber.subscribed = True
+            subscriber.topics |= topics
+            while len(subscriber.topics) > WEBSOCKET_MAX_TOPICS:
+                subscriber.topics.pop()
+        elif action == 'unsubscribe':
+            subscriber.subscribed = True
+            subscriber.topics -= topics
+        elif action == 'encoding':
+            if command.get('value') in WEBSOCKET_ENCODINGS:
+                subscriber.encoding = command['value']
+            subscriber.offer(encode_event_frame({'type': 'encoding', 'value': subscriber.encoding},
+                                                subscriber.encoding))
+            return
+        elif action != 'ping':
+            return
+        subscriber.offer(encode_event_frame({
+            'type': 'pong' if action == 'ping' else 'subscriptions',
+            'topics': sorted(subscriber.topics),
+        }, subscriber.encoding))
+
+    async def serve(self, websocket) -> None:
+        """Register ``websocket`` and feed it until either side closes."""
+        subscriber = _EventSubscriber(websocket, self.queue_size)
+        self._subscribers[websocket] = subscriber
+        logger.info(f"📱 Cliente WebSocket conectado. Total: {self.client_count}")
+        writer = asyncio.ensure_future(self._write(subscriber))
         try:
-            await websocket.wait_closed()
+            async for raw in websocket:
+                self._handle_command(subscriber, raw)
         except websockets.exceptions.ConnectionClosed:
             pass
         finally:
-            websocket_clients.discard(websocket)
-            logger.info(f"📱 Cliente WebSocket desconectado. Total: {len(websocket_clients)}")
-
-    async def broadcast_message(message_data: Dict[str, Any]):
-        """Broadcast message to all connected WebSocket clients"""
-        if not websocket_clients:
-            return
-        
-        message = json.dumps(message_data)
-        disconnected_clients = set()
-        
-        for client in websocket_clients:
+            writer.cancel()
+            self._subscribers.pop(websocket, None)
+            logger.info(f"📱 Cliente WebSocket desconectado. Total: {self.client_count}")
+
+    async def _write(self, subscriber: _EventSubscriber) -> None:
+        websocket = subscriber.websocket
+        while True:
+            message = await subscriber.queue.get()
             try:
-                await client.send(message)
+                await asyncio.wait_for(websocket.send(message), self.send_timeout)
+            except asyncio.TimeoutError:
+                self.slow_disconnects += 1
+                self._subscribers.pop(websocket, None)
+                logger.warning("⚠️ Cliente WebSocket lento desconectado (%s pendentes)", subscriber.queue.qsize())
+                await websocket.close(code=1008, reason="slow consumer")
+                return
             except websockets.exceptions.ConnectionClosed:
-                disconnected_clients.add(client)
+                return
             except Exception as e:
                 logger.error(f"❌ Erro ao enviar mensagem WebSocket: {e}")
-                disconnected_clients.add(client)
-        
-        # Remove disconnected clients
-        for client in disconnected_clients:
-            websocket_clients.discard(client)
+                await websocket.close()
+                return
+            subscriber.sent += 1
+            self.delivered += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'clients': self.client_count,
+            'published': self.published,
+            'delivered': self.delivered,
+            'dropped': self.dropped,
+            'slow_disconnects': self.slow_disconnects,
+            'frames': self.frames,
+            'batched_events': self.batched,
+            'coalesce_ms': int(self.coalesce * 1000),
+            'compression': WEBSOCKET_COMPRESSION,
+            'encodings': dict(Counter(sub.encoding for sub in list(self._subscribers.values()))),
+            'queue_size': self.queue_size,
+            'send_timeout': self.send_timeout,
+            'queued': sum(sub.queue.qsize() for sub in list(self._subscribers.values())),
+            'subscriptions': sum(len(sub.topics) for sub in list(self._subscribers.values())),
+        }
+
+
+class EventLog:
+    """Ring buffer of recent events with sequence numbers for SSE and long-poll readers."""
+
+    def __init__(self, size: int = EVENT_LOG_SIZE):
+        self.size = max(1, size)
+        self._events: "deque[Tuple[int, Optional[str], str]]" = deque(maxlen=self.size)
+        self._cond = threading.Condition()
+        self._seq = 0
+        self.waiting = 0
+
+    @property
+    def cursor(self) -> int:
+        return self._seq
+
+    def append(self, event: Dict[str, Any], topic: Optional[str] = None) -> int:
+        if topic is not None:
+            event = dict(event, topic=topic)
+        message = json.dumps(event, ensure_ascii=False, default=str)
+        with self._cond:
+            self._seq += 1
+            self._events.append((self._seq, topic, message))
+            self._cond.notify_all()
+            return self._seq
+
+    def _collect(self, since: int, topics) -> Tuple[List[Tuple[int, str]], bool]:
+        # Caller holds the lock. ``missed`` is True when events after ``since``
+        # already fell out of the buffer (or the cursor predates a restart)
+        # and the reader has to resync.
+        missed = since > self._seq or (bool(self._events) and since < self._events[0][0] - 1)
+        matched = [
+            (seq, message) for seq, topic, message in self._events
+            if seq > since and (not topics or _topic_matches(topics, topic))
+        ]
+        return matched, missed
+
+    def wait(self, since: int, topics=None, timeout: float = EVENT_LONG_POLL_TIMEOUT):
+        """Block until events newer than ``since`` match ``topics`` or ``timeout`` passes.
+
+        Returns ``(events, cursor, missed)`` where ``events`` is a list of
+        ``(seq, json)`` pairs and ``cursor`` is the ``since`` for the next call.
+        """
+        deadline = time.monotonic() + max(0.0, timeout)
+        with self._cond:
+            self.waiting += 1
+            try:
+                while True:
+                    events, missed = self._collect(since, topics)
+                    remaining = deadline - time.monotonic()
+                    if events or missed or remaining <= 0:
+                        return events, self._seq, missed
+                    # Non-matching events still advance the cursor
+                    since = self._seq
+                    self._cond.wait(remaining)
+            finally:
+                self.waiting -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                'cursor': self._seq,
+                'buffered': len(self._events),
+                'size': self.size,
+                'waiting': self.waiting,
+            }
+
+
+_EVENT_BUS = EventBus()
+_EVENT_LOG = EventLog()
+
+
+def publish_event(event: Dict[str, Any], topic: Optional[str] = None) -> None:
+    """Broadcast ``event`` on ``topic`` to WebSocket clients and /api/events readers."""
+    _EVENT_LOG.append(event, topic)
+    _EVENT_BUS.publish(event, topic)
+
+
+def publish_stats_delta(**delta: int) -> None:
+    """Push changes of the dashboard counters (``/api/stats`` fields) to ``stats``."""
+    delta = {key: value for key, value in delta.items() if value}
+    if delta:
+        publish_event({'type': 'stats_delta', 'delta': delta}, 'stats')
+
+
+def publish_dispatch_event(record: Dict[str, Any]) -> None:
+    """Scheduler dispatch observer: campaign progress for ``campaign:<id>``."""
+    campaign_id = record.get('campaign_id')
+    if campaign_id:
+        publish_event(dict(record, type='campaign_progress'), f"campaign:{campaign_id}")
+
+
+if WEBSOCKETS_AVAILABLE:
+    async def websocket_handler(websocket, path=None):
+        """Handle WebSocket connections (``path`` is only passed by older websockets)"""
+        await _EVENT_BUS.serve(websocket)
 
     def start_websocket_server():
         """Start WebSocket server in a separate thread"""
@@ -8119,17 +10442,20 @@ if WEBSOCKETS_AVAILABLE:
             try:
                 loop = asyncio.new_event_loop()
                 asyncio.set_event_loop(loop)
+
+                async def serve():
+                    return await websockets.serve(
+                        websocket_handler, 
+                        WEBSOCKET_HOST, 
+                        WEBSOCKET_PORT,
+                        ping_interval=30,
+                        ping_timeout=10,
+                        compression=None if WEBSOCKET_COMPRESSION == 'none' else 'deflate'
+                    )
                 
-                start_server = websockets.serve(
-                    websocket_handler, 
-                    "localhost", 
-                    WEBSOCKET_PORT,
-                    ping_interval=30,
-                    ping_timeout=10
-                )
-                
+                loop.run_until_complete(serve())
+                _EVENT_BUS.bind(loop)
                 logger.info(f"🔌 WebSocket server iniciado na porta {WEBSOCKET_PORT}")
-                loop.run_until_complete(start_server)
                 loop.run_forever()
             except Exception as e:
                 logger.error(f"❌ Erro no WebSocket server: {e}")
@@ -8142,7 +10468,6 @@ else:
         print("⚠️ WebSocket não disponível - modo básico")
         return None
 
-
 def add_sample_data():
     with sqlite3.connect(DB_FILE, timeout=30) as conn:
         cursor = conn.cursor()
@@ -8163,61 +10488,44 @@ def add_sample_data():
         conn.commit()
 
 # Baileys Service Manager
-class BaileysManager:
-    def __init__(self):
-        self.process = None
-        self.is_running = False
-        self.baileys_dir = "baileys_service"
-        
-    def start_baileys(self):
-        """Start Baileys service"""
-        if self.is_running:
-            return True
-            
-        try:
-            print("📦 Configurando serviço Baileys...")
-            
-            # Create Baileys service directory
-            if not os.path.exists(self.baileys_dir):
-                os.makedirs(self.baileys_dir)
-                print(f"✅ Diretório {self.baileys_dir} criado")
-            
-            # Create package.json
-            package_json = {
-                "name": "whatsflow-baileys",
-                "version": "1.0.0",
-                "description": "WhatsApp Baileys Service for WhatsFlow",
-                "main": "server.js",
-                "engines": {
-                    "node": ">=20"
-                },
-                "dependencies": {
-                    "@whiskeysockets/baileys": "^6.7.0",
-                    "cors": "^2.8.5",
-                    "express": "^4.18.2",
-                    "node-fetch": "^2.6.7",
-                    "qrcode-terminal": "^0.12.0",
-                    "swagger-jsdoc": "^6.2.8",
-                    "swagger-ui-express": "^5.0.1"
-                },
-                "scripts": {
-                    "start": "node server.js"
-                }
-            }
-            
-            package_path = f"{self.baileys_dir}/package.json"
-            with open(package_path, 'w') as f:
-                json.dump(package_json, f, indent=2)
-            print("✅ package.json criado")
-            
-            # Create Baileys server
-            baileys_server = '''const express = require('express');
+# Baileys service provisioning. The generated files are only rewritten when
+# their content changes, and `npm install` only runs when package.json or the
+# lockfile differ from what the install marker recorded.
+BAILEYS_INSTALL_MARKER = ".whatsflow-install.json"
+BAILEYS_INSTALL_TIMEOUT = _env_int("BAILEYS_INSTALL_TIMEOUT", 300)
+BAILEYS_LOCKFILES = ("package-lock.json", "yarn.lock")
+
+BAILEYS_PACKAGE_JSON = {
+    "name": "whatsflow-baileys",
+    "version": "1.0.0",
+    "description": "WhatsApp Baileys Service for WhatsFlow",
+    "main": "server.js",
+    "engines": {
+        "node": ">=20"
+    },
+    "dependencies": {
+        "@whiskeysockets/baileys": "^6.7.0",
+        "cors": "^2.8.5",
+        "express": "^4.18.2",
+        "node-fetch": "^2.6.7",
+        "qrcode-terminal": "^0.12.0",
+        "swagger-jsdoc": "^6.2.8",
+        "swagger-ui-express": "^5.0.1"
+    },
+    "scripts": {
+        "start": "node server.js"
+    }
+}
+
+BAILEYS_SERVER_JS = '''const express = require('express');
 const cors = require('cors');
 const { DisconnectReason, useMultiFileAuthState, downloadMediaMessage } = require('@whiskeysockets/baileys');
 const makeWASocket = require('@whiskeysockets/baileys').default;
 const qrTerminal = require('qrcode-terminal');
 const fs = require('fs');
 const path = require('path');
+const http = require('http');
+const net = require('net');
 const swaggerUi = require('swagger-ui-express');
 const swaggerJsdoc = require('swagger-jsdoc');
 
@@ -8225,6 +10533,30 @@ const app = express();
 const PORT = process.env.PORT || 3002;
 const BODY_LIMIT = '15mb';
 const MAX_MEDIA_BYTES = 15 * 1024 * 1024;
+// Optional Unix-domain sockets: SOCKET_PATH is where this service listens for the
+// backend, WHATSFLOW_API_SOCKET is where the backend listens for our callbacks.
+const SOCKET_PATH = process.env.SOCKET_PATH || null;
+const BACKEND_API_URL = process.env.WHATSFLOW_API_URL || 'http://localhost:8889';
+const BACKEND_SOCKET = process.env.WHATSFLOW_API_SOCKET || null;
+
+class UnixSocketAgent extends http.Agent {
+    constructor(socketPath) {
+        super({ keepAlive: true });
+        this.socketPath = socketPath;
+    }
+
+    createConnection(options, callback) {
+        return net.createConnection(this.socketPath, callback);
+    }
+}
+
+const backendAgent = BACKEND_SOCKET ? new UnixSocketAgent(BACKEND_SOCKET) : new http.Agent({ keepAlive: true });
+
+// Calls back into the WhatsFlow backend, over its Unix socket when configured.
+async function backendFetch(pathname, options = {}) {
+    const fetch = (await import('node-fetch')).default;
+    return fetch(`${BACKEND_API_URL}${pathname}`, { ...options, agent: backendAgent });
+}
 
 app.use(cors({
     origin: '*',
@@ -8596,6 +10928,129 @@ const swaggerSpec = swaggerJsdoc({ definition: swaggerDefinition, apis: [] });
 app.use('/docs', swaggerUi.serve, swaggerUi.setup(swaggerSpec, { explorer: true }));
 app.get('/docs.json', (req, res) => res.json(swaggerSpec));
 
+// Inbound messages are buffered and posted to /api/messages/receive-batch when
+// INBOUND_BATCH_SIZE messages are waiting or the oldest is INBOUND_FLUSH_MS old.
+const INBOUND_BATCH_SIZE = parseInt(process.env.INBOUND_BATCH_SIZE || '50', 10);
+const INBOUND_FLUSH_MS = parseInt(process.env.INBOUND_FLUSH_MS || '250', 10);
+const INBOUND_MAX_BUFFER = 5000;
+let inboundBuffer = [];
+let inboundFlushTimer = null;
+let inboundFlushing = false;
+
+function queueInboundMessage(payload) {
+    if (inboundBuffer.length >= INBOUND_MAX_BUFFER) {
+        inboundBuffer.shift();
+        console.log('⚠️ Buffer de mensagens recebidas cheio; descartando a mais antiga');
+    }
+    inboundBuffer.push(payload);
+    if (inboundBuffer.length >= INBOUND_BATCH_SIZE) {
+        flushInboundMessages();
+    } else if (!inboundFlushTimer) {
+        inboundFlushTimer = setTimeout(flushInboundMessages, INBOUND_FLUSH_MS);
+    }
+}
+
+async function flushInboundMessages() {
+    if (inboundFlushTimer) {
+        clearTimeout(inboundFlushTimer);
+        inboundFlushTimer = null;
+    }
+    if (inboundFlushing || inboundBuffer.length === 0) {
+        return;
+    }
+    inboundFlushing = true;
+    const batch = inboundBuffer.splice(0, INBOUND_BATCH_SIZE);
+    try {
+        // Send to Python backend with retry logic
+        let retries = 3;
+        while (retries > 0) {
+            try {
+                const response = await backendFetch('/api/messages/receive-batch', {
+                    method: 'POST',
+                    headers: { 'Content-Type': 'application/json' },
+                    body: JSON.stringify({ messages: batch })
+                });
+                if (response.ok) {
+                    const result = await response.json().catch(() => ({}));
+                    if (Array.isArray(result.invalid) && result.invalid.length > 0) {
+                        console.log(`⚠️ ${result.invalid.length} mensagens inválidas rejeitadas pelo backend`);
+                    }
+                    break; // Success, exit retry loop
+                }
+                if (response.status >= 400 && response.status < 500) {
+                    // The same payload would be rejected again; do not retry
+                    console.log(`❌ Lote de ${batch.length} mensagens rejeitado pelo backend (HTTP ${response.status})`);
+                    break;
+                }
+                throw new Error(`HTTP ${response.status}`);
+            } catch (err) {
+                retries--;
+                console.log(`❌ Erro ao enviar ${batch.length} mensagens (tentativas restantes: ${retries}):`, err.message);
+                if (retries > 0) {
+                    await new Promise(resolve => setTimeout(resolve, 2000));
+                } else {
+                    console.log(`❌ ${batch.length} mensagens descartadas após falhas consecutivas`);
+                }
+            }
+        }
+    } finally {
+        inboundFlushing = false;
+        if (inboundBuffer.length >= INBOUND_BATCH_SIZE) {
+            flushInboundMessages();
+        } else if (inboundBuffer.length > 0 && !inboundFlushTimer) {
+            inboundFlushTimer = setTimeout(flushInboundMessages, INBOUND_FLUSH_MS);
+        }
+    }
+}
+
+// (instanceId, jid) -> name, so inbound messages without a pushName do not
+// cost a sock.onWhatsApp() round trip each. Insertion order doubles as LRU order.
+const CONTACT_NAME_CACHE_SIZE = parseInt(process.env.CONTACT_NAME_CACHE_SIZE || '5000', 10);
+const contactNames = new Map();
+
+function rememberContactName(instanceId, jid, name) {
+    const key = `${instanceId}:${jid}`;
+    contactNames.delete(key);
+    contactNames.set(key, name);
+    if (contactNames.size > CONTACT_NAME_CACHE_SIZE) {
+        contactNames.delete(contactNames.keys().next().value);
+    }
+    return name;
+}
+
+async function resolveContactName(sock, instanceId, jid) {
+    const key = `${instanceId}:${jid}`;
+    if (contactNames.has(key)) {
+        return rememberContactName(instanceId, jid, contactNames.get(key));
+    }
+    try {
+        const contact = await sock.onWhatsApp(jid);
+        return rememberContactName(instanceId, jid, contact[0]?.name || '');
+    } catch (err) {
+        return '';
+    }
+}
+
+// Initial chat import batch size; later batches follow the backend's recommendation.
+const CHAT_IMPORT_BATCH_SIZE = parseInt(process.env.CHAT_IMPORT_BATCH_SIZE || '200', 10);
+
+// Keep only what the backend stores for an imported chat.
+function summarizeChat(chat) {
+    const last = chat.messages && chat.messages.length ? chat.messages[chat.messages.length - 1] : null;
+    const lastContent = last && last.message ? last.message : null;
+    const timestamp = Number(chat.conversationTimestamp || 0);
+    return {
+        id: chat.id,
+        name: chat.name || chat.subject || null,
+        unreadCount: chat.unreadCount || 0,
+        lastMessage: lastContent ? (lastContent.conversation || lastContent.extendedTextMessage?.text || 'Mídia') : null,
+        lastMessageTime: timestamp > 0 ? new Date(timestamp * 1000).toISOString() : null
+    };
+}
+
+// Root for auth_<instanceId> folders; each worker process gets its own.
+const AUTH_ROOT = process.env.AUTH_ROOT || '.';
+
 // Global state management
 let instances = new Map(); // instanceId -> { sock, qr, connected, connecting, user }
 let currentQR = null;
@@ -8626,7 +11081,7 @@ async function connectInstance(instanceId) {
         console.log(`🔄 Iniciando conexão para instância: ${instanceId}`);
         
         // Create instance directory
-        const authDir = `./auth_${instanceId}`;
+        const authDir = path.join(AUTH_ROOT, `auth_${instanceId}`);
         if (!fs.existsSync(authDir)) {
             fs.mkdirSync(authDir, { recursive: true });
         }
@@ -8659,6 +11114,10 @@ async function connectInstance(instanceId) {
         sock.ev.on('connection.update', async (update) => {
             const { connection, lastDisconnect, qr } = update;
             const instance = instances.get(instanceId);
+            // Ignore sockets that were released or replaced (e.g. moved to another worker)
+            if (!instance || instance.sock !== sock) {
+                return;
+            }
             
             if (qr) {
                 console.log(`📱 Novo QR Code gerado para instância: ${instanceId}`);
@@ -8708,7 +11167,7 @@ async function connectInstance(instanceId) {
                     console.log(`❌ Instância ${instanceId} deslogada permanentemente`);
                     // Clean auth files if logged out
                     try {
-                        const authPath = path.join('./auth_' + instanceId);
+                        const authPath = path.join(AUTH_ROOT, 'auth_' + instanceId);
                         if (fs.existsSync(authPath)) {
                             fs.rmSync(authPath, { recursive: true, force: true });
                             console.log(`🧹 Arquivos de auth removidos para ${instanceId}`);
@@ -8720,8 +11179,7 @@ async function connectInstance(instanceId) {
                 
                 // Notify backend about disconnection
                 try {
-                    const fetch = (await import('node-fetch')).default;
-                    await fetch(`${process.env.WHATSFLOW_API_URL || 'http://localhost:8889'}/api/whatsapp/disconnected`, {
+                    await backendFetch('/api/whatsapp/disconnected', {
                         method: 'POST',
                         headers: { 'Content-Type': 'application/json' },
                         body: JSON.stringify({
@@ -8770,29 +11228,37 @@ async function connectInstance(instanceId) {
                         const chats = await sock.getChats();
                         console.log(`📊 ${chats.length} conversas encontradas`);
                         
-                        // Process chats in batches to avoid overwhelming the system
-                        const batchSize = 20;
-                        for (let i = 0; i < chats.length; i += batchSize) {
-                            const batch = chats.slice(i, i + batchSize);
+                        // Batches start at CHAT_IMPORT_BATCH_SIZE; the backend answers each one
+                        // with recommendedBatchSize, tuned to how long the upsert took.
+                        let batchSize = CHAT_IMPORT_BATCH_SIZE;
+                        let batchNumber = 0;
+                        for (let offset = 0; offset < chats.length;) {
+                            const batch = chats.slice(offset, offset + batchSize).map(summarizeChat);
+                            batchNumber += 1;
                             
                             // Send batch to Python backend
-                            const fetch = (await import('node-fetch')).default;
-                            await fetch(`${process.env.WHATSFLOW_API_URL || 'http://localhost:8889'}/api/chats/import`, {
+                            const response = await backendFetch('/api/chats/import', {
                                 method: 'POST',
                                 headers: { 'Content-Type': 'application/json' },
                                 body: JSON.stringify({
                                     instanceId: instanceId,
                                     chats: batch,
-                                    user: instance.user,
-                                    batchNumber: Math.floor(i / batchSize) + 1,
-                                    totalBatches: Math.ceil(chats.length / batchSize)
+                                    user: batchNumber === 1 ? instance.user : undefined,
+                                    batchNumber: batchNumber,
+                                    offset: offset,
+                                    totalChats: chats.length,
+                                    final: offset + batch.length >= chats.length
                                 })
                             });
+                            if (!response.ok) {
+                                throw new Error(`HTTP ${response.status} no lote ${batchNumber}`);
+                            }
+                            offset += batch.length;
                             
-                            console.log(`📦 Lote ${Math.floor(i / batchSize) + 1}/${Math.ceil(chats.length / batchSize)} enviado`);
-                            
-                            // Small delay between batches
-                            await new Promise(resolve => setTimeout(resolve, 1000));
+                            const result = await response.json().catch(() => ({}));
+                            if (result.recommendedBatchSize > 0) {
+                                batchSize = result.recommendedBatchSize;
+                            }
                         }
                         
                         console.log('✅ Importação de conversas concluída');
@@ -8805,8 +11271,7 @@ async function connectInstance(instanceId) {
                 // Send connected notification to Python backend
                 setTimeout(async () => {
                     try {
-                        const fetch = (await import('node-fetch')).default;
-                        await fetch(`${process.env.WHATSFLOW_API_URL || 'http://localhost:8889'}/api/whatsapp/connected`, {
+                        await backendFetch('/api/whatsapp/connected', {
                             method: 'POST',
                             headers: { 'Content-Type': 'application/json' },
                             body: JSON.stringify({
@@ -8843,46 +11308,25 @@ async function connectInstance(instanceId) {
                     
                     // Extract contact name from WhatsApp
                     const pushName = message.pushName || '';
-                    const contact = await sock.onWhatsApp(from);
-                    const contactName = pushName || contact[0]?.name || '';
+                    const contactName = pushName
+                        ? rememberContactName(instanceId, from, pushName)
+                        : await resolveContactName(sock, instanceId, from);
                     
                     console.log(`📥 Nova mensagem na instância ${instanceId}`);
                     console.log(`👤 Contato: ${contactName || from.split('@')[0]} (${from.split('@')[0]})`);
                     console.log(`💬 Mensagem: ${messageText.substring(0, 50)}...`);
                     
-                    // Send to Python backend with retry logic
-                    let retries = 3;
-                    while (retries > 0) {
-                        try {
-                            const fetch = (await import('node-fetch')).default;
-                            const response = await fetch(`${process.env.WHATSFLOW_API_URL || 'http://localhost:8889'}/api/messages/receive`, {
-                                method: 'POST',
-                                headers: { 'Content-Type': 'application/json' },
-                                body: JSON.stringify({
-                                    instanceId: instanceId,
-                                    from: from,
-                                    message: messageText,
-                                    pushName: pushName,
-                                    contactName: contactName,
-                                    timestamp: new Date().toISOString(),
-                                    messageId: message.key.id,
-                                    messageType: message.message.conversation ? 'text' : 'media'
-                                })
-                            });
-                            
-                            if (response.ok) {
-                                break; // Success, exit retry loop
-                            } else {
-                                throw new Error(`HTTP ${response.status}`);
-                            }
-                        } catch (err) {
-                            retries--;
-                            console.log(`❌ Erro ao enviar mensagem (tentativas restantes: ${retries}):`, err.message);
-                            if (retries > 0) {
-                                await new Promise(resolve => setTimeout(resolve, 2000));
-                            }
-                        }
-                    }
+                    // Buffered; flushed to the backend in batches
+                    queueInboundMessage({
+                        instanceId: instanceId,
+                        from: from,
+                        message: messageText,
+                        pushName: pushName,
+                        contactName: contactName,
+                        timestamp: new Date().toISOString(),
+                        messageId: message.key.id,
+                        messageType: message.message.conversation ? 'text' : 'media'
+                    });
                 }
             }
         });
@@ -8931,14 +11375,15 @@ app.get('/status/:instanceId?', (req, res) => {
             });
         }
     } else {
-        // Return all instances
+        // Return all instances (QR included so one sweep serves both proxies)
         const allInstances = {};
         for (const [id, instance] of instances) {
             allInstances[id] = {
                 connected: instance.connected,
                 connecting: instance.connecting,
                 user: instance.user,
-                lastSeen: instance.lastSeen
+                lastSeen: instance.lastSeen,
+                qr: instance.qr || null
             };
         }
         res.json(allInstances);
@@ -8998,6 +11443,28 @@ app.post('/disconnect/:instanceId', (req, res) => {
     }
 });
 
+// Close the socket without logging out so another worker can take the session over
+app.post('/release/:instanceId', (req, res) => {
+    const { instanceId } = req.params;
+    const instance = instances.get(instanceId);
+
+    if (!instance) {
+        return res.json({ success: true, released: false, instanceId: instanceId });
+    }
+
+    instances.delete(instanceId);
+    stopQRRefresh();
+    try {
+        if (instance.sock) {
+            instance.sock.end(undefined);
+        }
+    } catch (err) {
+        console.log(`⚠️ Erro ao liberar instância ${instanceId}:`, err.message);
+    }
+    console.log(`📦 Instância ${instanceId} liberada para outro worker`);
+    res.json({ success: true, released: true, instanceId: instanceId });
+});
+
 app.post('/send/:instanceId', async (req, res) => {
     const { instanceId } = req.params;
     const { to, message, type = 'text' } = req.body;
@@ -9136,80 +11603,217 @@ app.listen(PORT, '0.0.0.0', () => {
     console.log(`🚀 Baileys service rodando na porta ${PORT}`);
     console.log(`📊 Health check: http://localhost:${PORT}/health`);
     console.log('⏳ Aguardando comandos para conectar instâncias...');
-});'''
+});
+
+if (SOCKET_PATH) {
+    try {
+        fs.unlinkSync(SOCKET_PATH);
+    } catch (err) {
+        if (err.code !== 'ENOENT') {
+            console.log('⚠️ Não foi possível remover socket antigo:', err.message);
+        }
+    }
+    app.listen(SOCKET_PATH, () => {
+        fs.chmodSync(SOCKET_PATH, 0o660);
+        console.log(`🔌 Baileys service também disponível no socket ${SOCKET_PATH}`);
+    });
+}'''
+
+
+def _sha256_hex(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def _write_if_changed(path: str, content: str) -> bool:
+    """Write ``content`` to ``path`` unless the file already holds it. Returns True when written."""
+
+    data = content.encode("utf-8")
+    try:
+        with open(path, "rb") as handle:
+            if _sha256_hex(handle.read()) == _sha256_hex(data):
+                return False
+    except OSError:
+        pass
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "wb") as handle:
+        handle.write(data)
+    os.replace(temp_path, path)
+    return True
+
+
+BAILEYS_PORT = _env_int("BAILEYS_PORT", 3002)
+# Seconds to wait for /health after spawning node before counting a failed start.
+BAILEYS_READY_TIMEOUT = _env_float("BAILEYS_READY_TIMEOUT", 60.0)
+BAILEYS_RESTART_BACKOFF = _env_float("BAILEYS_RESTART_BACKOFF", 1.0)
+BAILEYS_RESTART_MAX_BACKOFF = _env_float("BAILEYS_RESTART_MAX_BACKOFF", 60.0)
+# A process that stayed up this long resets the backoff.
+BAILEYS_STABLE_SECONDS = _env_float("BAILEYS_STABLE_SECONDS", 60.0)
+BAILEYS_OUTPUT_TAIL_LINES = 200
+
+_baileys_logger = logging.getLogger("whatsflow.baileys")
+
+# Optional Unix-domain sockets between the backend and the co-located workers:
+# the backend reaches each worker on <dir>/baileys-<n>.sock and the workers post
+# their callbacks to <dir>/backend.sock, so local traffic skips TCP and never
+# depends on the URL picked by discovery. The TCP ports stay open for browsers.
+BAILEYS_UNIX_SOCKETS = bool(_env_int("BAILEYS_UNIX_SOCKETS", 0)) and hasattr(socket, "AF_UNIX")
+BAILEYS_SOCKET_DIR = os.environ.get("BAILEYS_SOCKET_DIR") or os.path.join(tempfile.gettempdir(), f"whatsflow-{PORT}")
+BACKEND_SOCKET_PATH = os.path.join(BAILEYS_SOCKET_DIR, "backend.sock")
+
+
+def ensure_private_dir(path: str) -> str:
+    """Create ``path`` with mode 0700, refusing one we do not own exclusively.
+
+    The default socket and cache directories have predictable names under the
+    shared temp dir, so another local user could create them first.
+    """
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode):
+        raise PermissionError(f"{path} não é um diretório")
+    if hasattr(os, "getuid") and info.st_uid != os.getuid():
+        raise PermissionError(f"{path} pertence a outro usuário (uid {info.st_uid})")
+    if stat.S_IMODE(info.st_mode) != 0o700:
+        raise PermissionError(f"{path} deve ter permissão 0700 (atual {stat.S_IMODE(info.st_mode):o})")
+    return path
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        request, _ = self.socket.accept()
+        # Unix peers have no address, but the handler logs client_address[0].
+        return request, ("unix", 0)
+
+
+_BACKEND_UNIX_SERVER: Optional[_UnixHTTPServer] = None
+_BACKEND_UNIX_SERVER_LOCK = threading.Lock()
+
+
+def start_backend_unix_server(path: str = BACKEND_SOCKET_PATH) -> Optional[_UnixHTTPServer]:
+    """Serve the backend API on the Unix socket ``path`` (once per process)."""
+
+    global _BACKEND_UNIX_SERVER
+    with _BACKEND_UNIX_SERVER_LOCK:
+        if _BACKEND_UNIX_SERVER is not None:
+            return _BACKEND_UNIX_SERVER
+        try:
+            ensure_private_dir(os.path.dirname(path))
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(path)
+            server = _UnixHTTPServer(path, WhatsFlowRealHandler)
+            os.chmod(path, 0o660)
+        except OSError as exc:
+            print(f"⚠️ Não foi possível abrir o socket do backend em {path}: {exc}")
+            return None
+        threading.Thread(target=server.serve_forever, name="backend-unix-socket", daemon=True).start()
+        _BACKEND_UNIX_SERVER = server
+        print(f"🔌 Backend também disponível no socket {path}")
+        return server
+
+
+def stop_backend_unix_server() -> None:
+    global _BACKEND_UNIX_SERVER
+    with _BACKEND_UNIX_SERVER_LOCK:
+        server, _BACKEND_UNIX_SERVER = _BACKEND_UNIX_SERVER, None
+    if server is not None:
+        server.shutdown()
+        server.server_close()
+        with contextlib.suppress(OSError):
+            os.unlink(server.server_address)
+
+
+class BaileysManager:
+    """Provisions the Node service and supervises the ``node server.js`` process.
+
+    A supervisor thread spawns the process, drains its stdout/stderr into
+    the logger (a full pipe would otherwise freeze the service), waits for
+    ``/health`` before declaring it ready and restarts it with exponential
+    backoff whenever it exits. With ``BAILEYS_UNIX_SOCKETS`` it also wires
+    both directions of the local traffic through Unix-domain sockets.
+    """
+
+    def __init__(self, worker_id: int = 0, port: Optional[int] = None, auth_root: Optional[str] = None):
+        self.process = None
+        self.is_running = False
+        self.baileys_dir = "baileys_service"
+        self.worker_id = worker_id
+        self.port = port or BAILEYS_PORT + worker_id
+        # Relative to baileys_dir; None keeps auth_<instance> folders in baileys_dir itself.
+        self.auth_root = auth_root
+        self.socket_path = (
+            os.path.join(BAILEYS_SOCKET_DIR, f"baileys-{worker_id}.sock") if BAILEYS_UNIX_SOCKETS else None
+        )
+        self.ready = False
+        self.restarts = 0
+        self.started_at: Optional[float] = None
+        self.last_exit_code: Optional[int] = None
+        self.last_exit_at: Optional[str] = None
+        self.output_tail = deque(maxlen=BAILEYS_OUTPUT_TAIL_LINES)
+        self._stop = threading.Event()
+        self._first_attempt = threading.Event()
+        self._supervisor = None
+        self._lock = threading.Lock()
+
+    @property
+    def tcp_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    @property
+    def local_url(self) -> str:
+        """URL the backend uses for this worker: its Unix socket when enabled."""
+        if self.socket_path:
+            return unix_socket_url(self.socket_path)
+        return self.tcp_url
+        
+    def start_baileys(self, provision: bool = True):
+        """Start Baileys service"""
+        if self.is_running:
+            return True
             
-            server_path = f"{self.baileys_dir}/server.js"
-            with open(server_path, 'w') as f:
-                f.write(baileys_server)
-            print("✅ server.js criado")
+        try:
+            print("📦 Configurando serviço Baileys...")
             
-            # Install dependencies
-            print("📦 Iniciando instalação das dependências...")
-            print("   Isso pode levar alguns minutos na primeira vez...")
+            # Create Baileys service directory
+            if not os.path.exists(self.baileys_dir):
+                os.makedirs(self.baileys_dir)
+                print(f"✅ Diretório {self.baileys_dir} criado")
             
-            try:
-                # Try npm first, then yarn
-                result = subprocess.run(['npm', 'install'], cwd=self.baileys_dir, 
-                                      capture_output=True, text=True, timeout=300)
-                if result.returncode != 0:
-                    print("⚠️ npm falhou, tentando yarn...")
-                    result = subprocess.run(['yarn', 'install'], cwd=self.baileys_dir, 
-                                          capture_output=True, text=True, timeout=300)
-                
-                if result.returncode == 0:
-                    print("✅ Dependências instaladas com sucesso!")
-                    # Install node-fetch specifically (required for backend communication)
-                    print("📦 Instalando node-fetch...")
-                    fetch_result = subprocess.run(['npm', 'install', 'node-fetch@2.6.7'], 
-                                                cwd=self.baileys_dir, capture_output=True, text=True)
-                    if fetch_result.returncode == 0:
-                        print("✅ node-fetch instalado com sucesso!")
-                    else:
-                        print("⚠️ Aviso: node-fetch pode não ter sido instalado corretamente")
-                else:
-                    print(f"❌ Erro na instalação: {result.stderr}")
-                    return False
-                    
-            except subprocess.TimeoutExpired:
-                print("⏰ Timeout na instalação - continuando mesmo assim...")
-            except FileNotFoundError:
-                print("❌ npm/yarn não encontrado. Por favor instale Node.js 20 ou superior e tente novamente.")
+            if provision and not self._provision():
                 return False
+
+            if self.socket_path:
+                try:
+                    ensure_private_dir(BAILEYS_SOCKET_DIR)
+                    start_backend_unix_server()
+                except OSError as exc:
+                    print(f"⚠️ Sockets Unix desativados, usando TCP: {exc}")
+                    self.socket_path = None
             
             # Start the service
             print("🚀 Iniciando serviço Baileys...")
-            try:
-                # Set environment variables for Node.js process
-                env = os.environ.copy()
-                env['WHATSFLOW_API_URL'] = f'http://localhost:{PORT}'
-                
-                self.process = subprocess.Popen(
-                    ['node', 'server.js'],
-                    cwd=self.baileys_dir,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                    text=True,
-                    env=env
-                )
-                
-                self.is_running = True
-                
-                # Wait a bit and check if it's still running
-                time.sleep(3)
-                if self.process.poll() is None:
-                    print("✅ Baileys iniciado com sucesso!")
-                    check_service_health(API_BASE_URL)
-                    return True
-                else:
-                    stdout, stderr = self.process.communicate()
-                    print(f"❌ Baileys falhou ao iniciar:")
-                    print(f"stdout: {stdout}")
-                    print(f"stderr: {stderr}")
-                    return False
-                    
-            except FileNotFoundError:
-                print("❌ Node.js não encontrado no sistema. Instale Node.js 20 ou superior para utilizar o WhatsApp real.")
+            self._stop.clear()
+            self._first_attempt.clear()
+            self.is_running = True
+            self._supervisor = threading.Thread(
+                target=self._supervise, name="baileys-supervisor", daemon=True
+            )
+            self._supervisor.start()
+
+            self._first_attempt.wait(BAILEYS_READY_TIMEOUT + 5)
+            if self.ready:
+                print("✅ Baileys iniciado com sucesso!")
+                if self.socket_path and self.worker_id == 0:
+                    # Unrouted calls go to the local socket instead of the discovered URL.
+                    _BAILEYS_CLIENT.transport_url = self.local_url
+                # The local service is up now; let discovery pick it if preferred.
+                _BAILEYS_URL_RESOLVER.resolve()
+                return True
+            if not self.is_running:
                 return False
+            print("⚠️ Baileys ainda não respondeu ao /health; o supervisor continuará tentando.")
+            return False
             
         except Exception as e:
             print(f"❌ Erro ao configurar Baileys: {e}")
@@ -9217,197 +11821,1823 @@ app.listen(PORT, '0.0.0.0', () => {
     
     def stop_baileys(self):
         """Stop Baileys service"""
-        if self.process:
+        # Same lock as the supervisor's spawn: either we see its process here,
+        # or it sees _stop right after spawning and terminates the child itself.
+        with self._lock:
+            self._stop.set()
+            process = self.process
+        self.is_running = False
+        if self.socket_path and _BAILEYS_CLIENT.transport_url == self.local_url:
+            _BAILEYS_CLIENT.transport_url = None
+        if process:
             try:
-                self.process.terminate()
-                self.process.wait(timeout=10)
+                process.terminate()
+                process.wait(timeout=10)
                 print("✅ Baileys parado com sucesso")
             except subprocess.TimeoutExpired:
-                self.process.kill()
+                process.kill()
                 print("⚠️ Baileys forçadamente terminado")
             
-            self.is_running = False
             self.process = None
+        if self._supervisor and self._supervisor is not threading.current_thread():
+            self._supervisor.join(timeout=5)
+        self.ready = False
+
+    def _spawn(self):
+        # Set environment variables for Node.js process
+        env = os.environ.copy()
+        env['WHATSFLOW_API_URL'] = f'http://localhost:{PORT}'
+        env['PORT'] = str(self.port)
+        if self.auth_root:
+            os.makedirs(os.path.join(self.baileys_dir, self.auth_root), exist_ok=True)
+            env['AUTH_ROOT'] = self.auth_root
+        if self.socket_path:
+            env['SOCKET_PATH'] = self.socket_path
+            if _BACKEND_UNIX_SERVER is not None:
+                env['WHATSFLOW_API_SOCKET'] = _BACKEND_UNIX_SERVER.server_address
+
+        process = subprocess.Popen(
+            ['node', 'server.js'],
+            cwd=self.baileys_dir,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            encoding='utf-8',
+            errors='replace',
+            bufsize=1,
+            env=env
+        )
+        for stream, level in ((process.stdout, logging.INFO), (process.stderr, logging.WARNING)):
+            threading.Thread(
+                target=self._drain, args=(stream, level), name="baileys-output", daemon=True
+            ).start()
+        return process
 
-# Message Scheduler for automated sending
-class MessageScheduler:
-    def __init__(self, api_base_url):
-        self.api_base_url = api_base_url
-        self.running = False
-        self.thread = None
-        
-    def start(self):
-        """Start the message scheduler"""
-        if not self.running:
-            self._sanitize_legacy_media_records()
-            self.running = True
-            self.thread = threading.Thread(target=self._run_scheduler, daemon=True)
-            self.thread.start()
-            print("✅ Message Scheduler iniciado")
+    def _drain(self, stream, level) -> None:
+        """Forward child output line by line so the pipe never fills up."""
 
-    def stop(self):
-        """Stop the message scheduler"""
-        self.running = False
-        if self.thread:
-            self.thread.join(timeout=5)
-        print("⏹️ Message Scheduler parado")
-    
-    def _run_scheduler(self):
-        """Main scheduler loop"""
-        while self.running:
-            try:
-                self._check_and_send_scheduled_messages()
-                time.sleep(30)  # Check every 30 seconds
-            except Exception as e:
-                print(f"❌ Erro no scheduler: {e}")
-                time.sleep(60)  # Wait longer on error
-    
-    def _check_and_send_scheduled_messages(self):
-        """Check for messages that need to be sent"""
-        conn = None
         try:
-            brazil_tz = pytz.timezone('America/Sao_Paulo')
-            now_brazil = datetime.now(brazil_tz)
+            for line in iter(stream.readline, ''):
+                line = line.rstrip()
+                if not line:
+                    continue
+                self.output_tail.append(line)
+                _baileys_logger.log(level, "[baileys-%s] %s", self.worker_id, line)
+        except (OSError, ValueError):
+            pass
+        finally:
+            stream.close()
 
-            # Use standardized database connection with retry logic
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            
-            # Get messages that need to be sent (next_run <= now and active)
-            cursor.execute("""
-                SELECT sm.*, smg.group_id, smg.group_name, smg.instance_id
+    def _wait_ready(self, process) -> bool:
+        deadline = time.monotonic() + BAILEYS_READY_TIMEOUT
+        while time.monotonic() < deadline and not self._stop.is_set():
+            if process.poll() is not None:
+                return False
+            if _BAILEYS_CLIENT.health(self.local_url, force=True):
+                return True
+            self._stop.wait(0.5)
+        return False
+
+    def _supervise(self) -> None:
+        failures = 0
+        while not self._stop.is_set():
+            try:
+                process = self._spawn()
+            except FileNotFoundError:
+                print("❌ Node.js não encontrado no sistema. Instale Node.js 20 ou superior para utilizar o WhatsApp real.")
+                self.is_running = False
+                self._first_attempt.set()
+                return
+
+            with self._lock:
+                stopping = self._stop.is_set()
+                if not stopping:
+                    self.process = process
+                    self.started_at = time.time()
+            if stopping:
+                # stop_baileys ran while we were spawning and could not see this child
+                process.terminate()
+                try:
+                    process.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+                    process.wait()
+                self._first_attempt.set()
+                return
+            self.ready = self._wait_ready(process)
+            if self.ready:
+                _baileys_logger.info("Baileys pronto (pid %s, reinícios: %s)", process.pid, self.restarts)
+            elif process.poll() is None and not self._stop.is_set():
+                _baileys_logger.warning("Baileys não respondeu ao /health em %.0fs; reiniciando", BAILEYS_READY_TIMEOUT)
+                process.kill()
+            self._first_attempt.set()
+
+            exit_code = process.wait()
+            uptime = time.time() - (self.started_at or time.time())
+            with self._lock:
+                self.ready = False
+                self.last_exit_code = exit_code
+                self.last_exit_at = datetime.now(timezone.utc).isoformat()
+                if self.process is process:
+                    self.process = None
+            if self._stop.is_set():
+                return
+
+            failures = 0 if uptime >= BAILEYS_STABLE_SECONDS else failures + 1
+            delay = min(BAILEYS_RESTART_MAX_BACKOFF, BAILEYS_RESTART_BACKOFF * (2 ** failures))
+            self.restarts += 1
+            print(
+                f"❌ Baileys encerrou (código {exit_code}) após {uptime:.0f}s; "
+                f"reiniciando em {delay:.1f}s (reinício #{self.restarts})"
+            )
+            for line in list(self.output_tail)[-10:]:
+                print(f"   {line}")
+            self._stop.wait(delay)
+
+    def auth_dir(self, instance_id: str) -> str:
+        """Folder holding the Baileys session files of ``instance_id`` on this worker."""
+        return os.path.join(self.baileys_dir, self.auth_root or '', f"auth_{instance_id}")
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            process = self.process
+            started_at = self.started_at
+        alive = process is not None and process.poll() is None
+        return {
+            'worker_id': self.worker_id,
+            'port': self.port,
+            'socket_path': self.socket_path,
+            'running': self.is_running,
+            'ready': self.ready,
+            'pid': process.pid if alive else None,
+            'restarts': self.restarts,
+            'uptime_seconds': round(time.time() - started_at, 1) if alive and started_at else 0.0,
+            'started_at': datetime.fromtimestamp(started_at, timezone.utc).isoformat() if started_at else None,
+            'last_exit_code': self.last_exit_code,
+            'last_exit_at': self.last_exit_at,
+            'recent_output': list(self.output_tail)[-20:],
+        }
+
+    def _provision(self) -> bool:
+        """Write the service files and install dependencies only when needed."""
+
+        started = time.perf_counter()
+        package_content = json.dumps(BAILEYS_PACKAGE_JSON, indent=2)
+        if _write_if_changed(os.path.join(self.baileys_dir, "package.json"), package_content):
+            print("✅ package.json atualizado")
+        else:
+            print("✅ package.json inalterado")
+        if _write_if_changed(os.path.join(self.baileys_dir, "server.js"), BAILEYS_SERVER_JS):
+            print("✅ server.js atualizado")
+        else:
+            print("✅ server.js inalterado")
+
+        if self._dependencies_installed():
+            print(f"✅ Dependências já instaladas (provisionamento em {time.perf_counter() - started:.1f}s)")
+            return True
+
+        if not self._install_dependencies():
+            return False
+        print(f"✅ Provisionamento concluído em {time.perf_counter() - started:.1f}s")
+        return True
+
+    def _dependency_hash(self) -> str:
+        """Hash of package.json plus whichever lockfile exists."""
+
+        digest = hashlib.sha256()
+        for name in ("package.json",) + BAILEYS_LOCKFILES:
+            path = os.path.join(self.baileys_dir, name)
+            try:
+                with open(path, "rb") as handle:
+                    content = handle.read()
+            except OSError:
+                continue
+            digest.update(name.encode("utf-8") + b"\0" + content + b"\0")
+        return digest.hexdigest()
+
+    def _dependencies_installed(self) -> bool:
+        """True when the install marker matches the manifests and node_modules is intact."""
+
+        marker_path = os.path.join(self.baileys_dir, BAILEYS_INSTALL_MARKER)
+        try:
+            with open(marker_path, "r", encoding="utf-8") as handle:
+                marker = json.load(handle)
+        except (OSError, ValueError):
+            return False
+        if not isinstance(marker, dict) or marker.get("hash") != self._dependency_hash():
+            return False
+
+        node_modules = os.path.join(self.baileys_dir, "node_modules")
+        for dependency in BAILEYS_PACKAGE_JSON["dependencies"]:
+            if not os.path.isfile(os.path.join(node_modules, *dependency.split("/"), "package.json")):
+                print(f"⚠️ Dependência ausente em node_modules: {dependency}")
+                return False
+        return True
+
+    def _install_dependencies(self) -> bool:
+        print("📦 Iniciando instalação das dependências...")
+        print("   Isso pode levar alguns minutos na primeira vez...")
+
+        try:
+            # Try npm first, then yarn
+            result = subprocess.run(['npm', 'install'], cwd=self.baileys_dir,
+                                    capture_output=True, text=True, timeout=BAILEYS_INSTALL_TIMEOUT)
+            if result.returncode != 0:
+                print("⚠️ npm falhou, tentando yarn...")
+                result = subprocess.run(['yarn', 'install'], cwd=self.baileys_dir,
+                                        capture_output=True, text=True, timeout=BAILEYS_INSTALL_TIMEOUT)
+
+            if result.returncode != 0:
+                print(f"❌ Erro na instalação: {result.stderr}")
+                return False
+        except subprocess.TimeoutExpired:
+            # No marker is written, so the next start retries the install.
+            print("⏰ Timeout na instalação - continuando mesmo assim...")
+            return True
+        except FileNotFoundError:
+            print("❌ npm/yarn não encontrado. Por favor instale Node.js 20 ou superior e tente novamente.")
+            return False
+
+        print("✅ Dependências instaladas com sucesso!")
+        marker = {
+            "hash": self._dependency_hash(),
+            "installed_at": datetime.now(timezone.utc).isoformat(),
+        }
+        _write_if_changed(os.path.join(self.baileys_dir, BAILEYS_INSTALL_MARKER), json.dumps(marker, indent=2))
+        return True
+
+# Worker pool: BAILEYS_WORKERS > 1 runs several `node server.js` processes, each
+# on its own port (BAILEYS_PORT + n) and auth folder. The instance -> worker
+# mapping lives in baileys_instance_routes and is used by BaileysClient, so the
+# proxies, the status monitor and the scheduler all reach the right worker.
+BAILEYS_WORKERS = max(1, _env_int("BAILEYS_WORKERS", 1))
+
+
+class BaileysWorkerPool:
+    """Starts, stops and reports on a set of supervised Baileys workers."""
+
+    def __init__(self, size: int = BAILEYS_WORKERS):
+        # Worker 0 keeps the legacy auth location so existing sessions survive.
+        self.workers = [
+            BaileysManager(worker_id=index, auth_root=None if index == 0 else f"workers/worker-{index}")
+            for index in range(max(1, size))
+        ]
+
+    @property
+    def is_running(self) -> bool:
+        return any(worker.is_running for worker in self.workers)
+
+    def start_baileys(self) -> bool:
+        primary = self.workers[0]
+        os.makedirs(primary.baileys_dir, exist_ok=True)
+        if not primary._provision():
+            return False
+
+        results = [False] * len(self.workers)
+
+        def start(index, worker):
+            results[index] = worker.start_baileys(provision=False)
+
+        threads = [
+            threading.Thread(target=start, args=(index, worker), daemon=True)
+            for index, worker in enumerate(self.workers)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        print(f"✅ {sum(results)}/{len(self.workers)} workers Baileys prontos")
+        return any(results)
+
+    def stop_baileys(self) -> None:
+        for worker in self.workers:
+            worker.stop_baileys()
+
+    def status(self) -> Dict[str, Any]:
+        workers = [worker.status() for worker in self.workers]
+        return {
+            'running': self.is_running,
+            'ready': all(worker['ready'] for worker in workers),
+            'restarts': sum(worker['restarts'] for worker in workers),
+            'workers': workers,
+        }
+
+
+class BaileysRouter:
+    """Persistent instance -> worker routing with least-loaded assignment."""
+
+    def __init__(self, pool: BaileysWorkerPool, db_file: Optional[str] = None):
+        self.pool = pool
+        self.db_file = db_file
+        self._lock = threading.Lock()
+        self._routes: Optional[Dict[str, int]] = None
+
+    @property
+    def workers(self):
+        return self.pool.workers
+
+    def worker_urls(self) -> list:
+        return [worker.local_url for worker in self.workers]
+
+    def instances_on(self, urls) -> Set[str]:
+        """Instance ids routed to the workers serving ``urls``."""
+        worker_ids = {worker.worker_id for worker in self.workers if worker.local_url in set(urls)}
+        with self._lock:
+            routes = dict(self._load())
+        return {instance_id for instance_id, worker_id in routes.items() if worker_id in worker_ids}
+
+    def _load(self) -> Dict[str, int]:
+        if self._routes is None:
+            conn = get_db_connection(db_file=self.db_file)
+            try:
+                rows = conn.execute("SELECT instance_id, worker_id FROM baileys_instance_routes").fetchall()
+            finally:
+                conn.close()
+            self._routes = {
+                instance_id: worker_id for instance_id, worker_id in rows
+                if 0 <= worker_id < len(self.workers)
+            }
+        return self._routes
+
+    def _save(self, instance_id: str, worker_id: int) -> None:
+        now = datetime.now(timezone.utc).isoformat()
+        conn = get_db_connection(db_file=self.db_file)
+        try:
+            conn.execute(
+                """
+                INSERT INTO baileys_instance_routes (instance_id, worker_id, assigned_at, updated_at)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(instance_id) DO UPDATE SET worker_id = excluded.worker_id,
+                                                       updated_at = excluded.updated_at
+                """,
+                (instance_id, worker_id, now, now),
+            )
+            conn.commit()
+        finally:
+            conn.close()
+        self._routes[instance_id] = worker_id
+
+    def _healthy(self, worker) -> bool:
+        return worker.ready and _BAILEYS_CLIENT.health(worker.local_url)
+
+    def loads(self) -> Dict[int, int]:
+        counts = {worker.worker_id: 0 for worker in self.workers}
+        for worker_id in self._load().values():
+            counts[worker_id] = counts.get(worker_id, 0) + 1
+        return counts
+
+    def _pick_worker(self, instance_id: str, healthy: List[int]) -> int:
+        # Caller holds the lock. A worker that already holds the session files keeps the instance.
+        for worker in self.workers:
+            if os.path.isdir(worker.auth_dir(instance_id)):
+                return worker.worker_id
+        loads = self.loads()
+        candidates = healthy or list(loads)
+        return min(candidates, key=lambda worker_id: (loads.get(worker_id, 0), worker_id))
+
+    def worker_for(self, instance_id: str):
+        with self._lock:
+            worker_id = self._load().get(instance_id)
+        if worker_id is None:
+            # Health checks are HTTP calls: run them before taking the lock so
+            # a new instance does not hold up routing for every other one.
+            healthy = [worker.worker_id for worker in self.workers if self._healthy(worker)]
+            with self._lock:
+                worker_id = self._load().get(instance_id)
+                if worker_id is None:
+                    worker_id = self._pick_worker(instance_id, healthy)
+                    self._save(instance_id, worker_id)
+                    logger.info("🧭 Instância %s atribuída ao worker %s", instance_id, worker_id)
+        return self.workers[worker_id]
+
+    def url_for(self, instance_id: str) -> str:
+        return self.worker_for(instance_id).local_url
+
+    def _move(self, instance_id: str, source, target) -> Dict[str, Any]:
+        if source.ready:
+            try:
+                _BAILEYS_CLIENT.request('release', 'POST', f"/release/{urllib.parse.quote(instance_id, safe='')}",
+                                        base_url=source.local_url, json={})
+            except BaileysError as exc:
+                logger.warning("Não foi possível liberar %s no worker %s: %s", instance_id, source.worker_id, exc)
+
+        had_session = False
+        source_dir, target_dir = source.auth_dir(instance_id), target.auth_dir(instance_id)
+        if os.path.isdir(source_dir) and not os.path.exists(target_dir):
+            os.makedirs(os.path.dirname(target_dir), exist_ok=True)
+            shutil.move(source_dir, target_dir)
+            had_session = True
+        with self._lock:
+            self._save(instance_id, target.worker_id)
+        if had_session:
+            try:
+                _BAILEYS_CLIENT.connect(instance_id, base_url=target.local_url)
+            except BaileysError as exc:
+                logger.warning("Falha ao reconectar %s no worker %s: %s", instance_id, target.worker_id, exc)
+        return {'instance_id': instance_id, 'from': source.worker_id, 'to': target.worker_id,
+                'session_moved': had_session}
+
+    def rebalance(self, dry_run: bool = False) -> Dict[str, Any]:
+        """Move instances off unhealthy workers and even out the healthy ones."""
+
+        with self._lock:
+            routes = dict(self._load())
+        healthy = {worker.worker_id for worker in self.workers if self._healthy(worker)}
+        if not healthy:
+            return {'moves': [], 'error': 'Nenhum worker saudável'}
+
+        loads = {worker_id: 0 for worker_id in healthy}
+        pending = []
+        for instance_id, worker_id in sorted(routes.items()):
+            if worker_id in healthy:
+                loads[worker_id] += 1
+            else:
+                pending.append((instance_id, worker_id))
+
+        limit = -(-len(routes) // len(healthy))  # ceil
+        for worker_id in sorted(healthy):
+            excess = loads[worker_id] - limit
+            if excess > 0:
+                owned = sorted(i for i, w in routes.items() if w == worker_id)
+                pending.extend((instance_id, worker_id) for instance_id in owned[:excess])
+                loads[worker_id] -= excess
+
+        moves = []
+        for instance_id, source_id in pending:
+            target_id = min(loads, key=lambda worker_id: (loads[worker_id], worker_id))
+            loads[target_id] += 1
+            if dry_run:
+                moves.append({'instance_id': instance_id, 'from': source_id, 'to': target_id})
+            else:
+                moves.append(self._move(instance_id, self.workers[source_id], self.workers[target_id]))
+        return {'moves': moves, 'dry_run': dry_run, 'loads': loads}
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            loads = self.loads()
+        workers = []
+        for worker in self.workers:
+            workers.append(dict(
+                worker.status(),
+                url=worker.local_url,
+                healthy=self._healthy(worker),
+                instances=loads.get(worker.worker_id, 0),
+            ))
+        return {'workers': workers, 'routes': sum(loads.values())}
+
+
+_BAILEYS_ROUTER: Optional[BaileysRouter] = None
+
+
+# Set by main() so the admin endpoints can report on the supervised process.
+_BAILEYS_MANAGER: Optional[BaileysManager] = None
+
+# Recurrence engine shared by the HTTP handlers and the MessageScheduler
+SCHEDULER_TIMEZONE = os.environ.get("SCHEDULER_TIMEZONE", "America/Sao_Paulo")
+SCHEDULE_TYPES = ("once", "daily", "weekly", "monthly", "cron")
+# What to do with occurrences missed while the backend was down:
+#   once   - fire a single time as soon as possible, then resume the rule
+#   skip   - drop the missed occurrence and wait for the next one
+#   spread - fire, but spread overdue schedules across SCHEDULER_CATCH_UP_SPREAD_SECONDS
+# The schedule form has no policy field, so the default decides for every
+# schedule created from the UI: spread, so an outage does not end in a burst.
+CATCH_UP_POLICIES = ("once", "skip", "spread")
+DEFAULT_CATCH_UP_POLICY = os.environ.get("SCHEDULER_CATCH_UP_POLICY", "spread")
+# Schedules later than this are considered missed and go through the catch-up policy.
+CATCH_UP_GRACE_SECONDS = _env_int("SCHEDULER_CATCH_UP_GRACE_SECONDS", 300)
+CATCH_UP_SPREAD_SECONDS = _env_int("SCHEDULER_CATCH_UP_SPREAD_SECONDS", 600)
+
+WEEKDAY_INDEX = {
+    'monday': 0, 'tuesday': 1, 'wednesday': 2, 'thursday': 3,
+    'friday': 4, 'saturday': 5, 'sunday': 6
+}
+_CRON_MONTH_NAMES = {
+    'jan': 1, 'feb': 2, 'mar': 3, 'apr': 4, 'may': 5, 'jun': 6,
+    'jul': 7, 'aug': 8, 'sep': 9, 'oct': 10, 'nov': 11, 'dec': 12,
+}
+_CRON_DAY_NAMES = {'sun': 0, 'mon': 1, 'tue': 2, 'wed': 3, 'thu': 4, 'fri': 5, 'sat': 6}
+# Upper bound for searching the next occurrence (covers Feb 29 style rules).
+_RECURRENCE_SEARCH_DAYS = 366 * 5
+
+_ZONE_CACHE: Dict[str, Any] = {}
+
+
+def get_schedule_timezone(name: Optional[str] = None):
+    """Return the ``ZoneInfo`` for ``name`` (defaults to SCHEDULER_TIMEZONE)."""
+
+    zone_name = (name or SCHEDULER_TIMEZONE or "UTC").strip()
+    zone = _ZONE_CACHE.get(zone_name)
+    if zone is None:
+        try:
+            zone = ZoneInfo(zone_name)
+        except (ZoneInfoNotFoundError, ValueError) as exc:
+            raise ValueError(f"Fuso horário inválido: {zone_name}") from exc
+        _ZONE_CACHE[zone_name] = zone
+    return zone
+
+
+def _localize_wall_time(naive: datetime, tz) -> datetime:
+    """Attach ``tz`` to a wall-clock time, resolving DST gaps and overlaps.
+
+    Ambiguous times (clocks turned back) resolve to the first occurrence.
+    Times that do not exist (clocks turned forward) are shifted forward by the
+    size of the gap, which is what a wall clock would show at that instant.
+    """
+
+    aware = naive.replace(tzinfo=tz, fold=0)
+    return aware.astimezone(timezone.utc).astimezone(tz)
+
+
+def _parse_schedule_time(schedule_time: Optional[str]) -> Tuple[int, int]:
+    try:
+        hour_text, minute_text = (schedule_time or '').strip().split(':')[:2]
+        hour, minute = int(hour_text), int(minute_text)
+    except (ValueError, AttributeError):
+        raise ValueError("Horário inválido. Use o formato HH:MM") from None
+    if not (0 <= hour <= 23 and 0 <= minute <= 59):
+        raise ValueError("Horário inválido. Use o formato HH:MM")
+    return hour, minute
+
+
+def _parse_schedule_days(schedule_days) -> list:
+    if schedule_days is None:
+        return []
+    if isinstance(schedule_days, str):
+        text = schedule_days.strip()
+        if not text:
+            return []
+        try:
+            schedule_days = json.loads(text)
+        except ValueError:
+            schedule_days = [part.strip() for part in text.split(',')]
+    if not isinstance(schedule_days, (list, tuple)):
+        return []
+    return [day for day in schedule_days if day not in (None, '')]
+
+
+class CronExpression:
+    """Minimal five-field cron expression (minute hour day month weekday).
+
+    Supports ``*``, lists, ranges, steps and month/weekday names. As in
+    classic cron, when both day-of-month and day-of-week are restricted a
+    day matches if either field matches.
+    """
+
+    _FIELDS = (
+        ('minute', 0, 59, None),
+        ('hour', 0, 23, None),
+        ('day', 1, 31, None),
+        ('month', 1, 12, _CRON_MONTH_NAMES),
+        ('weekday', 0, 7, _CRON_DAY_NAMES),
+    )
+
+    def __init__(self, expression: str):
+        self.expression = ' '.join((expression or '').split())
+        parts = self.expression.split(' ')
+        if len(parts) != 5:
+            raise ValueError("Expressão cron deve ter 5 campos: minuto hora dia mês dia-da-semana")
+
+        parsed = []
+        for text, (name, low, high, names) in zip(parts, self._FIELDS):
+            parsed.append(self._parse_field(text.lower(), name, low, high, names))
+        self.minutes, self.hours, self.days, self.months, weekdays = parsed
+        # Cron uses 0/7 = Sunday; Python's weekday() uses 6 = Sunday.
+        self.weekdays = {(value - 1) % 7 for value in weekdays}
+        self.day_restricted = not parts[2].startswith('*')
+        self.weekday_restricted = not parts[4].startswith('*')
+
+    @staticmethod
+    def _parse_field(text, name, low, high, names):
+        values = set()
+        for item in text.split(','):
+            step = 1
+            if '/' in item:
+                item, step_text = item.split('/', 1)
+                if not step_text.isdigit() or int(step_text) == 0:
+                    raise ValueError(f"Passo inválido no campo cron '{name}'")
+                step = int(step_text)
+
+            if item in ('*', ''):
+                start, end = low, high
+            elif '-' in item:
+                start_text, end_text = item.split('-', 1)
+                start = CronExpression._parse_value(start_text, name, low, high, names)
+                end = CronExpression._parse_value(end_text, name, low, high, names)
+            else:
+                start = CronExpression._parse_value(item, name, low, high, names)
+                end = high if step > 1 else start
+
+            if start > end:
+                raise ValueError(f"Intervalo inválido no campo cron '{name}'")
+            values.update(range(start, end + 1, step))
+        return values
+
+    @staticmethod
+    def _parse_value(text, name, low, high, names):
+        if names and text in names:
+            return names[text]
+        if not text.isdigit():
+            raise ValueError(f"Valor inválido no campo cron '{name}': {text}")
+        value = int(text)
+        if not low <= value <= high:
+            raise ValueError(f"Valor fora do intervalo no campo cron '{name}': {text}")
+        return value
+
+    def matches_day(self, day) -> bool:
+        if day.month not in self.months:
+            return False
+        day_match = day.day in self.days
+        weekday_match = day.weekday() in self.weekdays
+        if self.day_restricted and self.weekday_restricted:
+            return day_match or weekday_match
+        return day_match and weekday_match
+
+
+class RecurrenceRule:
+    """Compute occurrences of a scheduled message in its own timezone.
+
+    ``schedule_days`` holds weekday names for ``weekly`` rules and day numbers
+    (1-31, clamped to the month length) for ``monthly`` rules. ``monthly``
+    falls back to the day of ``schedule_date`` when no days are given.
+    Invalid definitions raise ``ValueError`` with a user facing message.
+    """
+
+    def __init__(
+        self,
+        schedule_type: str,
+        schedule_time: Optional[str] = None,
+        schedule_days=None,
+        schedule_date: Optional[str] = None,
+        cron_expression: Optional[str] = None,
+        tz_name: Optional[str] = None,
+    ):
+        self.schedule_type = (schedule_type or '').strip().lower()
+        if self.schedule_type not in SCHEDULE_TYPES:
+            raise ValueError("Tipo de agendamento inválido")
+
+        self.tz = get_schedule_timezone(tz_name)
+        self.hour = self.minute = 0
+        self.date = None
+        self.weekdays: Set[int] = set()
+        self.month_days: Set[int] = set()
+        self.cron: Optional[CronExpression] = None
+
+        if self.schedule_type == 'cron':
+            if not (cron_expression or '').strip():
+                raise ValueError("Expressão cron é obrigatória para agendamentos cron")
+            self.cron = CronExpression(cron_expression)
+            return
+
+        self.hour, self.minute = _parse_schedule_time(schedule_time)
+        days = _parse_schedule_days(schedule_days)
+
+        if schedule_date:
+            try:
+                self.date = datetime.strptime(str(schedule_date).strip(), '%Y-%m-%d').date()
+            except ValueError:
+                raise ValueError("Data inválida. Use o formato AAAA-MM-DD") from None
+
+        if self.schedule_type == 'once':
+            if self.date is None:
+                raise ValueError("Data é obrigatória para envio único")
+        elif self.schedule_type == 'weekly':
+            if not days:
+                raise ValueError("Pelo menos um dia da semana é obrigatório")
+            self.weekdays = {
+                WEEKDAY_INDEX[str(day).lower()] for day in days if str(day).lower() in WEEKDAY_INDEX
+            }
+            if not self.weekdays:
+                raise ValueError("Dias da semana inválidos")
+        elif self.schedule_type == 'monthly':
+            for day in days:
+                try:
+                    value = int(day)
+                except (TypeError, ValueError):
+                    raise ValueError("Dias do mês inválidos") from None
+                if not 1 <= value <= 31:
+                    raise ValueError("Dias do mês inválidos")
+                self.month_days.add(value)
+            if not self.month_days:
+                if self.date is None:
+                    raise ValueError("Informe os dias do mês ou uma data de referência")
+                self.month_days = {self.date.day}
+
+    @classmethod
+    def from_row(cls, row: Dict[str, Any]) -> "RecurrenceRule":
+        """Build a rule from a ``scheduled_messages`` row mapping."""
+
+        return cls(
+            row.get('schedule_type'),
+            row.get('schedule_time'),
+            row.get('schedule_days'),
+            row.get('schedule_date'),
+            row.get('cron_expression'),
+            row.get('timezone'),
+        )
+
+    @property
+    def is_recurring(self) -> bool:
+        return self.schedule_type != 'once'
+
+    def next_after(self, after: Optional[datetime] = None) -> Optional[datetime]:
+        """Return the first occurrence strictly after ``after`` (default: now)."""
+
+        after = (after or datetime.now(timezone.utc)).astimezone(self.tz)
+
+        if self.schedule_type == 'once':
+            occurrence = _localize_wall_time(
+                datetime.combine(self.date, datetime.min.time()).replace(
+                    hour=self.hour, minute=self.minute
+                ),
+                self.tz,
+            )
+            return occurrence if occurrence > after else None
+
+        start_day = after.date()
+        for offset in range(_RECURRENCE_SEARCH_DAYS):
+            day = start_day + timedelta(days=offset)
+            if not self._matches_day(day):
+                continue
+            for hour, minute in self._times_of_day():
+                naive = datetime(day.year, day.month, day.day, hour, minute)
+                occurrence = _localize_wall_time(naive, self.tz)
+                if occurrence > after:
+                    return occurrence
+        return None
+
+    def _matches_day(self, day) -> bool:
+        if self.schedule_type == 'daily':
+            return True
+        if self.schedule_type == 'weekly':
+            return day.weekday() in self.weekdays
+        if self.schedule_type == 'monthly':
+            last_day = calendar.monthrange(day.year, day.month)[1]
+            return any(min(value, last_day) == day.day for value in self.month_days)
+        return self.cron.matches_day(day)
+
+    def _times_of_day(self):
+        if self.cron is None:
+            return ((self.hour, self.minute),)
+        return ((hour, minute) for hour in sorted(self.cron.hours) for minute in sorted(self.cron.minutes))
+
+
+def compute_next_run(
+    schedule_type: str,
+    schedule_time: Optional[str] = None,
+    schedule_days=None,
+    schedule_date: Optional[str] = None,
+    cron_expression: Optional[str] = None,
+    tz_name: Optional[str] = None,
+    after: Optional[datetime] = None,
+) -> Optional[str]:
+    """Return the next run as an ISO string, or ``None`` when there is none.
+
+    Raises ``ValueError`` when the schedule definition is invalid.
+    """
+
+    rule = RecurrenceRule(
+        schedule_type, schedule_time, schedule_days, schedule_date, cron_expression, tz_name
+    )
+    occurrence = rule.next_after(after)
+    return occurrence.isoformat() if occurrence else None
+
+
+def normalize_catch_up_policy(policy: Optional[str]) -> str:
+    """Validate a catch-up policy, falling back to the configured default."""
+
+    if policy is None or not str(policy).strip():
+        return DEFAULT_CATCH_UP_POLICY if DEFAULT_CATCH_UP_POLICY in CATCH_UP_POLICIES else 'spread'
+    normalized = str(policy).strip().lower()
+    if normalized not in CATCH_UP_POLICIES:
+        raise ValueError("Política de recuperação inválida (use once, skip ou spread)")
+    return normalized
+
+
+def recompute_next_runs(conn, *, only_missing: bool = False, after: Optional[datetime] = None,
+                        keep_future: bool = False) -> int:
+    """Recompute ``next_run`` for every active schedule in one pass.
+
+    With ``only_missing`` only rows without a ``next_run`` are touched; with
+    ``keep_future`` rows whose ``next_run`` is still ahead of ``after`` (or
+    now) are left alone, which preserves pending failure retries. Rows whose
+    rule no longer yields an occurrence are deactivated. Returns the number
+    of updated rows; the caller owns the transaction.
+    """
+
+    conn_row_factory = conn.row_factory
+    conn.row_factory = sqlite3.Row
+    try:
+        query = """
+            SELECT id, schedule_type, schedule_time, schedule_days, schedule_date,
+                   cron_expression, timezone
+            FROM scheduled_messages
+            WHERE is_active = 1
+        """
+        params: List[Any] = []
+        if only_missing:
+            query += " AND (next_run IS NULL OR TRIM(next_run) = '')"
+        elif keep_future:
+            query += " AND (next_run IS NULL OR TRIM(next_run) = '' OR datetime(next_run) <= datetime(?))"
+            params.append((after or datetime.now(timezone.utc)).isoformat())
+        rows = [dict(row) for row in conn.execute(query, params).fetchall()]
+    finally:
+        conn.row_factory = conn_row_factory
+
+    updates = []
+    for row in rows:
+        try:
+            next_run = RecurrenceRule.from_row(row).next_after(after)
+        except ValueError as exc:
+            logger.warning("Agendamento %s com regra inválida: %s", row['id'], exc)
+            next_run = None
+        updates.append((
+            next_run.isoformat() if next_run else None,
+            1 if next_run else 0,
+            row['id'],
+        ))
+
+    if updates:
+        conn.executemany(
+            "UPDATE scheduled_messages SET next_run = ?, is_active = ? WHERE id = ?",
+            updates,
+        )
+    return len(updates)
+
+
+class SystemClock:
+    """Real time source used by the scheduler in production."""
+
+    def now(self) -> datetime:
+        return datetime.now(timezone.utc)
+
+    def time(self) -> float:
+        return time.time()
+
+    def sleep(self, seconds: float) -> None:
+        time.sleep(seconds)
+
+
+class TimeWarpClock:
+    """Clock for simulations: idle sleeps are skipped, real work still takes time.
+
+    ``now()`` is the simulated start plus the real time elapsed since creation
+    plus every ``sleep`` so far. Waits between scheduler ticks are therefore
+    instantaneous, while time spent sending or querying the database still
+    counts toward dispatch lag.
+    """
+
+    def __init__(self, start: datetime):
+        self._start = start.astimezone(timezone.utc)
+        self._real_start = time.perf_counter()
+        self._warp = 0.0
+        self._lock = threading.Lock()
+
+    def now(self) -> datetime:
+        with self._lock:
+            warp = self._warp
+        return self._start + timedelta(seconds=(time.perf_counter() - self._real_start) + warp)
+
+    def time(self) -> float:
+        return self.now().timestamp()
+
+    def sleep(self, seconds: float) -> None:
+        self.advance(seconds)
+
+    def advance(self, seconds: float) -> None:
+        with self._lock:
+            self._warp += max(0.0, seconds)
+
+
+# Scheduler leadership: one process holds a lease row in SQLite and renews it
+# with a heartbeat. Each takeover increments the fencing token, and every claim
+# or update made by the scheduler is conditioned on that token.
+SCHEDULER_LEASE_NAME = "message-scheduler"
+SCHEDULER_LEASE_TTL_SECONDS = _env_float("SCHEDULER_LEASE_TTL_SECONDS", 60.0)
+# Claims older than this are considered abandoned (crashed process) and reclaimed.
+SCHEDULER_CLAIM_TTL_SECONDS = _env_float("SCHEDULER_CLAIM_TTL_SECONDS", 900.0)
+# When disabled every process dispatches and row claims split the work (worker pool).
+SCHEDULER_REQUIRE_LEADERSHIP = os.environ.get("SCHEDULER_REQUIRE_LEADERSHIP", "1").lower() in {
+    "1", "true", "yes", "on"
+}
+SCHEDULER_NODE_ID = os.environ.get("SCHEDULER_NODE_ID") or (
+    f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+)
+
+
+class SchedulerLease:
+    """Leader lease stored in the ``scheduler_leases`` table.
+
+    ``fencing_token`` grows every time a different holder takes over, so
+    writes guarded by the token are rejected once leadership has moved on.
+    """
+
+    def __init__(self, name: str, holder_id: str, ttl: float, clock=None, connection_factory=None):
+        self.name = name
+        self.holder_id = holder_id
+        self.ttl = max(1.0, ttl)
+        self._clock = clock or time.time
+        self._connection_factory = connection_factory or get_db_connection
+        self._lock = threading.Lock()
+        self.fencing_token: Optional[int] = None
+        self._expires_at = 0.0
+        self._stop_event = threading.Event()
+        self._heartbeat_thread: Optional[threading.Thread] = None
+
+    def is_held(self) -> bool:
+        with self._lock:
+            return self.fencing_token is not None and self._clock() < self._expires_at
+
+    def acquire_or_renew(self) -> bool:
+        """Take the lease if it is free or expired, or extend it if already held."""
+
+        conn = None
+        try:
+            conn = self._connection_factory()
+            conn.isolation_level = None
+            conn.execute("BEGIN IMMEDIATE")
+            now = self._clock()
+            expires_at = now + self.ttl
+            row = conn.execute(
+                "SELECT holder, fencing_token, expires_at FROM scheduler_leases WHERE name = ?",
+                (self.name,),
+            ).fetchone()
+
+            with self._lock:
+                current_token = self.fencing_token
+
+            if row is None:
+                token = 1
+                conn.execute(
+                    """
+                    INSERT INTO scheduler_leases (name, holder, fencing_token, expires_at, renewed_at)
+                    VALUES (?, ?, ?, ?, ?)
+                    """,
+                    (self.name, self.holder_id, token, expires_at, datetime.now(timezone.utc).isoformat()),
+                )
+            else:
+                holder, token, lease_expires_at = row
+                if holder == self.holder_id and token == current_token:
+                    pass  # Renewal keeps the same fencing token.
+                elif lease_expires_at <= now:
+                    token = (token or 0) + 1
+                else:
+                    conn.execute("ROLLBACK")
+                    self._set_state(None, 0.0)
+                    return False
+                conn.execute(
+                    """
+                    UPDATE scheduler_leases
+                    SET holder = ?, fencing_token = ?, expires_at = ?, renewed_at = ?
+                    WHERE name = ?
+                    """,
+                    (self.holder_id, token, expires_at, datetime.now(timezone.utc).isoformat(), self.name),
+                )
+
+            conn.execute("COMMIT")
+            if token != current_token:
+                logger.info(
+                    "👑 Liderança do agendador assumida por %s (token %s)", self.holder_id, token
+                )
+            self._set_state(token, expires_at)
+            return True
+        except sqlite3.Error as exc:
+            logger.warning("Não foi possível renovar liderança do agendador: %s", exc)
+            if conn is not None:
+                try:
+                    conn.execute("ROLLBACK")
+                except sqlite3.Error:
+                    pass
+            # Keep the local view until the previous expiry; the DB decides on next renewal.
+            return self.is_held()
+        finally:
+            if conn is not None:
+                conn.close()
+
+    def release(self) -> None:
+        """Give up the lease so another process can take over immediately."""
+
+        with self._lock:
+            token = self.fencing_token
+        if token is None:
+            return
+        conn = None
+        try:
+            conn = self._connection_factory()
+            conn.execute(
+                """
+                UPDATE scheduler_leases SET expires_at = 0
+                WHERE name = ? AND holder = ? AND fencing_token = ?
+                """,
+                (self.name, self.holder_id, token),
+            )
+            conn.commit()
+        except sqlite3.Error as exc:
+            logger.warning("Não foi possível liberar liderança do agendador: %s", exc)
+        finally:
+            if conn is not None:
+                conn.close()
+            self._set_state(None, 0.0)
+
+    def start_heartbeat(self) -> None:
+        """Renew the lease every third of its TTL in a background thread."""
+
+        if self._heartbeat_thread and self._heartbeat_thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._heartbeat_thread = threading.Thread(target=self._heartbeat_loop, daemon=True)
+        self._heartbeat_thread.start()
+
+    def stop_heartbeat(self) -> None:
+        self._stop_event.set()
+        if self._heartbeat_thread:
+            self._heartbeat_thread.join(timeout=5)
+        self._heartbeat_thread = None
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "name": self.name,
+                "holder_id": self.holder_id,
+                "is_leader": self.fencing_token is not None and self._clock() < self._expires_at,
+                "fencing_token": self.fencing_token,
+                "expires_at": self._expires_at or None,
+            }
+
+    def _heartbeat_loop(self) -> None:
+        while not self._stop_event.is_set():
+            self.acquire_or_renew()
+            self._stop_event.wait(self.ttl / 3)
+
+    def _set_state(self, token: Optional[int], expires_at: float) -> None:
+        with self._lock:
+            self.fencing_token = token
+            self._expires_at = expires_at
+
+
+# Message Scheduler for automated sending
+# Scheduled media is downloaded once into a local LRU directory and handed to
+# the co-located Baileys service as a loopback URL (/media-cache/<key>), so a
+# campaign to N groups reads the remote bucket once instead of N times. A
+# Baileys service on another host cannot reach the loopback URL: set
+# MEDIA_CACHE_BASE_URL to an address it can reach, or it gets the remote URL.
+MEDIA_CACHE_DIR = os.environ.get(
+    "MEDIA_CACHE_DIR", os.path.join(tempfile.gettempdir(), f"whatsflow-media-{PORT}")
+)
+MEDIA_CACHE_MAX_BYTES = _env_int("MEDIA_CACHE_MAX_BYTES", 1024 * 1024 * 1024)  # 0 disables
+MEDIA_CACHE_BASE_URL = os.environ.get("MEDIA_CACHE_BASE_URL", f"http://127.0.0.1:{PORT}").rstrip("/")
+MEDIA_CACHE_BASE_URL_EXPLICIT = bool(os.environ.get("MEDIA_CACHE_BASE_URL"))
+# Entries older than this are revalidated (If-None-Match / If-Modified-Since)
+# before reuse; 0 revalidates on every send. Content-addressed objects, whose
+# name is the SHA-256 of their bytes, never change and are exempt.
+MEDIA_CACHE_TTL = _env_float("MEDIA_CACHE_TTL", 3600.0)
+_CONTENT_ADDRESSED_NAME = re.compile(r'^[0-9a-f]{64}(\.[a-z0-9]+)?$')
+MEDIA_PREFETCH_WINDOW_SECONDS = _env_int("MEDIA_PREFETCH_WINDOW_SECONDS", 3600)
+MEDIA_PREFETCH_INTERVAL = _env_float("MEDIA_PREFETCH_INTERVAL", 60.0)
+
+
+def media_cache_reachable_from(service_url: Optional[str]) -> bool:
+    """Whether the Baileys service at ``service_url`` can download cache URLs.
+
+    True for a service on this host (loopback address or Unix socket) or when
+    MEDIA_CACHE_BASE_URL was set explicitly.
+    """
+    if MEDIA_CACHE_BASE_URL_EXPLICIT:
+        return True
+    url = (service_url or '').strip().lower()
+    if url.startswith(UNIX_SOCKET_SCHEME):
+        return True
+    host = urllib.parse.urlsplit(url).hostname or ''
+    return host in ('localhost', '::1') or host.startswith('127.')
+
+
+class MediaCache:
+    """Size-bounded on-disk LRU of remote media, keyed by the SHA-256 of the URL."""
+
+    def __init__(self, directory: str = MEDIA_CACHE_DIR, max_bytes: int = MEDIA_CACHE_MAX_BYTES,
+                 base_url: str = MEDIA_CACHE_BASE_URL, ttl: float = MEDIA_CACHE_TTL):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.base_url = base_url
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._flight = _SingleFlight()
+        # key -> {'size', 'content_type', 'url'}; oldest use first
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._bytes = 0
+        self._loaded = False
+        self.hits = 0
+        self.misses = 0
+        self.downloads = 0
+        self.download_bytes = 0
+        self.download_errors = 0
+        self.evictions = 0
+        self.revalidations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def is_fresh(self, meta: Dict[str, Any]) -> bool:
+        """Whether a cached entry may be reused without asking the origin."""
+        name = urllib.parse.urlsplit(meta.get('url') or '').path.rsplit('/', 1)[-1].lower()
+        if _CONTENT_ADDRESSED_NAME.match(name):
+            return True
+        return time.time() - float(meta.get('fetched_at') or 0) < self.ttl
+
+    @staticmethod
+    def key_for(url: str) -> str:
+        return hashlib.sha256(url.strip().encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def is_valid_key(key: str) -> bool:
+        return len(key) == 64 and all(char in '0123456789abcdef' for char in key)
+
+    def path_for(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    def _load(self) -> None:
+        # Caller holds the lock. Rebuild the index from disk, oldest mtime first.
+        if self._loaded:
+            return
+        self._loaded = True
+        try:
+            # Files found here are served as media, so nobody else may write here
+            ensure_private_dir(self.directory)
+        except OSError as exc:
+            logger.error("❌ Cache de mídia desativado: %s", exc)
+            self.max_bytes = 0
+            return
+        found = []
+        for name in os.listdir(self.directory):
+            if not self.is_valid_key(name):
+                continue
+            try:
+                with open(self.path_for(name) + '.json', 'r', encoding='utf-8') as handle:
+                    meta = json.load(handle)
+                info = os.stat(self.path_for(name))
+            except (OSError, ValueError):
+                continue
+            found.append((info.st_mtime, name, dict(meta, size=info.st_size)))
+        for _, name, meta in sorted(found):
+            self._entries[name] = meta
+            self._bytes += meta['size']
+        self._evict()
+
+    def _evict(self) -> None:
+        # Caller holds the lock
+        while self._bytes > self.max_bytes and self._entries:
+            key, meta = self._entries.popitem(last=False)
+            self._bytes -= meta['size']
+            self.evictions += 1
+            for path in (self.path_for(key), self.path_for(key) + '.json'):
+                with contextlib.suppress(OSError):
+                    os.remove(path)
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Metadata plus ``path`` of a cached object, marking it recently used."""
+        if not self.enabled or not self.is_valid_key(key):
+            return None
+        with self._lock:
+            self._load()
+            meta = self._entries.get(key)
+            if meta is None:
+                return None
+            self._entries.move_to_end(key)
+        with contextlib.suppress(OSError):
+            os.utime(self.path_for(key))
+        return dict(meta, path=self.path_for(key))
+
+    def local_url(self, url: str) -> Optional[str]:
+        """Loopback URL of ``url`` when a fresh copy is cached, else None."""
+        key = self.key_for(url)
+        meta = self.get(key)
+        if meta is None or not self.is_fresh(meta):
+            return None
+        with self._lock:
+            self.hits += 1
+        return f"{self.base_url}/media-cache/{key}"
+
+    def fetch(self, url: str) -> Optional[str]:
+        """Cache ``url`` (downloading it at most once at a time) and return its local URL."""
+        url = (url or '').strip()
+        if not self.enabled or not url.lower().startswith(('http://', 'https://')):
+            return None
+        local = self.local_url(url)
+        if local:
+            return local
+        with self._lock:
+            self.misses += 1
+        key = self.key_for(url)
+        try:
+            self._flight.do(key, lambda: self._download(key, url))
+        except Exception as exc:
+            with self._lock:
+                self.download_errors += 1
+            logger.warning("⚠️ Falha ao armazenar mídia %s no cache local: %s", url, exc)
+            return None
+        return f"{self.base_url}/media-cache/{key}" if self.get(key) else None
+
+    def _download(self, key: str, url: str) -> None:
+        current = self.get(key)
+        if current is not None and self.is_fresh(current):
+            return
+        headers = {}
+        if current is not None:
+            if current.get('etag'):
+                headers['If-None-Match'] = current['etag']
+            if current.get('last_modified'):
+                headers['If-Modified-Since'] = current['last_modified']
+        http = _ensure_requests_dependency()
+        ensure_private_dir(self.directory)
+        with http.get(url, stream=True, allow_redirects=True, timeout=REMOTE_MEDIA_TIMEOUT,
+                      headers=headers) as response:
+            if headers and response.status_code == 304:
+                self._refresh(key, current)
+                return
+            response.raise_for_status()
+            declared = response.headers.get('content-length')
+            if declared and declared.isdigit() and int(declared) > MAX_MEDIA_BYTES:
+                raise ValueError(f"mídia com {int(declared)} bytes excede MAX_MEDIA_BYTES")
+            content_type = (response.headers.get('content-type') or '').split(';')[0].strip()
+            size = 0
+            handle = tempfile.NamedTemporaryFile(dir=self.directory, prefix='.part-', delete=False)
+            try:
+                with handle:
+                    for chunk in response.iter_content(UPLOAD_READ_CHUNK):
+                        size += len(chunk)
+                        if size > MAX_MEDIA_BYTES:
+                            raise ValueError("mídia excede MAX_MEDIA_BYTES")
+                        handle.write(chunk)
+                meta = {
+                    'url': url,
+                    'content_type': content_type or mimetypes.guess_type(urllib.parse.urlparse(url).path)[0],
+                    'etag': response.headers.get('etag'),
+                    'last_modified': response.headers.get('last-modified'),
+                    'fetched_at': time.time(),
+                }
+                with open(self.path_for(key) + '.json', 'w', encoding='utf-8') as meta_file:
+                    json.dump(meta, meta_file)
+                os.replace(handle.name, self.path_for(key))
+            except BaseException:
+                with contextlib.suppress(OSError):
+                    os.remove(handle.name)
+                raise
+        with self._lock:
+            self._load()
+            previous = self._entries.pop(key, None)
+            if previous:
+                self._bytes -= previous['size']
+            self._entries[key] = dict(meta, size=size)
+            self._bytes += size
+            self.downloads += 1
+            self.download_bytes += size
+            self._evict()
+        logger.info("📥 Mídia armazenada no cache local (%.2f MB): %s", size / (1024 * 1024), url)
+
+    def _refresh(self, key: str, current: Dict[str, Any]) -> None:
+        # The origin answered 304: keep the bytes, restart the TTL
+        meta = {name: value for name, value in current.items() if name not in ('path', 'size')}
+        meta['fetched_at'] = time.time()
+        with open(self.path_for(key) + '.json', 'w', encoding='utf-8') as meta_file:
+            json.dump(meta, meta_file)
+        with self._lock:
+            if key in self._entries:
+                self._entries[key]['fetched_at'] = meta['fetched_at']
+            self.revalidations += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            if self.enabled:
+                self._load()
+            return {
+                'enabled': self.enabled,
+                'directory': self.directory,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'downloads': self.downloads,
+                'download_bytes': self.download_bytes,
+                'download_errors': self.download_errors,
+                'evictions': self.evictions,
+                'revalidations': self.revalidations,
+                'ttl': self.ttl,
+            }
+
+
+class MediaPrefetcher:
+    """Warms the media cache for schedules due within MEDIA_PREFETCH_WINDOW_SECONDS."""
+
+    def __init__(self, cache: "MediaCache", window_seconds: int = MEDIA_PREFETCH_WINDOW_SECONDS,
+                 interval: float = MEDIA_PREFETCH_INTERVAL, db_file=None):
+        self.cache = cache
+        self.window_seconds = window_seconds
+        self.interval = interval
+        self.db_file = db_file
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.prefetched = 0
+
+    def start(self) -> None:
+        if not self.cache.enabled or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="media-prefetch", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.prefetch_due()
+            except Exception as exc:
+                logger.warning("⚠️ Erro no prefetch de mídia: %s", exc)
+            self._stop.wait(self.interval)
+
+    def due_media_urls(self) -> List[str]:
+        """Distinct media URLs of active schedules inside the window, soonest first."""
+        horizon = datetime.now(timezone.utc) + timedelta(seconds=self.window_seconds)
+        conn = get_db_connection(db_file=self.db_file)
+        try:
+            rows = conn.execute("""
+                SELECT TRIM(media_url), MIN(datetime(next_run)) AS first_run FROM scheduled_messages
+                WHERE is_active = 1
+                AND next_run IS NOT NULL
+                AND datetime(next_run) <= datetime(?)
+                AND IFNULL(message_type, 'text') != 'text'
+                AND TRIM(IFNULL(media_url, '')) != ''
+                GROUP BY TRIM(media_url)
+                ORDER BY first_run
+            """, (horizon.isoformat(),)).fetchall()
+        finally:
+            conn.close()
+        return [row[0] for row in rows]
+
+    def prefetch_due(self) -> int:
+        """Download the media of upcoming schedules that are not cached yet.
+
+        Stops once the upcoming media fill the cache, so a window larger than
+        MEDIA_CACHE_MAX_BYTES does not evict what the next sends need.
+        """
+        if not media_cache_reachable_from(_BAILEYS_CLIENT.base_url):
+            return 0
+        fetched = 0
+        budget = self.cache.max_bytes
+        for url in self.due_media_urls():
+            if self._stop.is_set():
+                break
+            entry = self.cache.get(self.cache.key_for(url))
+            if entry is None or not self.cache.is_fresh(entry):
+                # A new download may need up to MAX_MEDIA_BYTES of the remaining room
+                if entry is None and budget < MAX_MEDIA_BYTES:
+                    logger.info("📦 Cache de mídia cheio; prefetch limitado às próximas mídias")
+                    break
+                if self.cache.fetch(url):
+                    fetched += 1
+                    entry = self.cache.get(self.cache.key_for(url))
+            budget -= entry['size'] if entry else 0
+        self.prefetched += fetched
+        return fetched
+
+
+_MEDIA_CACHE = MediaCache()
+
+
+class MessageScheduler:
+    def __init__(self, api_base_url=None, node_id=None, require_leadership=None, clock=None,
+                 db_file=None, tick_interval=30):
+        # None follows API_BASE_URL, including failovers made by the URL resolver.
+        self._api_base_url = api_base_url
+        self.running = False
+        self.thread = None
+        self.clock = clock or SystemClock()
+        self.db_file = db_file
+        self.tick_interval = tick_interval
+        self.node_id = node_id or SCHEDULER_NODE_ID
+        self.require_leadership = (
+            SCHEDULER_REQUIRE_LEADERSHIP if require_leadership is None else require_leadership
+        )
+        self.lease = SchedulerLease(
+            SCHEDULER_LEASE_NAME,
+            self.node_id,
+            SCHEDULER_LEASE_TTL_SECONDS,
+            clock=self.clock.time,
+            connection_factory=self._connect,
+        )
+        self._claim_sequence = 0
+        # Callables notified with a dict per dispatch attempt and per tick.
+        self.dispatch_observers = []
+        self.tick_observers = []
+        self._tick_send_seconds = 0.0
+
+    @property
+    def api_base_url(self):
+        return self._api_base_url or API_BASE_URL
+
+    def _connect(self):
+        return get_db_connection(db_file=self.db_file)
+        
+    def start(self):
+        """Start the message scheduler"""
+        if not self.running:
+            self._sanitize_legacy_media_records()
+            self._fill_missing_next_runs()
+            if self.require_leadership:
+                self.lease.start_heartbeat()
+            self.running = True
+            self.thread = threading.Thread(target=self._run_scheduler, daemon=True)
+            self.thread.start()
+            print(f"✅ Message Scheduler iniciado (nó {self.node_id})")
+
+    def stop(self):
+        """Stop the message scheduler"""
+        self.running = False
+        if self.thread:
+            self.thread.join(timeout=5)
+        if self.require_leadership:
+            self.lease.stop_heartbeat()
+            self.lease.release()
+        print("⏹️ Message Scheduler parado")
+    
+    def _run_scheduler(self):
+        """Main scheduler loop"""
+        while self.running:
+            try:
+                self._check_and_send_scheduled_messages()
+                self.clock.sleep(self.tick_interval)  # Check every 30 seconds by default
+            except Exception as e:
+                print(f"❌ Erro no scheduler: {e}")
+                self.clock.sleep(self.tick_interval * 2)  # Wait longer on error
+    
+    def _check_and_send_scheduled_messages(self):
+        """Check for messages that need to be sent"""
+        if self.require_leadership and not self.lease.is_held():
+            return
+
+        conn = None
+        tick_started = time.perf_counter()
+        self._tick_send_seconds = 0.0
+        due_messages: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        processed = 0
+        try:
+            now_utc = self.clock.now()
+            stale_claim_before = self.clock.time() - SCHEDULER_CLAIM_TTL_SECONDS
+
+            # Use standardized database connection with retry logic
+            conn = self._connect()
+            conn.row_factory = sqlite3.Row
+            cursor = conn.cursor()
+
+            # Get messages that need to be sent (next_run <= now and active)
+            cursor.execute("""
+                SELECT sm.id, sm.campaign_id, sm.message_text, sm.message_type, sm.media_url,
+                       sm.schedule_type, sm.schedule_time, sm.schedule_days, sm.schedule_date,
+                       sm.next_run, sm.cron_expression, sm.timezone, sm.catch_up_policy,
+                       smg.group_id, smg.group_name, smg.instance_id
                 FROM scheduled_messages sm
                 LEFT JOIN scheduled_message_groups smg ON sm.id = smg.message_id
-                WHERE sm.is_active = 1 
-                AND sm.next_run IS NOT NULL 
+                WHERE sm.is_active = 1
+                AND sm.next_run IS NOT NULL
                 AND datetime(sm.next_run) <= datetime(?)
-            """, (now_brazil.isoformat(),))
-            
-            messages_to_send = cursor.fetchall()
+                AND (sm.claimed_by IS NULL OR sm.claimed_at < ?)
+                ORDER BY datetime(sm.next_run)
+            """, (now_utc.isoformat(), stale_claim_before))
+
+            for row in cursor.fetchall():
+                entry = due_messages.setdefault(row['id'], {'schedule': dict(row), 'groups': []})
+                if row['group_id'] and row['instance_id']:
+                    entry['groups'].append((row['group_id'], row['group_name'], row['instance_id']))
+
+            # Overdue schedules using the "spread" policy get evenly spaced slots
+            # instead of all firing in the same tick after an outage.
+            spread_ids = [
+                message_id
+                for message_id, entry in due_messages.items()
+                if self._catch_up_policy(entry['schedule']) == 'spread'
+                and self._lateness_seconds(entry['schedule'], now_utc) > CATCH_UP_GRACE_SECONDS
+            ]
+            spread_delays = {
+                message_id: CATCH_UP_SPREAD_SECONDS * index / len(spread_ids)
+                for index, message_id in enumerate(spread_ids)
+            }
 
-            for row in messages_to_send:
+            for message_id, entry in due_messages.items():
+                schedule = entry['schedule']
+                if self.require_leadership and not self.lease.is_held():
+                    logger.warning("Liderança do agendador perdida; interrompendo ciclo atual.")
+                    break
+                if not self._claim_message(conn, schedule, stale_claim_before):
+                    continue
                 try:
-                    message_id = row[0]
-                    message_text = row[2] or ''
-                    message_type = (row[3] or 'text').lower()
-                    media_url = (row[4] or '').strip()
-                    schedule_type = row[5]
-                    schedule_time = row[6]
-                    schedule_days = row[7]
-                    schedule_date = row[8]
-                    # Columns after sm.* begin at index 12
-                    group_id = row[12]
-                    group_name = row[13]
-                    instance_id = row[14]
-                    
-                    if not group_id or not instance_id:
-                        print(f"⚠️ Mensagem {message_id} sem grupo ou instância definidos")
-                        continue
-
-                    if media_url and _looks_like_base64_payload(media_url):
-                        warning_msg = (
-                            "Mensagem agendada contém payload base64 legado; desativando "
-                            f"o registro {message_id}."
-                        )
-                        logger.warning(warning_msg)
-                        cursor.execute(
-                            """
-                            UPDATE scheduled_messages
-                            SET media_url = '', is_active = 0, next_run = NULL
-                            WHERE id = ?
-                            """,
-                            (message_id,),
-                        )
-                        self._log_message_sent(
-                            message_id,
-                            group_id,
-                            group_name,
-                            message_text,
-                            'failed',
-                            instance_id,
-                            warning_msg,
-                            cursor=cursor,
-                        )
-                        conn.commit()
-                        continue
-
-                    # Send message
-                    success, error_message = self._send_message_to_group(
-                        instance_id, group_id, message_text, message_type, media_url
+                    self._process_due_message(
+                        cursor,
+                        schedule,
+                        entry['groups'],
+                        now_utc,
+                        spread_delays.get(message_id),
                     )
-
-                    if success:
-                        print(f"✅ Mensagem enviada para {group_name} via instância {instance_id}")
-                        
-                        # Log success using shared cursor/connection
-                        self._log_message_sent(
-                            message_id,
-                            group_id,
-                            group_name,
-                            message_text,
-                            'sent',
-                            instance_id,
-                            cursor=cursor,
-                        )
-                        
-                        # Calculate next run if recurring
-                        if schedule_type == 'weekly':
-                            next_run = self._calculate_next_weekly_run(
-                                schedule_time, json.loads(schedule_days or '[]'), brazil_tz
-                            )
-                            
-                            cursor.execute("""
-                                UPDATE scheduled_messages 
-                                SET next_run = ?
-                                WHERE id = ?
-                            """, (next_run, message_id))
-                        else:
-                            # For 'once' type, deactivate after sending
-                            cursor.execute("""
-                                UPDATE scheduled_messages 
-                                SET is_active = 0, next_run = NULL
-                                WHERE id = ?
-                            """, (message_id,))
-                    else:
-                        print(
-                            f"❌ Falha ao enviar mensagem para {group_name}: {error_message}"
-                        )
-
-                        # Log failure using shared cursor/connection
-                        self._log_message_sent(
-                            message_id,
-                            group_id,
-                            group_name,
-                            message_text,
-                            'failed',
-                            instance_id,
-                            error_message,
-                            cursor=cursor,
-                        )
-                        
-                        # Only retry in 5 minutes for network errors, not instance errors
-                        if "não conectada" not in str(error_message).lower():
-                            retry_time = now_brazil + timedelta(minutes=5)
-                            cursor.execute("""
-                                UPDATE scheduled_messages 
-                                SET next_run = ?
-                                WHERE id = ?
-                            """, (retry_time.isoformat(), message_id))
-                    
+                    conn.commit()
+                    processed += 1
                 except Exception as e:
+                    conn.rollback()
                     print(f"❌ Erro ao processar mensagem: {e}")
-                    continue
-            
-            conn.commit()
+                finally:
+                    self._release_claim(conn, schedule)
 
-            if messages_to_send:
-                print(f"📤 Processadas {len(messages_to_send)} mensagens agendadas")
+            if processed:
+                print(f"📤 Processadas {processed} mensagens agendadas")
                 
         except Exception as e:
             print(f"❌ Erro ao verificar mensagens agendadas: {e}")
         finally:
             if conn:
                 conn.close()
+            duration = time.perf_counter() - tick_started
+            self._notify(self.tick_observers, {
+                'due': len(due_messages),
+                'processed': processed,
+                'duration': duration,
+                'send_seconds': self._tick_send_seconds,
+                'db_seconds': max(0.0, duration - self._tick_send_seconds),
+            })
+
+    def _notify(self, observers, record):
+        for observer in observers:
+            try:
+                observer(record)
+            except Exception as exc:  # pragma: no cover - defensive logging
+                logger.warning("Observador do agendador falhou: %s", exc)
+
+    def _process_due_message(self, cursor, schedule, groups, now_utc, spread_delay=None):
+        """Send one due schedule to all of its groups and move it forward."""
+
+        message_id = schedule['id']
+        message_text = schedule['message_text'] or ''
+        message_type = (schedule['message_type'] or 'text').lower()
+        media_url = (schedule['media_url'] or '').strip()
+
+        if not groups:
+            print(f"⚠️ Mensagem {message_id} sem grupo ou instância definidos")
+            return
+
+        lateness = self._lateness_seconds(schedule, now_utc)
+        if lateness > CATCH_UP_GRACE_SECONDS:
+            policy = self._catch_up_policy(schedule)
+            if policy == 'skip':
+                logger.info(
+                    "⏭️ Agendamento %s atrasado %.0fs ignorado (política skip)", message_id, lateness
+                )
+                for group_id, group_name, instance_id in groups:
+                    self._log_message_sent(
+                        message_id,
+                        group_id,
+                        group_name,
+                        message_text,
+                        'skipped',
+                        instance_id,
+                        f"Execução perdida ignorada ({int(lateness)}s de atraso)",
+                        cursor=cursor,
+                    )
+                self._advance_schedule(cursor, schedule, now_utc)
+                return
+            if policy == 'spread' and spread_delay:
+                slot = now_utc + timedelta(seconds=spread_delay)
+                self._update_schedule(
+                    cursor,
+                    schedule,
+                    "next_run = ?",
+                    (slot.astimezone(self._schedule_timezone(schedule)).isoformat(),),
+                )
+                logger.info(
+                    "🕒 Agendamento %s atrasado %.0fs redistribuído para %s (política spread)",
+                    message_id,
+                    lateness,
+                    slot.isoformat(),
+                )
+                return
+
+        if media_url and _looks_like_base64_payload(media_url):
+            warning_msg = (
+                "Mensagem agendada contém payload base64 legado; desativando "
+                f"o registro {message_id}."
+            )
+            logger.warning(warning_msg)
+            self._update_schedule(cursor, schedule, "media_url = '', is_active = 0, next_run = NULL")
+            for group_id, group_name, instance_id in groups:
+                self._log_message_sent(
+                    message_id,
+                    group_id,
+                    group_name,
+                    message_text,
+                    'failed',
+                    instance_id,
+                    warning_msg,
+                    cursor=cursor,
+                )
+            return
+
+        sent_count = 0
+        retry_later = False
+        for group_id, group_name, instance_id in groups:
+            lag = self._lateness_seconds(schedule, self.clock.now())
+            send_started = time.perf_counter()
+            success, error_message, attempts = self._send_message_to_group(
+                instance_id, group_id, message_text, message_type, media_url
+            )
+            latency = time.perf_counter() - send_started
+            self._tick_send_seconds += latency
+            self._notify(self.dispatch_observers, {
+                'message_id': message_id,
+                'campaign_id': schedule.get('campaign_id'),
+                'instance_id': instance_id,
+                'group_id': group_id,
+                'lag': lag,
+                'latency': latency,
+                'outcome': 'sent' if success else 'failed',
+                'retries': max(0, attempts - 1),
+                'error': error_message,
+                'timestamp': self.clock.time(),
+            })
+
+            if success:
+                sent_count += 1
+                print(f"✅ Mensagem enviada para {group_name} via instância {instance_id}")
+                self._log_message_sent(
+                    message_id,
+                    group_id,
+                    group_name,
+                    message_text,
+                    'sent',
+                    instance_id,
+                    cursor=cursor,
+                )
+            else:
+                print(
+                    f"❌ Falha ao enviar mensagem para {group_name}: {error_message}"
+                )
+                self._log_message_sent(
+                    message_id,
+                    group_id,
+                    group_name,
+                    message_text,
+                    'failed',
+                    instance_id,
+                    error_message,
+                    cursor=cursor,
+                )
+                # Only retry in 5 minutes for network errors, not instance errors
+                if "não conectada" not in str(error_message).lower():
+                    retry_later = True
+
+        if sent_count:
+            # Groups that already received the message must not get it twice,
+            # so a partial failure still advances the schedule.
+            self._advance_schedule(cursor, schedule, now_utc)
+        elif retry_later:
+            retry_time = now_utc + timedelta(minutes=5)
+            self._update_schedule(
+                cursor,
+                schedule,
+                "next_run = ?",
+                (retry_time.astimezone(self._schedule_timezone(schedule)).isoformat(),),
+            )
+
+    def _advance_schedule(self, cursor, schedule, now_utc):
+        """Move a schedule to its next occurrence, deactivating finished ones."""
+
+        try:
+            rule = RecurrenceRule.from_row(schedule)
+            next_run = rule.next_after(now_utc) if rule.is_recurring else None
+        except ValueError as exc:
+            logger.warning("Agendamento %s com regra inválida: %s", schedule['id'], exc)
+            next_run = None
+
+        if next_run:
+            self._update_schedule(cursor, schedule, "next_run = ?", (next_run.isoformat(),))
+        else:
+            # For 'once' type, deactivate after sending
+            self._update_schedule(cursor, schedule, "is_active = 0, next_run = NULL")
+
+    def _claim_message(self, conn, schedule, stale_claim_before) -> bool:
+        """Atomically claim a due schedule so no other process sends it.
+
+        In leader mode the claim only succeeds while this node still holds
+        the lease with the current fencing token.
+        """
+
+        if self.require_leadership:
+            claim_token = self.lease.fencing_token
+            if claim_token is None:
+                return False
+            fence_sql = """
+                AND EXISTS (
+                    SELECT 1 FROM scheduler_leases
+                    WHERE name = ? AND holder = ? AND fencing_token = ? AND expires_at > ?
+                )
+            """
+            fence_params = (SCHEDULER_LEASE_NAME, self.node_id, claim_token, self.clock.time())
+        else:
+            self._claim_sequence += 1
+            claim_token = self._claim_sequence
+            fence_sql = ""
+            fence_params = ()
+
+        try:
+            cursor = conn.execute(
+                f"""
+                UPDATE scheduled_messages
+                SET claimed_by = ?, claimed_at = ?, claim_token = ?
+                WHERE id = ? AND is_active = 1 AND next_run = ?
+                AND (claimed_by IS NULL OR claimed_at < ?)
+                {fence_sql}
+                """,
+                (
+                    self.node_id,
+                    self.clock.time(),
+                    claim_token,
+                    schedule['id'],
+                    schedule['next_run'],
+                    stale_claim_before,
+                    *fence_params,
+                ),
+            )
+            claimed = cursor.rowcount == 1
+            conn.commit()
+        except sqlite3.Error as exc:
+            conn.rollback()
+            logger.warning("Não foi possível reservar agendamento %s: %s", schedule['id'], exc)
+            return False
+
+        if claimed:
+            schedule['claim_token'] = claim_token
+        return claimed
+
+    def _update_schedule(self, cursor, schedule, assignments, params=()):
+        """Update a claimed schedule and release the claim in the same statement.
+
+        The update is fenced on ``claimed_by``/``claim_token`` so a process whose
+        claim was taken over cannot overwrite the new owner's changes.
+        """
+
+        cursor.execute(
+            f"""
+            UPDATE scheduled_messages
+            SET {assignments}, claimed_by = NULL, claimed_at = NULL, claim_token = NULL
+            WHERE id = ? AND claimed_by = ? AND claim_token = ?
+            """,
+            (*params, schedule['id'], self.node_id, schedule.get('claim_token')),
+        )
+        if cursor.rowcount == 0:
+            logger.warning(
+                "Reserva do agendamento %s perdida; atualização ignorada.", schedule['id']
+            )
+
+    def _release_claim(self, conn, schedule):
+        """Drop this node's claim if the processing path did not already do it."""
+
+        try:
+            conn.execute(
+                """
+                UPDATE scheduled_messages
+                SET claimed_by = NULL, claimed_at = NULL, claim_token = NULL
+                WHERE id = ? AND claimed_by = ? AND claim_token = ?
+                """,
+                (schedule['id'], self.node_id, schedule.get('claim_token')),
+            )
+            conn.commit()
+        except sqlite3.Error as exc:
+            logger.warning("Não foi possível liberar reserva do agendamento %s: %s", schedule['id'], exc)
+
+    @staticmethod
+    def _schedule_timezone(schedule):
+        try:
+            return get_schedule_timezone(schedule.get('timezone'))
+        except ValueError:
+            return get_schedule_timezone()
+
+    @staticmethod
+    def _catch_up_policy(schedule) -> str:
+        try:
+            return normalize_catch_up_policy(schedule.get('catch_up_policy'))
+        except ValueError:
+            return normalize_catch_up_policy(None)
+
+    def _lateness_seconds(self, schedule, now_utc) -> float:
+        """Seconds between the planned ``next_run`` and ``now_utc``."""
+
+        try:
+            planned = datetime.fromisoformat(schedule['next_run'])
+        except (TypeError, ValueError):
+            return 0.0
+        if planned.tzinfo is None:
+            planned = planned.replace(tzinfo=self._schedule_timezone(schedule))
+        return max(0.0, (now_utc - planned).total_seconds())
     
     def _build_baileys_payload(
         self,
@@ -9417,10 +13647,13 @@ class MessageScheduler:
         message_text: str,
         message_type: str,
         media_url: str,
+        service_url: Optional[str] = None,
     ) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
         """Prepare the payload used to contact the Baileys service.
 
-        Returns a tuple ``(payload, error_message)``.
+        ``service_url`` is the Baileys base the payload goes to (the instance's
+        route by default); media is only rewritten to the local cache when that
+        service can reach it. Returns a tuple ``(payload, error_message)``.
         """
 
         normalized_type = (message_type or 'text').strip().lower()
@@ -9444,12 +13677,21 @@ class MessageScheduler:
         if normalized_type not in supported_media_types:
             return None, f"Tipo de mídia não suportado: {message_type}"
 
-        trimmed_url, validation_error, content_length = validate_remote_media_url(media_url)
-        if validation_error:
-            return None, validation_error
+        # Cached media skips the remote probe and is served from the loopback URL
+        use_cache = _MEDIA_CACHE.enabled and media_cache_reachable_from(
+            service_url or _BAILEYS_CLIENT.url_for(instance_id)
+        )
+        local_url = _MEDIA_CACHE.local_url(media_url) if use_cache else None
+        if local_url:
+            trimmed_url, content_length = media_url.strip(), None
+        else:
+            trimmed_url, validation_error, content_length = validate_remote_media_url(media_url)
+            if validation_error:
+                return None, validation_error
+            local_url = _MEDIA_CACHE.fetch(trimmed_url) if use_cache else None
 
         payload['type'] = normalized_type
-        payload['mediaUrl'] = trimmed_url
+        payload['mediaUrl'] = local_url or trimmed_url
 
         if content_length is not None:
             size_mb = content_length / (1024 * 1024)
@@ -9468,15 +13710,19 @@ class MessageScheduler:
         return payload, None
 
     def _send_message_to_group(self, instance_id, group_id, message_text, message_type, media_url):
-        """Send message to group via Baileys API"""
+        """Send message to group via Baileys API.
 
-        try:
-            http = _ensure_requests_dependency()
+        Returns ``(success, error_message, attempts)``.
+        """
 
-            if not check_service_health(self.api_base_url):
-                error_msg = f"Baileys service indisponível em {self.api_base_url}"
+        attempts = 0
+        try:
+            # An explicit URL (simulation, tests) wins; otherwise follow the instance route.
+            target_url = self._api_base_url or _BAILEYS_CLIENT.url_for(instance_id)
+            if not check_service_health(target_url):
+                error_msg = f"Baileys service indisponível em {target_url}"
                 print(f"❌ {error_msg}")
-                return False, error_msg
+                return False, error_msg, attempts
 
             payload, payload_error = self._build_baileys_payload(
                 instance_id=instance_id,
@@ -9484,91 +13730,100 @@ class MessageScheduler:
                 message_text=message_text,
                 message_type=message_type,
                 media_url=media_url or '',
+                service_url=target_url,
             )
 
             if payload_error:
                 logger.error(payload_error)
-                return False, payload_error
+                return False, payload_error, attempts
 
             normalized_type = payload['type']
             log_details = f"message_type={normalized_type}, media_url={media_url}"
 
+            if normalized_type == 'text':
+                logger.info(
+                    f"📤 Enviando mensagem de texto ao grupo {group_id} ({log_details})"
+                )
+            else:
+                logger.info(
+                    f"📤 Enviando mensagem de mídia ao grupo {group_id} ({log_details})"
+                )
 
-            for attempt in range(3):
-                try:
-                    if normalized_type == 'text':
-                        logger.info(
-                            f"📤 Enviando mensagem de texto ao grupo {group_id} ({log_details})"
-                        )
-                    else:
-                        logger.info(
-                            f"📤 Enviando mensagem de mídia ao grupo {group_id} ({log_details})"
-                        )
-
-                    try:
-                        payload_preview = json.dumps(payload, ensure_ascii=False)
-                    except (TypeError, ValueError):
-                        payload_preview = str(payload)
-                    print(
-                        f"console.log ▶️ Corpo da requisição para Baileys ({instance_id}): {payload_preview}"
-                    )
-
-                    response = http.post(
-                        f"{self.api_base_url}/send/{instance_id}",
-                        json=payload,
-                        timeout=(10, 180),
-                    )
-
-                    if response.status_code != 200:
-                        try:
-                            error_payload = response.json()
-                            error_detail = error_payload.get('error')
-                        except Exception:
-                            error_detail = response.text
-
-                        logger.error(
-                            f"Baileys send failed ({response.status_code}): {error_detail}"
-                        )
-                        detail_message = error_detail or f"HTTP {response.status_code}"
-                        return False, f"Baileys send failed ({response.status_code}): {detail_message}"
+            try:
+                payload_preview = json.dumps(payload, ensure_ascii=False)
+            except (TypeError, ValueError):
+                payload_preview = str(payload)
+            print(
+                f"console.log ▶️ Corpo da requisição para Baileys ({instance_id}): {payload_preview}"
+            )
 
+            try:
+                response = _BAILEYS_CLIENT.send(instance_id, payload, base_url=target_url,
+                                                sleep=self.clock.sleep)
+            except BaileysTimeoutError as exc:
+                attempts = getattr(exc, 'attempts', 1)
+                logger.error("Baileys send timed out")
+                return False, "Baileys send timed out", attempts
+            attempts = getattr(response, 'attempts', 1)
+
+            if response.status_code != 200:
+                try:
+                    error_payload = response.json()
+                    error_detail = error_payload.get('error')
+                except Exception:
+                    error_detail = response.text
 
-                    try:
-                        response_data = response.json()
-                    except ValueError:
-                        logger.error("Baileys respondeu com payload inválido: %s", response.text)
-                        return False, "Resposta inválida do serviço Baileys"
-
-                    if not response_data.get('success', False):
-                        error_detail = response_data.get('error') or 'Resposta sem sucesso'
-                        logger.error("Baileys indicou falha no envio: %s", error_detail)
-                        return False, f"Baileys indicou falha no envio: {error_detail}"
-
-                    if normalized_type == 'text':
-                        logger.info("✅ Mensagem de texto enviada ao grupo %s", group_id)
-                    else:
-                        logger.info("✅ Mensagem de mídia enviada ao grupo %s", group_id)
+                logger.error(
+                    f"Baileys send failed ({response.status_code}): {error_detail}"
+                )
+                detail_message = error_detail or f"HTTP {response.status_code}"
+                return False, f"Baileys send failed ({response.status_code}): {detail_message}", attempts
 
+            try:
+                response_data = response.json()
+            except ValueError:
+                logger.error("Baileys respondeu com payload inválido: %s", response.text)
+                return False, "Resposta inválida do serviço Baileys", attempts
+
+            if not response_data.get('success', False):
+                error_detail = response_data.get('error') or 'Resposta sem sucesso'
+                logger.error("Baileys indicou falha no envio: %s", error_detail)
+                return False, f"Baileys indicou falha no envio: {error_detail}", attempts
+
+            if normalized_type == 'text':
+                logger.info("✅ Mensagem de texto enviada ao grupo %s", group_id)
+            else:
+                logger.info("✅ Mensagem de mídia enviada ao grupo %s", group_id)
 
-                    return True, None
-                except http.exceptions.Timeout:  # type: ignore[attr-defined]
-                    if attempt < 2:
-                        time.sleep(2 ** attempt)
-                        continue
-                    logger.error("Baileys send timed out")
-                    return False, "Baileys send timed out"
+            return True, None, attempts
 
         except Exception as e:  # pragma: no cover - defensive logging
             error_msg = f"Erro ao enviar via Baileys: {e}"
             print(f"❌ {error_msg}")
-            return False, error_msg
+            return False, error_msg, attempts
+
+    def _fill_missing_next_runs(self):
+        """Compute ``next_run`` for active schedules that never got one."""
+
+        conn = None
+        try:
+            conn = self._connect()
+            updated = recompute_next_runs(conn, only_missing=True)
+            conn.commit()
+            if updated:
+                logger.info("🔁 Próxima execução recalculada para %s agendamentos.", updated)
+        except sqlite3.Error as exc:
+            logger.error("Não foi possível recalcular próximas execuções: %s", exc)
+        finally:
+            if conn:
+                conn.close()
 
     def _sanitize_legacy_media_records(self):
         """Disable legacy scheduled messages that still store base64 payloads."""
 
         conn = None
         try:
-            conn = get_db_connection()
+            conn = self._connect()
             cursor = conn.cursor()
             cursor.execute(
                 """
@@ -9609,35 +13864,6 @@ class MessageScheduler:
             if conn:
                 conn.close()
     
-    def _calculate_next_weekly_run(self, schedule_time, schedule_days, brazil_tz):
-        """Calculate next weekly run"""
-        try:
-            now_brazil = datetime.now(brazil_tz)
-            hour, minute = map(int, schedule_time.split(':'))
-            
-            weekdays = {
-                'monday': 0, 'tuesday': 1, 'wednesday': 2, 'thursday': 3,
-                'friday': 4, 'saturday': 5, 'sunday': 6
-            }
-            
-            target_weekdays = [weekdays[day] for day in schedule_days if day in weekdays]
-            
-            # Find next occurrence
-            for i in range(1, 8):  # Start from tomorrow
-                check_date = now_brazil + timedelta(days=i)
-                if check_date.weekday() in target_weekdays:
-                    next_run = check_date.replace(hour=hour, minute=minute, second=0, microsecond=0)
-                    return next_run.isoformat()
-            
-            # Fallback
-            next_run = now_brazil + timedelta(days=7)
-            next_run = next_run.replace(hour=hour, minute=minute, second=0, microsecond=0)
-            return next_run.isoformat()
-            
-        except Exception as e:
-            print(f"❌ Erro ao calcular próxima execução semanal: {e}")
-            return None
-    
     def _log_message_sent(self, message_id, group_id, group_name, message_text,
                          status, instance_id, error_message=None, cursor=None):
         """Log sent message to history.
@@ -9648,7 +13874,7 @@ class MessageScheduler:
         """
         try:
             history_id = str(uuid.uuid4())
-            sent_at = datetime.now().isoformat()
+            sent_at = self.clock.now().astimezone().replace(tzinfo=None).isoformat()
 
             if cursor is not None:
                 cursor.execute(
@@ -9670,7 +13896,7 @@ class MessageScheduler:
                     ),
                 )
             else:
-                with sqlite3.connect(DB_FILE, timeout=30) as conn:
+                with sqlite3.connect(self.db_file or DB_FILE, timeout=30) as conn:
                     cur = conn.cursor()
                     cur.execute(
                         """
@@ -9695,11 +13921,782 @@ class MessageScheduler:
         except Exception as e:
             print(f"❌ Erro ao registrar histórico: {e}")
 
+# Scheduler instrumentation: every dispatch reported by MessageScheduler is
+# folded into per-minute histogram slices (rolling window served by the admin
+# endpoint) and into hourly aggregates persisted in scheduler_metrics_hourly.
+SCHEDULER_METRICS_WINDOW_SECONDS = _env_int("SCHEDULER_METRICS_WINDOW_SECONDS", 3600)
+SCHEDULER_METRICS_FLUSH_SECONDS = _env_float("SCHEDULER_METRICS_FLUSH_SECONDS", 60.0)
+# Upper bounds (seconds) of the histogram buckets; the last bucket is open.
+SCHEDULER_LAG_BUCKETS = (0.5, 1, 2, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+SCHEDULER_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60, 180)
+
+
+class _DispatchStats:
+    """Lag/latency histograms plus outcome and retry counters."""
+
+    def __init__(self):
+        self.lag = _Histogram(SCHEDULER_LAG_BUCKETS)
+        self.latency = _Histogram(SCHEDULER_LATENCY_BUCKETS)
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+
+    def observe(self, record: Dict[str, Any]) -> None:
+        self.lag.observe(record.get('lag') or 0.0)
+        self.latency.observe(record.get('latency') or 0.0)
+        if record.get('outcome') == 'sent':
+            self.sent += 1
+        else:
+            self.failed += 1
+        self.retries += int(record.get('retries') or 0)
+
+    def merge(self, other: "_DispatchStats") -> None:
+        self.lag.merge(other.lag)
+        self.latency.merge(other.latency)
+        self.sent += other.sent
+        self.failed += other.failed
+        self.retries += other.retries
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            'dispatches': self.sent + self.failed,
+            'sent': self.sent,
+            'failed': self.failed,
+            'retries': self.retries,
+            'lag_seconds': self.lag.snapshot(),
+            'latency_seconds': self.latency.snapshot(),
+        }
+
+
+class SchedulerMetrics:
+    """Collects MessageScheduler dispatch and tick observations.
+
+    Attach with :meth:`attach`; :meth:`snapshot` returns the rolling window
+    overall and per instance/campaign, and :meth:`flush` persists hourly
+    rollups (also done automatically from the tick observer).
+    """
+
+    def __init__(self, window_seconds: int = SCHEDULER_METRICS_WINDOW_SECONDS,
+                 flush_interval: float = SCHEDULER_METRICS_FLUSH_SECONDS,
+                 db_file: Optional[str] = None, clock=None):
+        self.window_seconds = max(60, int(window_seconds))
+        self.flush_interval = flush_interval
+        self.db_file = db_file
+        self.clock = clock or SystemClock()
+        self._lock = threading.Lock()
+        # (scope, scope_id) -> OrderedDict[minute_slot, _DispatchStats]
+        self._slices: Dict[Tuple[str, str], "OrderedDict[int, _DispatchStats]"] = {}
+        # (hour, scope, scope_id) -> _DispatchStats not yet persisted
+        self._pending_rollups: Dict[Tuple[str, str, str], _DispatchStats] = {}
+        self._last_flush = 0.0
+        self._last_tick: Optional[Dict[str, Any]] = None
+        self._ticks = 0
+        self._tick_duration = _Histogram(SCHEDULER_LATENCY_BUCKETS)
+        self._tick_db = _Histogram(SCHEDULER_LATENCY_BUCKETS)
+
+    def attach(self, scheduler: "MessageScheduler") -> None:
+        self.clock = scheduler.clock
+        if self.db_file is None:
+            self.db_file = scheduler.db_file
+        scheduler.dispatch_observers.append(self.record_dispatch)
+        scheduler.tick_observers.append(self.record_tick)
+
+    def record_dispatch(self, record: Dict[str, Any]) -> None:
+        timestamp = record.get('timestamp') or self.clock.time()
+        slot = int(timestamp // 60)
+        hour = datetime.fromtimestamp(timestamp, timezone.utc).strftime("%Y-%m-%dT%H:00:00+00:00")
+        scopes = (
+            ('all', ''),
+            ('instance', str(record.get('instance_id') or '')),
+            ('campaign', str(record.get('campaign_id') or '')),
+        )
+        with self._lock:
+            for scope in scopes:
+                slices = self._slices.setdefault(scope, OrderedDict())
+                stats = slices.get(slot)
+                if stats is None:
+                    stats = slices[slot] = _DispatchStats()
+                stats.observe(record)
+                self._pending_rollups.setdefault((hour,) + scope, _DispatchStats()).observe(record)
+            self._expire(slot)
+
+    def record_tick(self, record: Dict[str, Any]) -> None:
+        with self._lock:
+            self._ticks += 1
+            self._last_tick = dict(record, at=self.clock.now().isoformat())
+            if record.get('due'):
+                self._tick_duration.observe(record.get('duration') or 0.0)
+                self._tick_db.observe(record.get('db_seconds') or 0.0)
+            due_flush = self._pending_rollups and (
+                time.monotonic() - self._last_flush >= self.flush_interval
+            )
+        if due_flush:
+            self.flush()
+
+    def _expire(self, current_slot: int) -> None:
+        oldest = current_slot - self.window_seconds // 60
+        for key in list(self._slices):
+            slices = self._slices[key]
+            while slices and next(iter(slices)) < oldest:
+                slices.popitem(last=False)
+            if not slices:
+                del self._slices[key]
+
+    def _window(self, key) -> _DispatchStats:
+        merged = _DispatchStats()
+        for stats in self._slices.get(key, {}).values():
+            merged.merge(stats)
+        return merged
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            self._expire(int(self.clock.time() // 60))
+            by_scope: Dict[str, Dict[str, Any]] = {'instance': {}, 'campaign': {}}
+            for scope, scope_id in self._slices:
+                if scope in by_scope:
+                    by_scope[scope][scope_id] = self._window((scope, scope_id)).snapshot()
+            return {
+                'window_seconds': self.window_seconds,
+                'overall': self._window(('all', '')).snapshot(),
+                'instances': by_scope['instance'],
+                'campaigns': by_scope['campaign'],
+                'ticks': {
+                    'count': self._ticks,
+                    'last': self._last_tick,
+                    'duration_seconds': self._tick_duration.snapshot(),
+                    'db_seconds': self._tick_db.snapshot(),
+                },
+            }
+
+    def flush(self) -> int:
+        """Merge pending hourly aggregates into ``scheduler_metrics_hourly``."""
+
+        with self._lock:
+            pending, self._pending_rollups = self._pending_rollups, {}
+            self._last_flush = time.monotonic()
+        if not pending:
+            return 0
+
+        conn = None
+        try:
+            conn = get_db_connection(db_file=self.db_file)
+            conn.execute("BEGIN IMMEDIATE")
+            for (hour, scope, scope_id), stats in pending.items():
+                row = conn.execute(
+                    """
+                    SELECT sent, failed, retries, lag_sum, lag_max, latency_sum, latency_max,
+                           lag_buckets, latency_buckets
+                    FROM scheduler_metrics_hourly
+                    WHERE hour = ? AND scope = ? AND scope_id = ?
+                    """,
+                    (hour, scope, scope_id),
+                ).fetchone()
+                if row:
+                    previous = _DispatchStats()
+                    previous.sent, previous.failed, previous.retries = row[0], row[1], row[2]
+                    previous.lag = _Histogram(SCHEDULER_LAG_BUCKETS, json.loads(row[7]))
+                    previous.lag.total, previous.lag.max = row[3], row[4]
+                    previous.latency = _Histogram(SCHEDULER_LATENCY_BUCKETS, json.loads(row[8]))
+                    previous.latency.total, previous.latency.max = row[5], row[6]
+                    previous.merge(stats)
+                    stats = previous
+                conn.execute(
+                    """
+                    INSERT OR REPLACE INTO scheduler_metrics_hourly
+                    (hour, scope, scope_id, dispatches, sent, failed, retries,
+                     lag_sum, lag_max, lag_p50, lag_p99, latency_sum, latency_max,
+                     lag_buckets, latency_buckets, updated_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    """,
+                    (
+                        hour, scope, scope_id,
+                        stats.sent + stats.failed, stats.sent, stats.failed, stats.retries,
+                        stats.lag.total, stats.lag.max,
+                        stats.lag.quantile(0.5), stats.lag.quantile(0.99),
+                        stats.latency.total, stats.latency.max,
+                        json.dumps(stats.lag.counts), json.dumps(stats.latency.counts),
+                        datetime.now(timezone.utc).isoformat(),
+                    ),
+                )
+            conn.commit()
+            return len(pending)
+        except sqlite3.Error as exc:
+            if conn:
+                conn.rollback()
+            logger.error("Não foi possível gravar métricas horárias do agendador: %s", exc)
+            with self._lock:
+                for key, stats in pending.items():
+                    self._pending_rollups.setdefault(key, _DispatchStats()).merge(stats)
+            return 0
+        finally:
+            if conn:
+                conn.close()
+
+    def hourly(self, hours: int = 24, scope: str = 'all', scope_id: Optional[str] = None) -> list:
+        """Persisted rollups for the last ``hours`` hours."""
+
+        self.flush()
+        since = (self.clock.now() - timedelta(hours=max(1, hours))).strftime("%Y-%m-%dT%H:00:00+00:00")
+        query = """
+            SELECT hour, scope, scope_id, dispatches, sent, failed, retries,
+                   lag_sum, lag_max, lag_p50, lag_p99, latency_sum, latency_max
+            FROM scheduler_metrics_hourly
+            WHERE hour >= ? AND scope = ?
+        """
+        params = [since, scope]
+        if scope_id is not None:
+            query += " AND scope_id = ?"
+            params.append(scope_id)
+        query += " ORDER BY hour, scope_id"
+
+        conn = get_db_connection(db_file=self.db_file)
+        try:
+            conn.row_factory = sqlite3.Row
+            rows = []
+            for row in conn.execute(query, params):
+                item = dict(row)
+                dispatches = item['dispatches'] or 0
+                item['lag_avg'] = round(item.pop('lag_sum') / dispatches, 4) if dispatches else 0.0
+                item['latency_avg'] = round(item.pop('latency_sum') / dispatches, 4) if dispatches else 0.0
+                rows.append(item)
+            return rows
+        finally:
+            conn.close()
+
+
+_SCHEDULER_METRICS = SchedulerMetrics()
+
+
+# Scheduler simulation: runs MessageScheduler against a generated dataset and a
+# local stub of the Baileys /send endpoint while a TimeWarpClock skips the idle
+# time between ticks. Used to benchmark dispatch lag and catch regressions.
+SIMULATION_REPORT_METRICS = {
+    # metric: True when higher values are better
+    'lag_p50': False,
+    'lag_p90': False,
+    'lag_p99': False,
+    'db_seconds_per_tick_avg': False,
+    'throughput_per_second': True,
+}
+
+
+def _percentile(values, pct: float) -> float:
+    """Nearest-rank percentile of ``values`` (0.0 for an empty sequence)."""
+
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, math.ceil(pct / 100.0 * len(ordered)) - 1))
+    return float(ordered[rank])
+
+
+class _StubBaileysServer:
+    """Minimal Baileys stand-in answering ``/health`` and ``/send/<instance>``."""
+
+    def __init__(self, latency_ms: float = 5.0, jitter_ms: float = 2.0,
+                 error_rate: float = 0.0, seed: int = 42):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.server = None
+        self.thread = None
+
+    def _next_response(self):
+        with self._lock:
+            self.requests += 1
+            delay = max(0.0, self._rng.gauss(self.latency_ms, self.jitter_ms)) / 1000.0
+            failed = self._rng.random() < self.error_rate
+        return delay, failed
+
+    def start(self) -> str:
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _reply(self, status, payload):
+                body = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path == '/health':
+                    self._reply(200, {'status': 'ok'})
+                else:
+                    self._reply(404, {'error': 'not found'})
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                if length:
+                    self.rfile.read(length)
+                if not self.path.startswith('/send/'):
+                    self._reply(404, {'error': 'not found'})
+                    return
+                delay, failed = stub._next_response()
+                if delay:
+                    time.sleep(delay)
+                if failed:
+                    self._reply(500, {'success': False, 'error': 'simulated failure'})
+                else:
+                    self._reply(200, {'success': True, 'messageId': uuid.uuid4().hex})
+
+            def log_message(self, format, *args):  # noqa: A002 - silence stub access logs
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+
+def generate_simulation_dataset(db_file: str, schedules: int, start: datetime, *,
+                                spike_fraction: float = 0.5, spike_time: str = "09:00",
+                                window_minutes: int = 60, groups_per_schedule: int = 1,
+                                tz_name: Optional[str] = None, seed: int = 42) -> int:
+    """Fill ``db_file`` with ``schedules`` daily schedules starting after ``start``.
+
+    ``spike_fraction`` of them fire at ``spike_time``; the rest are spread over
+    ``window_minutes`` from ``start``. Returns the number of schedules created.
+    """
+
+    rng = random.Random(seed)
+    zone = get_schedule_timezone(tz_name)
+    local_start = start.astimezone(zone)
+    created_at = start.isoformat()
+
+    init_db(db_file)
+    conn = get_db_connection(db_file=db_file)
+    try:
+        cursor = conn.cursor()
+        campaign_id = f"sim-campaign-{seed}"
+        cursor.execute(
+            "INSERT OR REPLACE INTO campaigns (id, name, description, status, created_at, updated_at) "
+            "VALUES (?, ?, ?, 'active', ?, ?)",
+            (campaign_id, "Simulação", "Campanha gerada para simulação", created_at, created_at),
+        )
+
+        schedule_rows = []
+        group_rows = []
+        spike_count = int(round(schedules * spike_fraction))
+        for index in range(schedules):
+            if index < spike_count:
+                schedule_time = spike_time
+            else:
+                offset = timedelta(minutes=rng.uniform(0, max(1, window_minutes)))
+                schedule_time = (local_start + offset).strftime("%H:%M")
+            message_id = f"sim-{index:06d}"
+            schedule_rows.append((
+                message_id,
+                campaign_id,
+                f"Mensagem simulada {index}",
+                schedule_time,
+                tz_name,
+                created_at,
+            ))
+            for group_index in range(groups_per_schedule):
+                group_rows.append((
+                    message_id,
+                    f"sim-group-{index:06d}-{group_index}@g.us",
+                    f"Grupo simulado {index}/{group_index}",
+                    f"sim-instance-{group_index % 4}",
+                ))
+
+        cursor.executemany(
+            """
+            INSERT OR REPLACE INTO scheduled_messages
+            (id, campaign_id, message_text, message_type, media_url, schedule_type,
+             schedule_time, schedule_days, timezone, is_active, created_at)
+            VALUES (?, ?, ?, 'text', '', 'daily', ?, '[]', ?, 1, ?)
+            """,
+            schedule_rows,
+        )
+        cursor.executemany(
+            """
+            INSERT OR REPLACE INTO scheduled_message_groups
+            (message_id, group_id, group_name, instance_id)
+            VALUES (?, ?, ?, ?)
+            """,
+            group_rows,
+        )
+        recompute_next_runs(conn, after=start - timedelta(seconds=1))
+        conn.commit()
+    finally:
+        conn.close()
+    return schedules
+
+
+def run_scheduler_simulation(*, schedules: int = 1000, spike_fraction: float = 0.5,
+                             spike_time: str = "09:00", lead_minutes: int = 5,
+                             duration_minutes: int = 60, tick_interval: float = 30.0,
+                             groups_per_schedule: int = 1, latency_ms: float = 5.0,
+                             jitter_ms: float = 2.0, error_rate: float = 0.0,
+                             seed: int = 42, tz_name: Optional[str] = None,
+                             db_file: Optional[str] = None, quiet: bool = True) -> Dict[str, Any]:
+    """Run the scheduler against a generated dataset and return a JSON-able report.
+
+    The simulation starts ``lead_minutes`` before ``spike_time`` on a fixed date
+    so repeated runs with the same seed are comparable.
+    """
+
+    zone = get_schedule_timezone(tz_name)
+    hour, minute = _parse_schedule_time(spike_time)
+    spike_local = _localize_wall_time(datetime(2024, 3, 4, hour, minute), zone)
+    start = (spike_local - timedelta(minutes=lead_minutes)).astimezone(timezone.utc)
+    end = start + timedelta(minutes=duration_minutes)
+
+    owns_db = db_file is None
+    if owns_db:
+        temp_dir = tempfile.mkdtemp(prefix="whatsflow-sim-")
+        db_file = os.path.join(temp_dir, "simulation.db")
+
+    generate_simulation_dataset(
+        db_file,
+        schedules,
+        start,
+        spike_fraction=spike_fraction,
+        spike_time=spike_time,
+        window_minutes=duration_minutes,
+        groups_per_schedule=groups_per_schedule,
+        tz_name=tz_name,
+        seed=seed,
+    )
+
+    stub = _StubBaileysServer(latency_ms=latency_ms, jitter_ms=jitter_ms,
+                              error_rate=error_rate, seed=seed)
+    base_url = stub.start()
+    clock = TimeWarpClock(start)
+    scheduler = MessageScheduler(
+        base_url,
+        node_id=f"simulation-{seed}",
+        require_leadership=False,
+        clock=clock,
+        db_file=db_file,
+        tick_interval=tick_interval,
+    )
+
+    dispatches = []
+    ticks = []
+    scheduler.dispatch_observers.append(dispatches.append)
+    scheduler.tick_observers.append(ticks.append)
+
+    real_started = time.perf_counter()
+    sink = open(os.devnull, 'w') if quiet else None
+    if quiet:
+        logging.disable(logging.CRITICAL)
+    try:
+        with contextlib.redirect_stdout(sink) if quiet else contextlib.nullcontext():
+            while clock.now() < end:
+                scheduler._check_and_send_scheduled_messages()
+                clock.sleep(tick_interval)
+    finally:
+        if quiet:
+            logging.disable(logging.NOTSET)
+            sink.close()
+        stub.stop()
+    real_seconds = time.perf_counter() - real_started
+
+    lags = [record['lag'] for record in dispatches]
+    latencies = [record['latency'] for record in dispatches]
+    busy_ticks = [tick for tick in ticks if tick['due']]
+    db_seconds = [tick['db_seconds'] for tick in busy_ticks]
+    sent = sum(1 for record in dispatches if record['outcome'] == 'sent')
+
+    conn = get_db_connection(db_file=db_file)
+    try:
+        pending = conn.execute(
+            "SELECT COUNT(*) FROM scheduled_messages WHERE is_active = 1 AND datetime(next_run) <= datetime(?)",
+            (end.isoformat(),),
+        ).fetchone()[0]
+    finally:
+        conn.close()
+    if owns_db:
+        shutil.rmtree(os.path.dirname(db_file), ignore_errors=True)
+
+    return {
+        'parameters': {
+            'schedules': schedules,
+            'spike_fraction': spike_fraction,
+            'spike_time': spike_time,
+            'duration_minutes': duration_minutes,
+            'tick_interval': tick_interval,
+            'groups_per_schedule': groups_per_schedule,
+            'latency_ms': latency_ms,
+            'jitter_ms': jitter_ms,
+            'error_rate': error_rate,
+            'seed': seed,
+        },
+        'dispatches': len(dispatches),
+        'sent': sent,
+        'failed': len(dispatches) - sent,
+        'pending_at_end': pending,
+        'ticks': len(ticks),
+        'busy_ticks': len(busy_ticks),
+        'real_seconds': round(real_seconds, 3),
+        'throughput_per_second': round(len(dispatches) / real_seconds, 2) if real_seconds else 0.0,
+        'lag_p50': round(_percentile(lags, 50), 3),
+        'lag_p90': round(_percentile(lags, 90), 3),
+        'lag_p99': round(_percentile(lags, 99), 3),
+        'lag_max': round(max(lags), 3) if lags else 0.0,
+        'send_latency_p50': round(_percentile(latencies, 50), 4),
+        'send_latency_p99': round(_percentile(latencies, 99), 4),
+        'db_seconds_per_tick_avg': round(sum(db_seconds) / len(db_seconds), 4) if db_seconds else 0.0,
+        'db_seconds_per_tick_p95': round(_percentile(db_seconds, 95), 4),
+        'db_seconds_per_tick_max': round(max(db_seconds), 4) if db_seconds else 0.0,
+    }
+
+
+def compare_simulation_reports(report: Dict[str, Any], baseline: Dict[str, Any],
+                               tolerance: float = 0.2, floor: float = 0.05) -> list:
+    """Return human-readable regressions of ``report`` against ``baseline``.
+
+    A metric regresses when it is worse than the baseline by more than
+    ``tolerance`` (relative) and ``floor`` (absolute, avoids noise near zero).
+    """
+
+    regressions = []
+    for metric, higher_is_better in SIMULATION_REPORT_METRICS.items():
+        if metric not in report or metric not in baseline:
+            continue
+        current = float(report[metric])
+        previous = float(baseline[metric])
+        delta = previous - current if higher_is_better else current - previous
+        if delta > floor and delta > abs(previous) * tolerance:
+            regressions.append(f"{metric}: {previous} -> {current}")
+    return regressions
+
+
+def simulate_scheduler_cli(argv) -> int:
+    """Entry point for ``python3 whatsflow-real.py simulate-scheduler``."""
+
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        prog="whatsflow-real.py simulate-scheduler",
+        description="Simula o agendador com relógio acelerado e um stub do Baileys.",
+    )
+    parser.add_argument("--schedules", type=int, default=1000)
+    parser.add_argument("--spike-fraction", type=float, default=0.5)
+    parser.add_argument("--spike-time", default="09:00")
+    parser.add_argument("--lead-minutes", type=int, default=5)
+    parser.add_argument("--duration-minutes", type=int, default=60)
+    parser.add_argument("--tick-interval", type=float, default=30.0)
+    parser.add_argument("--groups-per-schedule", type=int, default=1)
+    parser.add_argument("--latency-ms", type=float, default=5.0)
+    parser.add_argument("--jitter-ms", type=float, default=2.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--timezone", default=None)
+    parser.add_argument("--db", default=None, help="Arquivo SQLite (padrão: temporário)")
+    parser.add_argument("--output", help="Grava o relatório JSON neste arquivo")
+    parser.add_argument("--baseline", help="Relatório anterior para detectar regressões")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args(argv)
+
+    report = run_scheduler_simulation(
+        schedules=args.schedules,
+        spike_fraction=args.spike_fraction,
+        spike_time=args.spike_time,
+        lead_minutes=args.lead_minutes,
+        duration_minutes=args.duration_minutes,
+        tick_interval=args.tick_interval,
+        groups_per_schedule=args.groups_per_schedule,
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate,
+        seed=args.seed,
+        tz_name=args.timezone,
+        db_file=args.db,
+        quiet=not args.verbose,
+    )
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as handle:
+            json.dump(report, handle, indent=2, ensure_ascii=False)
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as handle:
+            baseline = json.load(handle)
+        regressions = compare_simulation_reports(report, baseline, args.tolerance)
+        if regressions:
+            print("❌ Regressões em relação à linha de base:", file=sys.stderr)
+            for line in regressions:
+                print(f"   {line}", file=sys.stderr)
+            return 1
+        print("✅ Sem regressões em relação à linha de base", file=sys.stderr)
+    return 0
+
+
+CONTACT_CACHE_SIZE = _env_int("CONTACT_CACHE_SIZE", 10000)
+
+
+class ContactNameCache:
+    """LRU of stored contact names keyed by ``(instance_id, phone)``.
+
+    The inbound path only writes a contact when it is unknown or its name
+    changed; entries are filled from the database on a miss.
+    """
+
+    def __init__(self, max_entries: int = CONTACT_CACHE_SIZE):
+        self.max_entries = max(1, max_entries)
+        self._entries: "OrderedDict[Tuple[str, str], str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, instance_id: str, phone: str) -> Optional[str]:
+        key = (instance_id, phone)
+        with self._lock:
+            name = self._entries.get(key)
+            if name is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return name
+
+    def put(self, instance_id: str, phone: str, name: str) -> None:
+        key = (instance_id, phone)
+        with self._lock:
+            self._entries[key] = name
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+_CONTACT_NAME_CACHE = ContactNameCache()
+
+# Inbound delivery counters for /api/admin/inbound/stats.
+_INBOUND_STATS = {'received': 0, 'stored': 0, 'duplicates': 0, 'invalid': 0,
+                  'contact_writes': 0, 'contact_writes_skipped': 0}
+_INBOUND_STATS_LOCK = threading.Lock()
+
+# Chat import batches are sized by the server: each reply recommends the batch
+# size that would take about CHAT_IMPORT_TARGET_SECONDS to upsert.
+CHAT_IMPORT_MIN_BATCH = 50
+CHAT_IMPORT_MAX_BATCH = _env_int("CHAT_IMPORT_MAX_BATCH", 2000)
+CHAT_IMPORT_TARGET_SECONDS = _env_float("CHAT_IMPORT_TARGET_SECONDS", 0.25)
+
+
+def _recommended_import_batch_size(batch_size: int, elapsed: float) -> int:
+    if batch_size <= 0:
+        return CHAT_IMPORT_MIN_BATCH
+    # Grow at most 4x per step so one fast, tiny batch does not overshoot.
+    scaled = batch_size * min(4.0, CHAT_IMPORT_TARGET_SECONDS / max(elapsed, 1e-3))
+    return int(max(CHAT_IMPORT_MIN_BATCH, min(CHAT_IMPORT_MAX_BATCH, scaled)))
+
+
+# Batch sends: one request fans out to many recipients. Dispatch is concurrent
+# but paced by a per-instance token bucket shared by every batch, so two
+# broadcasts on the same number do not add up past the limit.
+BATCH_SEND_MAX_RECIPIENTS = _env_int("BATCH_SEND_MAX_RECIPIENTS", 500)
+BATCH_SEND_CONCURRENCY = max(1, _env_int("BATCH_SEND_CONCURRENCY", 4))
+BATCH_SEND_RATE_PER_SECOND = _env_float("BATCH_SEND_RATE_PER_SECOND", 5.0)
+
+_SEND_RATE_LIMITERS: Dict[str, _RateLimiter] = {}
+_SEND_RATE_LIMITERS_LOCK = threading.Lock()
+
+
+def _send_rate_limiter(instance_id: str) -> _RateLimiter:
+    with _SEND_RATE_LIMITERS_LOCK:
+        limiter = _SEND_RATE_LIMITERS.get(instance_id)
+        if limiter is None:
+            limiter = _SEND_RATE_LIMITERS[instance_id] = _RateLimiter(BATCH_SEND_RATE_PER_SECOND)
+        return limiter
+
+
+def build_send_payload(data: Dict[str, Any]) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    """Build the Baileys ``/send`` payload (without ``to``) from a send request.
+
+    Media URLs are validated here, so a batch validates its shared media once.
+    Returns ``(payload, error)``.
+    """
+
+    message = data.get('message') or data.get('caption') or ''
+    message_type = (data.get('type', 'text') or 'text').strip().lower()
+    payload: Dict[str, Any] = {'type': 'text', 'message': message}
+    if message_type == 'text':
+        return payload, None
+
+    if data.get('imageData'):
+        return None, "Envio de base64 não é mais suportado. Utilize uma URL HTTP/HTTPS acessível."
+
+    media_url = (
+        data.get('mediaUrl') or
+        data.get('imageUrl') or
+        data.get('videoUrl') or
+        data.get('audioUrl') or
+        data.get('documentUrl') or
+        data.get('fileUrl')
+    )
+    if not media_url:
+        return None, "URL de mídia ausente"
+
+    sanitized_url, validation_error, _ = validate_remote_media_url(media_url)
+    if validation_error:
+        return None, validation_error
+
+    payload['type'] = message_type
+    payload['mediaUrl'] = sanitized_url
+    if message_type == 'document':
+        parsed = urllib.parse.urlparse(sanitized_url)
+        payload['fileName'] = os.path.basename(parsed.path) or 'documento'
+    return payload, None
+
+
+def _outgoing_message_row(instance_id: str, to: str, message: str) -> Tuple:
+    phone = to.replace('@s.whatsapp.net', '').replace('@c.us', '')
+    return (str(uuid.uuid4()), f"Para {phone[-4:]}", phone, message, 'outgoing', instance_id,
+            datetime.now(timezone.utc).isoformat())
+
+
+def _publish_outgoing_message(row: Tuple) -> None:
+    """Push a stored ``_outgoing_message_row`` to readers of its ``chat:`` topic."""
+    message_id, contact_name, phone, message, direction, instance_id, created_at = row
+    publish_event({
+        'type': 'new_message',
+        'message': {
+            'id': message_id,
+            'contact_name': contact_name,
+            'phone': phone,
+            'message': message,
+            'direction': direction,
+            'instance_id': instance_id,
+            'created_at': created_at,
+        }
+    }, f"chat:{instance_id}:{phone}")
+
+
 # HTTP Handler with Baileys integration
 class WhatsFlowRealHandler(BaseHTTPRequestHandler):
     def do_GET(self):
         if self.path == '/':
-            self.send_html_response(HTML_APP)
+            self.send_html_response(render_html_app())
         elif self.path == '/api/instances':
             self.handle_get_instances()
         elif self.path == '/api/stats':
@@ -9757,15 +14754,47 @@ class WhatsFlowRealHandler(BaseHTTPRequestHandler):
             self.handle_whatsapp_qr(instance_id)
         elif self.path.startswith('/api/messages?'):
             self.handle_get_messages_filtered()
+        elif self.path.split('?', 1)[0] == '/api/messages/changes':
+            self.handle_get_message_changes()
         elif self.path == '/api/webhooks':
             self.handle_get_webhooks()
         elif self.path == '/api/scheduled-messages':
             self.handle_get_scheduled_messages()
         elif self.path == '/api/settings/minio':
             self.handle_get_minio_settings()
+        elif self.path.split('?', 1)[0] == '/api/admin/scheduler/metrics':
+            self.handle_get_scheduler_metrics()
+        elif self.path.split('?', 1)[0] == '/api/admin/scheduler/metrics/hourly':
+            self.handle_get_scheduler_metrics_hourly()
+        elif self.path.split('?', 1)[0] == '/api/events':
+            self.handle_get_events()
+        elif self.path == '/api/admin/events/stats':
+            self.send_json_response(dict(_EVENT_BUS.stats(), log=_EVENT_LOG.stats()))
+        elif self.path == '/api/admin/inbound/stats':
+            self.handle_get_inbound_stats()
+        elif self.path == '/api/admin/media/stats':
+            self.handle_get_media_stats()
+        elif self.path == '/api/admin/media/cache':
+            self.send_json_response(_MEDIA_CACHE.stats())
+        elif self.path.startswith('/media-cache/'):
+            self.handle_media_cache()
+        elif self.path == '/api/admin/baileys/stats':
+            self.handle_get_baileys_client_stats()
+        elif self.path == '/api/admin/baileys/process':
+            self.handle_get_baileys_process_status()
+        elif self.path == '/api/admin/baileys/workers':
+            self.handle_get_baileys_workers()
+        elif self.path.startswith('/api/baileys/'):
+            self.handle_baileys_proxy('GET')
         else:
             self.send_error(404, "Not Found")
     
+    def do_HEAD(self):
+        if self.path.startswith('/media-cache/'):
+            self.handle_media_cache(head_only=True)
+        else:
+            self.send_error(404, "Not Found")
+
     def do_POST(self):
         if self.path == '/api/instances':
             self.handle_create_instance()
@@ -9777,6 +14806,8 @@ class WhatsFlowRealHandler(BaseHTTPRequestHandler):
             self.handle_disconnect_instance(instance_id)
         elif self.path == '/api/messages/receive':
             self.handle_receive_message()
+        elif self.path == '/api/messages/receive-batch':
+            self.handle_receive_message_batch()
         elif self.path == '/api/whatsapp/connected':
             self.handle_whatsapp_connected()
         elif self.path == '/api/whatsapp/disconnected':
@@ -9799,6 +14830,8 @@ class WhatsFlowRealHandler(BaseHTTPRequestHandler):
         elif self.path.startswith('/api/whatsapp/qr/'):
             instance_id = self.path.split('/')[-1]
             self.handle_whatsapp_qr(instance_id)
+        elif self.path == '/api/messages/send-batch':
+            self.handle_send_batch()
         elif self.path.startswith('/api/messages/send/'):
             instance_id = self.path.split('/')[-1]
             self.handle_send_message(instance_id)
@@ -9822,8 +14855,14 @@ class WhatsFlowRealHandler(BaseHTTPRequestHandler):
             self.handle_send_webhook()
         elif self.path == '/api/scheduled-messages':
             self.handle_create_scheduled_message()
+        elif self.path == '/api/scheduled-messages/recompute':
+            self.handle_recompute_scheduled_messages()
         elif self.path == '/api/settings/minio':
             self.handle_update_minio_settings()
+        elif self.path == '/api/admin/baileys/rebalance':
+            self.handle_rebalance_baileys_workers()
+        elif self.path.startswith('/api/baileys/'):
+            self.handle_baileys_proxy('POST')
         else:
             self.send_error(404, "Not Found")
     
@@ -9973,84 +15012,29 @@ class WhatsFlowRealHandler(BaseHTTPRequestHandler):
         try:
             # Start Baileys connection
             try:
-                import requests
-                response = requests.post(f'{API_BASE_URL}/connect', timeout=5)
-                
-                if response.status_code == 200:
-                    self.send_json_response({"success": True, "message": "Conexão iniciada"})
-                else:
-                    self.send_json_response({"error": "Erro ao iniciar conexão"}, 500)
-            except ImportError:
-                # Fallback usando urllib se requests não estiver disponível
-                import urllib.request
-                import urllib.error
-                
-                try:
-                    data = json.dumps({}).encode('utf-8')
-                    req = urllib.request.Request(f'{API_BASE_URL}/connect', data=data,
-                                               headers={'Content-Type': 'application/json'})
-                    req.get_method = lambda: 'POST'
-                    
-                    with urllib.request.urlopen(req, timeout=5) as response:
-                        if response.status == 200:
-                            self.send_json_response({"success": True, "message": "Conexão iniciada"})
-                        else:
-                            self.send_json_response({"error": "Erro ao iniciar conexão"}, 500)
-                except urllib.error.URLError as e:
-                    self.send_json_response({"error": f"Serviço WhatsApp indisponível: {str(e)}"}, 500)
-                
+                _BAILEYS_CLIENT.connect()
+                self.send_json_response({"success": True, "message": "Conexão iniciada"})
+            except BaileysUnavailableError as e:
+                self.send_json_response({"error": f"Serviço WhatsApp indisponível: {str(e)}"}, 500)
+            except BaileysError:
+                self.send_json_response({"error": "Erro ao iniciar conexão"}, 500)
+
         except Exception as e:
             self.send_json_response({"error": str(e)}, 500)
     
     def handle_whatsapp_status(self):
         try:
-            try:
-                import requests
-                response = requests.get(f'{API_BASE_URL}/status', timeout=5)
-                
-                if response.status_code == 200:
-                    data = response.json()
-                    self.send_json_response(data)
-                else:
-                    self.send_json_response({"connected": False, "connecting": False})
-            except ImportError:
-                # Fallback usando urllib
-                try:
-                    with urllib.request.urlopen(f'{API_BASE_URL}/status', timeout=5) as response:
-                        if response.status == 200:
-                            data = json.loads(response.read().decode('utf-8'))
-                            self.send_json_response(data)
-                        else:
-                            self.send_json_response({"connected": False, "connecting": False})
-                except:
-                    self.send_json_response({"connected": False, "connecting": False})
-                
+            self.send_json_response(_BAILEYS_CLIENT.status())
+        except BaileysError:
+            self.send_json_response({"connected": False, "connecting": False})
         except Exception as e:
             self.send_json_response({"connected": False, "connecting": False, "error": str(e)})
     
     def handle_whatsapp_qr(self):
         try:
-            try:
-                import requests
-                response = requests.get(f'{API_BASE_URL}/qr', timeout=5)
-                
-                if response.status_code == 200:
-                    data = response.json()
-                    self.send_json_response(data)
-                else:
-                    self.send_json_response({"qr": None, "connected": False})
-            except ImportError:
-                # Fallback usando urllib
-                try:
-                    with urllib.request.urlopen(f'{API_BASE_URL}/qr', timeout=5) as response:
-                        if response.status == 200:
-                            data = json.loads(response.read().decode('utf-8'))
-                            self.send_json_response(data)
-                        else:
-                            self.send_json_response({"qr": None, "connected": False})
-                except:
-                    self.send_json_response({"qr": None, "connected": False})
-                
+            self.send_json_response(_BAILEYS_CLIENT.qr())
+        except BaileysError:
+            self.send_json_response({"qr": None, "connected": False})
         except Exception as e:
             self.send_json_response({"qr": None, "connected": False, "error": str(e)})
     
@@ -10187,24 +15171,69 @@ class WhatsFlowRealHandler(BaseHTTPRequestHandler):
         )
 
     def handle_upload_media(self):
+        """Stream a multipart upload into MinIO without holding the file in memory."""
+        files = {}
         try:
-            form = cgi.FieldStorage(
-                fp=self.rfile,
-                headers=self.headers,
-                environ={
-                    'REQUEST_METHOD': 'POST',
-                    'CONTENT_TYPE': self.headers['Content-Type'],
-                },
+            try:
+                content_length = int(self.headers.get('Content-Length', 0))
+            except ValueError:
+                content_length = 0
+            started = time.perf_counter()
+            files, _fields = read_multipart_upload(
+                self.rfile, self.headers.get('Content-Type'), content_length
             )
-            file_item = form['file']
-            data = file_item.file.read()
-            url = upload_to_minio(file_item.filename, data)
-            self.send_json_response({'url': url})
+            received = time.perf_counter()
+            file_item = files.get('file')
+            if file_item is None:
+                raise UploadError("Campo 'file' não enviado")
+
+            result = store_media_object(
+                file_item.filename,
+                file_item.file,
+                length=file_item.size,
+                content_type=file_item.content_type or mimetypes.guess_type(file_item.filename)[0],
+                sha256=file_item.sha256,
+            )
+            stored = time.perf_counter()
+
+            receive_seconds = received - started
+            store_seconds = stored - received
+            size_mb = file_item.size / (1024 * 1024)
+            throughput = size_mb / (stored - started) if stored > started else 0.0
+            logger.info(
+                "📤 Upload %s: %.2f MB (recebido em %.2fs, MinIO %.2fs, %.2f MB/s%s%s)",
+                file_item.filename, size_mb, receive_seconds, store_seconds, throughput,
+                ", em disco" if file_item.spooled_to_disk else "",
+                ", já existente" if result['deduplicated'] else "",
+            )
+            self.send_json_response({
+                'url': result['url'],
+                'sha256': result['sha256'],
+                'deduplicated': result['deduplicated'],
+                'size': file_item.size,
+                'receiveSeconds': round(receive_seconds, 3),
+                'storeSeconds': round(store_seconds, 3),
+                'throughputMBps': round(throughput, 2),
+            })
+        except UploadError as e:
+            # The rest of a rejected body is not read; do not reuse the connection
+            self.close_connection = True
+            self.send_json_response({'error': str(e)}, e.status_code)
         except Exception as e:
             logger.exception("Erro no upload de mídia")
             self.send_json_response({'error': str(e)}, 500)
+        finally:
+            for uploaded in files.values():
+                uploaded.close()
 
     def handle_import_chats(self):
+        """Upsert a batch of chats (groups included) sent by the Baileys importer.
+
+        Each batch is two ``executemany`` upserts in one transaction. The reply
+        carries ``recommendedBatchSize`` so the importer grows or shrinks its
+        batches towards CHAT_IMPORT_TARGET_SECONDS of work per request;
+        progress goes out as ``chat_import_progress`` events.
+        """
         try:
             content_length = int(self.headers.get('Content-Length', 0))
             post_data = self.rfile.read(content_length)
@@ -10212,82 +15241,107 @@ class WhatsFlowRealHandler(BaseHTTPRequestHandler):
             
             instance_id = data.get('instanceId', 'default')
             chats = data.get('chats', [])
-            user = data.get('user', {})
+            user = data.get('user') or {}
             batch_number = data.get('batchNumber', 1)
-            total_batches = data.get('totalBatches', 1)
-            
-            conn = sqlite3.connect(DB_FILE)
-            cursor = conn.cursor()
-            
-            # Update instance with user info on first batch
-            if batch_number == 1:
-                cursor.execute("""
-                    UPDATE instances SET connected = 1, user_name = ?, user_id = ? 
-                    WHERE id = ?
-                """, (user.get('name', ''), user.get('id', ''), instance_id))
-                print(f"👤 Usuário atualizado: {user.get('name', '')} ({user.get('phone', '')})")
-            
-            # Import contacts and chats from this batch
-            imported_contacts = 0
-            imported_chats = 0
-            
+            total_batches = data.get('totalBatches')
+            total_chats = data.get('totalChats')
+            final = bool(data.get('final', total_batches is not None and batch_number == total_batches))
+
+            started = time.perf_counter()
+            now = datetime.now(timezone.utc).isoformat()
+            contacts: Dict[str, Tuple] = {}
+            chat_rows: Dict[str, Tuple] = {}
             for chat in chats:
-                if chat.get('id') and not chat['id'].endswith('@g.us'):  # Skip groups for now
-                    phone = chat['id'].replace('@s.whatsapp.net', '').replace('@c.us', '')
-                    contact_name = chat.get('name') or f"Contato {phone[-4:]}"
-                    
-                    # Check if contact exists
-                    cursor.execute("SELECT id FROM contacts WHERE phone = ? AND instance_id = ?", (phone, instance_id))
-                    if not cursor.fetchone():
-                        contact_id = str(uuid.uuid4())
-                        cursor.execute("""
-                            INSERT INTO contacts (id, name, phone, instance_id, created_at)
-                            VALUES (?, ?, ?, ?, ?)
-                        """, (contact_id, contact_name, phone, instance_id, datetime.now(timezone.utc).isoformat()))
-                        imported_contacts += 1
-                    
-                    # Create/update chat entry
-                    last_message = None
-                    last_message_time = None
-                    unread_count = chat.get('unreadCount', 0)
-                    
-                    # Try to get last message from chat
-                    if chat.get('messages') and len(chat['messages']) > 0:
-                        last_msg = chat['messages'][-1]
-                        if last_msg.get('message'):
-                            last_message = last_msg['message'].get('conversation') or 'Mídia'
-                            last_message_time = datetime.now(timezone.utc).isoformat()
-                    
-                    # Insert or update chat
-                    cursor.execute("SELECT id FROM chats WHERE contact_phone = ? AND instance_id = ?", (phone, instance_id))
-                    if cursor.fetchone():
-                        cursor.execute("""
-                            UPDATE chats SET contact_name = ?, last_message = ?, last_message_time = ?, unread_count = ?
-                            WHERE contact_phone = ? AND instance_id = ?
-                        """, (contact_name, last_message, last_message_time, unread_count, phone, instance_id))
-                    else:
-                        chat_id = str(uuid.uuid4())
-                        cursor.execute("""
-                            INSERT INTO chats (id, contact_phone, contact_name, instance_id, last_message, last_message_time, unread_count, created_at)
-                            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                        """, (chat_id, phone, contact_name, instance_id, last_message, last_message_time, unread_count, datetime.now(timezone.utc).isoformat()))
-                        imported_chats += 1
-            
-            conn.commit()
-            conn.close()
-            
-            print(f"📦 Lote {batch_number}/{total_batches} processado: {imported_contacts} contatos, {imported_chats} chats - Instância: {instance_id}")
-            
-            # If this is the last batch, log completion
-            if batch_number == total_batches:
-                print(f"✅ Importação completa para instância {instance_id}!")
+                jid = chat.get('id') if isinstance(chat, dict) else None
+                if not jid or jid == 'status@broadcast':
+                    continue
+                is_group = jid.endswith('@g.us')
+                # Groups keep their full JID so they are not mistaken for phone numbers
+                phone = jid if is_group else jid.replace('@s.whatsapp.net', '').replace('@c.us', '')
+                contact_name = chat.get('name') or chat.get('subject') or (
+                    f"Grupo {phone.split('@')[0][-4:]}" if is_group else f"Contato {phone[-4:]}"
+                )
+
+                last_message = chat.get('lastMessage')
+                last_message_time = chat.get('lastMessageTime')
+                if last_message is None and chat.get('messages'):
+                    # Older importers send raw Baileys chats
+                    last_msg = chat['messages'][-1]
+                    if last_msg.get('message'):
+                        last_message = last_msg['message'].get('conversation') or 'Mídia'
+                        last_message_time = now
+                if last_message is not None:
+                    last_message = str(last_message)[:100]
+
+                if not is_group:
+                    contacts[phone] = (str(uuid.uuid4()), contact_name, phone, instance_id, now)
+                chat_rows[phone] = (
+                    str(uuid.uuid4()), phone, contact_name, instance_id, last_message,
+                    last_message_time, chat.get('unreadCount') or 0, now,
+                )
+
+            with sqlite3.connect(DB_FILE, timeout=30) as conn:
+                cursor = conn.cursor()
+                # Update instance with user info on first batch
+                if batch_number == 1 and user:
+                    cursor.execute("""
+                        UPDATE instances SET connected = 1, user_name = ?, user_id = ? 
+                        WHERE id = ?
+                    """, (user.get('name', ''), user.get('id', ''), instance_id))
+
+                cursor.execute("SELECT COUNT(*) FROM contacts WHERE instance_id = ?", (instance_id,))
+                contacts_before = cursor.fetchone()[0]
+                cursor.execute("SELECT COUNT(*) FROM chats WHERE instance_id = ?", (instance_id,))
+                chats_before = cursor.fetchone()[0]
+
+                # Existing contacts keep their id and name
+                cursor.executemany("""
+                    INSERT INTO contacts (id, name, phone, instance_id, created_at)
+                    VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT(instance_id, phone) DO NOTHING
+                """, contacts.values())
+                cursor.executemany("""
+                    INSERT INTO chats (id, contact_phone, contact_name, instance_id, last_message, last_message_time, unread_count, created_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(instance_id, contact_phone) DO UPDATE SET
+                        contact_name = excluded.contact_name,
+                        last_message = COALESCE(excluded.last_message, chats.last_message),
+                        last_message_time = COALESCE(excluded.last_message_time, chats.last_message_time),
+                        unread_count = excluded.unread_count
+                """, chat_rows.values())
+
+                cursor.execute("SELECT COUNT(*) FROM contacts WHERE instance_id = ?", (instance_id,))
+                imported_contacts = cursor.fetchone()[0] - contacts_before
+                cursor.execute("SELECT COUNT(*) FROM chats WHERE instance_id = ?", (instance_id,))
+                imported_chats = cursor.fetchone()[0] - chats_before
+
+            elapsed = time.perf_counter() - started
+            recommended = _recommended_import_batch_size(len(chats), elapsed)
+
+            publish_event({
+                'type': 'chat_import_progress',
+                'instanceId': instance_id,
+                'batch': batch_number,
+                'totalBatches': total_batches,
+                'totalChats': total_chats,
+                'processed': int(data.get('offset') or 0) + len(chats),
+                'importedContacts': imported_contacts,
+                'importedChats': imported_chats,
+                'done': final,
+                'timestamp': now,
+            }, f"import:{instance_id}")
+            publish_stats_delta(contacts_count=imported_contacts, conversations_count=imported_contacts)
+            if final:
+                logger.info("✅ Importação de conversas concluída para instância %s", instance_id)
             
             self.send_json_response({
                 "success": True, 
                 "imported_contacts": imported_contacts,
                 "imported_chats": imported_chats,
                 "batch": batch_number,
-                "total_batches": total_batches
+                "total_batches": total_batches,
+                "elapsed": round(elapsed, 4),
+                "recommendedBatchSize": recommended,
             })
             
         except Exception as e:
@@ -10298,123 +15352,51 @@ class WhatsFlowRealHandler(BaseHTTPRequestHandler):
         try:
             # Start Baileys connection for specific instance
             try:
-                import requests
-                response = requests.post(f'{API_BASE_URL}/connect/{instance_id}', timeout=5)
-                
-                if response.status_code == 200:
-                    self.send_json_response({"success": True, "message": f"Conexão da instância {instance_id} iniciada"})
-                else:
-                    self.send_json_response({"error": "Erro ao iniciar conexão"}, 500)
-            except ImportError:
-                # Fallback usando urllib se requests não estiver disponível
-                import urllib.request
-                import urllib.error
-                
-                try:
-                    data = json.dumps({}).encode('utf-8')
-                    req = urllib.request.Request(f'{API_BASE_URL}/connect/{instance_id}', data=data,
-                                               headers={'Content-Type': 'application/json'})
-                    req.get_method = lambda: 'POST'
-                    
-                    with urllib.request.urlopen(req, timeout=5) as response:
-                        if response.status == 200:
-                            self.send_json_response({"success": True, "message": f"Conexão da instância {instance_id} iniciada"})
-                        else:
-                            self.send_json_response({"error": "Erro ao iniciar conexão"}, 500)
-                except urllib.error.URLError as e:
-                    self.send_json_response({"error": f"Serviço WhatsApp indisponível: {str(e)}"}, 500)
-                
+                _BAILEYS_CLIENT.connect(instance_id)
+                self.send_json_response({"success": True, "message": f"Conexão da instância {instance_id} iniciada"})
+            except BaileysUnavailableError as e:
+                self.send_json_response({"error": f"Serviço WhatsApp indisponível: {str(e)}"}, 500)
+            except BaileysError:
+                self.send_json_response({"error": "Erro ao iniciar conexão"}, 500)
+
         except Exception as e:
             self.send_json_response({"error": str(e)}, 500)
 
     def handle_disconnect_instance(self, instance_id):
         try:
             try:
-                import requests
-                response = requests.post(f'{API_BASE_URL}/disconnect/{instance_id}', timeout=5)
-                
-                if response.status_code == 200:
-                    # Update database
-                    conn = sqlite3.connect(DB_FILE)
-                    cursor = conn.cursor()
-                    cursor.execute("UPDATE instances SET connected = 0 WHERE id = ?", (instance_id,))
-                    conn.commit()
-                    conn.close()
-                    
-                    self.send_json_response({"success": True, "message": f"Instância {instance_id} desconectada"})
-                else:
-                    self.send_json_response({"error": "Erro ao desconectar"}, 500)
-            except ImportError:
-                # Fallback usando urllib
-                import urllib.request
-                data = json.dumps({}).encode('utf-8')
-                req = urllib.request.Request(f'{API_BASE_URL}/disconnect/{instance_id}', data=data,
-                                           headers={'Content-Type': 'application/json'})
-                req.get_method = lambda: 'POST'
-                
-                with urllib.request.urlopen(req, timeout=5) as response:
-                    if response.status == 200:
-                        conn = sqlite3.connect(DB_FILE)
-                        cursor = conn.cursor()
-                        cursor.execute("UPDATE instances SET connected = 0 WHERE id = ?", (instance_id,))
-                        conn.commit()
-                        conn.close()
-                        self.send_json_response({"success": True, "message": f"Instância {instance_id} desconectada"})
-                    else:
-                        self.send_json_response({"error": "Erro ao desconectar"}, 500)
-                        
+                _BAILEYS_CLIENT.disconnect(instance_id)
+            except BaileysUnavailableError:
+                raise
+            except BaileysError:
+                self.send_json_response({"error": "Erro ao desconectar"}, 500)
+                return
+
+            # Update database
+            conn = sqlite3.connect(DB_FILE)
+            cursor = conn.cursor()
+            cursor.execute("UPDATE instances SET connected = 0 WHERE id = ?", (instance_id,))
+            conn.commit()
+            conn.close()
+
+            self.send_json_response({"success": True, "message": f"Instância {instance_id} desconectada"})
+
         except Exception as e:
             self.send_json_response({"error": str(e)}, 500)
 
     def handle_whatsapp_status(self, instance_id):
         try:
-            try:
-                import requests
-                response = requests.get(f'{API_BASE_URL}/status/{instance_id}', timeout=5)
-                
-                if response.status_code == 200:
-                    data = response.json()
-                    self.send_json_response(data)
-                else:
-                    self.send_json_response({"connected": False, "connecting": False, "instanceId": instance_id})
-            except ImportError:
-                # Fallback usando urllib
-                try:
-                    with urllib.request.urlopen(f'{API_BASE_URL}/status/{instance_id}', timeout=5) as response:
-                        if response.status == 200:
-                            data = json.loads(response.read().decode('utf-8'))
-                            self.send_json_response(data)
-                        else:
-                            self.send_json_response({"connected": False, "connecting": False, "instanceId": instance_id})
-                except:
-                    self.send_json_response({"connected": False, "connecting": False, "instanceId": instance_id})
-                
+            self.send_json_response(_STATUS_MONITOR.get_status(instance_id))
+        except BaileysError:
+            self.send_json_response({"connected": False, "connecting": False, "instanceId": instance_id})
         except Exception as e:
             self.send_json_response({"connected": False, "connecting": False, "error": str(e), "instanceId": instance_id})
 
     def handle_whatsapp_qr(self, instance_id):
         try:
-            try:
-                import requests
-                response = requests.get(f'{API_BASE_URL}/qr/{instance_id}', timeout=5)
-                
-                if response.status_code == 200:
-                    data = response.json()
-                    self.send_json_response(data)
-                else:
-                    self.send_json_response({"qr": None, "connected": False, "instanceId": instance_id})
-            except ImportError:
-                # Fallback usando urllib
-                try:
-                    with urllib.request.urlopen(f'{API_BASE_URL}/qr/{instance_id}', timeout=5) as response:
-                        if response.status == 200:
-                            data = json.loads(response.read().decode('utf-8'))
-                            self.send_json_response(data)
-                        else:
-                            self.send_json_response({"qr": None, "connected": False, "instanceId": instance_id})
-                except:
-                    self.send_json_response({"qr": None, "connected": False, "instanceId": instance_id})
-                
+            self.send_json_response(_STATUS_MONITOR.get_qr(instance_id))
+        except BaileysError:
+            self.send_json_response({"qr": None, "connected": False, "instanceId": instance_id})
         except Exception as e:
             self.send_json_response({"qr": None, "connected": False, "error": str(e), "instanceId": instance_id})
 
@@ -10425,126 +15407,176 @@ class WhatsFlowRealHandler(BaseHTTPRequestHandler):
             data = json.loads(post_data.decode('utf-8'))
 
             to = data.get('to', '')
-            message = data.get('message') or data.get('caption') or ''
-            message_type = (data.get('type', 'text') or 'text').strip().lower()
+            payload, error = build_send_payload(data)
+            if error:
+                self.send_json_response({"error": error}, 400)
+                return
+            payload['to'] = to
+
+            try:
+                response = _BAILEYS_CLIENT.send(instance_id, payload)
+            except BaileysTimeoutError:
+                self.send_json_response({"error": "Timeout ao enviar mensagem"}, 504)
+                return
+            except BaileysUnavailableError:
+                self.send_json_response({"error": "Erro ao enviar mensagem"}, 500)
+                return
 
-            payload = {'to': to, 'type': 'text', 'message': message}
+            if response.status_code == 200:
+                conn = sqlite3.connect(DB_FILE)
+                cursor = conn.cursor()
 
-            if message_type != 'text':
-                if data.get('imageData'):
-                    self.send_json_response({
-                        "error": "Envio de base64 não é mais suportado. Utilize uma URL HTTP/HTTPS acessível."
-                    }, 400)
-                    return
+                row = _outgoing_message_row(instance_id, to, payload['message'])
+                cursor.execute("""
+                    INSERT INTO messages (id, contact_name, phone, message, direction, instance_id, created_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                """, row)
 
-                media_url = (
-                    data.get('mediaUrl') or
-                    data.get('imageUrl') or
-                    data.get('videoUrl') or
-                    data.get('audioUrl') or
-                    data.get('documentUrl') or
-                    data.get('fileUrl')
-                )
-                if not media_url:
-                    self.send_json_response({"error": "URL de mídia ausente"}, 400)
-                    return
+                conn.commit()
+                conn.close()
 
-                sanitized_url, validation_error, _ = validate_remote_media_url(media_url)
-                if validation_error:
-                    self.send_json_response({"error": validation_error}, 400)
-                    return
+                _publish_outgoing_message(row)
+                publish_stats_delta(messages_count=1)
 
-                payload['type'] = message_type
-                payload['mediaUrl'] = sanitized_url
+                self.send_json_response({"success": True, "instanceId": instance_id})
+            else:
+                self.send_json_response({"error": "Erro ao enviar mensagem"}, 500)
+                
+        except Exception as e:
+            self.send_json_response({"error": str(e)}, 500)
 
-                if message_type == 'document':
-                    parsed = urllib.parse.urlparse(sanitized_url)
-                    payload['fileName'] = os.path.basename(parsed.path) or 'documento'
+    def handle_send_batch(self):
+        """Send one message to many recipients, streaming one NDJSON line per result.
 
-            try:
-                import requests
-                for attempt in range(3):
-                    try:
-                        response = requests.post(
-                            f'{API_BASE_URL}/send/{instance_id}',
-                            json={k: v for k, v in payload.items() if k != 'imageData'},
-                            timeout=(10, 180)
-                        )
-                        break
-                    except requests.exceptions.Timeout:
-                        if attempt < 2:
-                            time.sleep(2 ** attempt)
-                            continue
-                        self.send_json_response({"error": "Timeout ao enviar mensagem"}, 504)
-                        return
+        Body: ``{"instanceId", "recipients": ["5511...", {"to", "message"}], "message",
+        "type", "mediaUrl", "concurrency"}``. Shared media is validated once, sends
+        run concurrently under the instance rate limit and every delivered message
+        is recorded in a single transaction before the final summary line.
+        """
+        try:
+            content_length = int(self.headers.get('Content-Length', 0))
+            data = json.loads(self.rfile.read(content_length).decode('utf-8'))
+        except (ValueError, UnicodeDecodeError):
+            self.send_json_response({"error": "JSON inválido"}, 400)
+            return
 
-                if response.status_code == 200:
-                    conn = sqlite3.connect(DB_FILE)
-                    cursor = conn.cursor()
+        instance_id = str(data.get('instanceId') or data.get('instance_id') or '').strip()
+        raw_recipients = data.get('recipients')
+        if not instance_id:
+            self.send_json_response({"error": "instanceId é obrigatório"}, 400)
+            return
+        if not isinstance(raw_recipients, list) or not raw_recipients:
+            self.send_json_response({"error": "Informe ao menos um destinatário em recipients"}, 400)
+            return
+        if len(raw_recipients) > BATCH_SEND_MAX_RECIPIENTS:
+            self.send_json_response({
+                "error": f"Máximo de {BATCH_SEND_MAX_RECIPIENTS} destinatários por lote"
+            }, 400)
+            return
 
-                    message_id = str(uuid.uuid4())
-                    phone = to.replace('@s.whatsapp.net', '').replace('@c.us', '')
+        payload, error = build_send_payload(data)
+        if error:
+            self.send_json_response({"error": error}, 400)
+            return
 
-                    cursor.execute("""
-                        INSERT INTO messages (id, contact_name, phone, message, direction, instance_id, created_at)
-                        VALUES (?, ?, ?, ?, ?, ?, ?)
-                    """, (message_id, f"Para {phone[-4:]}", phone, message, 'outgoing', instance_id,
-                          datetime.now(timezone.utc).isoformat()))
+        recipients = []
+        for item in raw_recipients:
+            if isinstance(item, dict):
+                to = str(item.get('to') or '').strip()
+                message = item.get('message') or payload['message']
+            else:
+                to, message = str(item or '').strip(), payload['message']
+            recipients.append((to, message))
 
-                    conn.commit()
-                    conn.close()
+        try:
+            concurrency = int(data.get('concurrency') or BATCH_SEND_CONCURRENCY)
+        except (TypeError, ValueError):
+            concurrency = BATCH_SEND_CONCURRENCY
+        concurrency = max(1, min(concurrency, BATCH_SEND_CONCURRENCY))
+        limiter = _send_rate_limiter(instance_id)
+
+        def dispatch(index: int, to: str, message: str) -> Dict[str, Any]:
+            result = {'index': index, 'to': to, 'success': False}
+            if not to:
+                result['error'] = "Destinatário vazio"
+                return result
+            result['waited'] = round(limiter.acquire(), 3)
+            started = time.perf_counter()
+            try:
+                response = _BAILEYS_CLIENT.send(instance_id, dict(payload, to=to, message=message))
+                result['success'] = response.status_code == 200
+                if not result['success']:
+                    result['error'] = f"HTTP {response.status_code}"
+            except BaileysTimeoutError:
+                result['error'] = "Timeout ao enviar mensagem"
+            except BaileysUnavailableError:
+                result['error'] = "Erro ao enviar mensagem"
+            result['latency'] = round(time.perf_counter() - started, 3)
+            return result
+
+        self.send_response(200)
+        self.send_header('Content-type', 'application/x-ndjson; charset=utf-8')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
 
-                    self.send_json_response({"success": True, "instanceId": instance_id})
-                else:
-                    self.send_json_response({"error": "Erro ao enviar mensagem"}, 500)
-            except ImportError:
-                import urllib.request
-                import urllib.error
-                import socket
-                safe_payload = {k: v for k, v in payload.items() if k != 'imageData'}
-                req_data = json.dumps(safe_payload).encode('utf-8')
-                req = urllib.request.Request(
-                    f'{API_BASE_URL}/send/{instance_id}',
-                    data=req_data,
-                    headers={'Content-Type': 'application/json'}
-                )
-                req.get_method = lambda: 'POST'
+        def emit(line: Dict[str, Any]) -> bool:
+            try:
+                self.wfile.write((json.dumps(line, ensure_ascii=False) + "\n").encode('utf-8'))
+                self.wfile.flush()
+                return True
+            except (BrokenPipeError, ConnectionResetError):
+                return False
 
-                for attempt in range(3):
-                    try:
-                        with urllib.request.urlopen(req, timeout=180) as response:
-                            if response.status == 200:
-                                conn = sqlite3.connect(DB_FILE)
-                                cursor = conn.cursor()
-
-                                message_id = str(uuid.uuid4())
-                                phone = to.replace('@s.whatsapp.net', '').replace('@c.us', '')
-
-                                cursor.execute("""
-                                    INSERT INTO messages (id, contact_name, phone, message, direction, instance_id, created_at)
-                                    VALUES (?, ?, ?, ?, ?, ?, ?)
-                                """, (message_id, f"Para {phone[-4:]}", phone, message, 'outgoing', instance_id,
-                                      datetime.now(timezone.utc).isoformat()))
-
-                                conn.commit()
-                                conn.close()
-
-                                self.send_json_response({"success": True, "instanceId": instance_id})
-                            else:
-                                self.send_json_response({"error": "Erro ao enviar mensagem"}, 500)
-                            break
-                    except urllib.error.URLError as e:
-                        if isinstance(getattr(e, 'reason', None), socket.timeout) and attempt < 2:
-                            time.sleep(2 ** attempt)
-                            continue
-                        if isinstance(getattr(e, 'reason', None), socket.timeout):
-                            self.send_json_response({"error": "Timeout ao enviar mensagem"}, 504)
-                        else:
-                            self.send_json_response({"error": "Erro ao enviar mensagem"}, 500)
-                        return
-                
-        except Exception as e:
-            self.send_json_response({"error": str(e)}, 500)
+        started = time.perf_counter()
+        rows = []
+        sent = failed = 0
+        client_connected = True
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="send-batch") as executor:
+            futures = [
+                executor.submit(dispatch, index, to, message)
+                for index, (to, message) in enumerate(recipients)
+            ]
+            for future in as_completed(futures):
+                try:
+                    result = future.result()
+                except Exception as exc:
+                    result = {'success': False, 'error': str(exc)}
+                if result['success']:
+                    sent += 1
+                    rows.append(_outgoing_message_row(
+                        instance_id, result['to'], recipients[result['index']][1]
+                    ))
+                else:
+                    failed += 1
+                if client_connected:
+                    # Keep sending even if the caller went away; only stop writing.
+                    client_connected = emit(result)
+
+        summary = {
+            'done': True,
+            'instanceId': instance_id,
+            'total': len(recipients),
+            'sent': sent,
+            'failed': failed,
+            'duration': round(time.perf_counter() - started, 3),
+        }
+        try:
+            if rows:
+                with sqlite3.connect(DB_FILE, timeout=30) as conn:
+                    conn.executemany("""
+                        INSERT INTO messages (id, contact_name, phone, message, direction, instance_id, created_at)
+                        VALUES (?, ?, ?, ?, ?, ?, ?)
+                    """, rows)
+                # Open conversations update like they do for single sends
+                for row in rows:
+                    _publish_outgoing_message(row)
+                publish_stats_delta(messages_count=len(rows))
+        except sqlite3.Error as exc:
+            logger.error("❌ Erro ao registrar mensagens do lote: %s", exc)
+            summary['error'] = f"Mensagens enviadas, mas não registradas: {exc}"
+        if client_connected:
+            emit(summary)
     
     def handle_whatsapp_connected(self):
         try:
@@ -10579,78 +15611,349 @@ class WhatsFlowRealHandler(BaseHTTPRequestHandler):
             content_length = int(self.headers.get('Content-Length', 0))
             post_data = self.rfile.read(content_length)
             data = json.loads(post_data.decode('utf-8'))
+
+            stored, _, invalid = self._ingest_inbound_messages([data])
+            if invalid:
+                self.send_json_response({"error": "Mensagem inválida: informe o remetente (from)"}, 400)
+                return
+            if not stored:
+                # Redelivery of a message we already have
+                self.send_json_response({"success": True, "duplicate": True,
+                                         "instanceId": data.get('instanceId', 'default')})
+                return
+            record = stored[0]
             
-            # Extract message info
-            instance_id = data.get('instanceId', 'default')
-            from_jid = data.get('from', '')
-            message = data.get('message', '')
-            timestamp = data.get('timestamp', datetime.now(timezone.utc).isoformat())
-            message_id = data.get('messageId', str(uuid.uuid4()))
-            message_type = data.get('messageType', 'text')
+            print(f"📥 Mensagem recebida na instância {record['instance_id']}")
+            print(f"👤 Contato: {record['contact_name']} ({record['phone']})")
+            print(f"💬 Mensagem: {record['message'][:50]}...")
             
-            # Extract real contact name from WhatsApp data
-            contact_name = data.get('pushName', data.get('contactName', ''))
+            self._broadcast_inbound_messages([record])
             
-            # Clean phone number
-            phone = from_jid.replace('@s.whatsapp.net', '').replace('@c.us', '')
+            self.send_json_response({"success": True, "instanceId": record['instance_id']})
             
-            # If no name provided, use formatted phone number
+        except Exception as e:
+            print(f"❌ Erro ao processar mensagem: {e}")
+            self.send_json_response({"error": str(e)}, 500)
+
+    def handle_receive_message_batch(self):
+        """Ingest ``{"messages": [...]}`` posted by the Baileys inbound buffer."""
+        try:
+            content_length = int(self.headers.get('Content-Length', 0))
+            data = json.loads(self.rfile.read(content_length).decode('utf-8'))
+            items = data.get('messages') if isinstance(data, dict) else data
+            if not isinstance(items, list):
+                self.send_json_response({"error": "Informe messages como lista"}, 400)
+                return
+
+            started = time.perf_counter()
+            records, duplicates, invalid = self._ingest_inbound_messages(items)
+            elapsed = time.perf_counter() - started
+            if invalid:
+                print(f"⚠️ {len(invalid)} mensagens inválidas ignoradas no lote (posições {invalid[:10]})")
+            if records:
+                instances = sorted({record['instance_id'] for record in records})
+                print(f"📥 {len(records)} mensagens recebidas ({', '.join(instances)}) em {elapsed * 1000:.0f}ms")
+                self._broadcast_inbound_messages(records)
+
+            self.send_json_response({"success": True, "received": len(records), "duplicates": duplicates,
+                                     "invalid": invalid})
+
+        except Exception as e:
+            print(f"❌ Erro ao processar lote de mensagens: {e}")
+            self.send_json_response({"error": str(e)}, 500)
+
+    def _ingest_inbound_messages(self, items):
+        """Store inbound messages, their contacts and chats in one transaction.
+
+        Messages are keyed on ``(instance_id, whatsapp_id)``: redeliveries hit
+        the unique index, are skipped and leave contacts and chats untouched.
+        Chats are upserted once per conversation, their unread count growing by
+        the number of new messages; contacts are only written when new or
+        renamed (see ``ContactNameCache``).
+        Fields are coerced to text item by item; items that are not objects or
+        lack a sender are skipped instead of failing the whole batch.
+        Returns ``(stored_records, duplicates, invalid_positions)``, records in
+        input order.
+        """
+        now = datetime.now(timezone.utc).isoformat()
+        records = []
+        invalid = []
+        for position, data in enumerate(items):
+            if not isinstance(data, dict):
+                invalid.append(position)
+                continue
+            instance_id = str(data.get('instanceId') or 'default')
+            phone = str(data.get('from') or '').replace('@s.whatsapp.net', '').replace('@c.us', '').strip()
+            if not phone:
+                invalid.append(position)
+                continue
+
+            # Use the WhatsApp name when provided, the formatted phone otherwise
+            contact_name = str(data.get('pushName') or data.get('contactName') or '')
             if not contact_name or contact_name == phone:
-                formatted_phone = self.format_phone_number(phone)
-                contact_name = formatted_phone
-            
-            # Save message and create/update contact
-            conn = sqlite3.connect(DB_FILE)
-            cursor = conn.cursor()
-            
-            # Create or update contact with real name
-            contact_id = f"{phone}_{instance_id}"
-            cursor.execute("""
-                INSERT OR REPLACE INTO contacts (id, name, phone, instance_id, created_at)
+                contact_name = self.format_phone_number(phone)
+
+            records.append({
+                'id': str(uuid.uuid4()),
+                'contact_name': contact_name,
+                'phone': phone,
+                'message': str(data.get('message') or ''),
+                'direction': 'incoming',
+                'instance_id': instance_id,
+                'message_type': str(data.get('messageType') or 'text'),
+                'whatsapp_id': str(data.get('messageId') or uuid.uuid4()),
+                'created_at': str(data.get('timestamp') or now),
+            })
+
+        if invalid:
+            with _INBOUND_STATS_LOCK:
+                _INBOUND_STATS['invalid'] += len(invalid)
+        if not records:
+            return [], 0, invalid
+
+        stored = []
+        with sqlite3.connect(DB_FILE, timeout=30) as conn:
+            for record in records:
+                cursor = conn.execute("""
+                    INSERT INTO messages (id, contact_name, phone, message, direction, instance_id, message_type, whatsapp_id, created_at)
+                    VALUES (:id, :contact_name, :phone, :message, :direction, :instance_id, :message_type, :whatsapp_id, :created_at)
+                    ON CONFLICT(instance_id, whatsapp_id) DO NOTHING
+                """, record)
+                if cursor.rowcount:
+                    stored.append(record)
+
+            contacts: Dict[str, Tuple] = {}
+            chats: Dict[str, list] = {}
+            for record in stored:
+                phone, instance_id = record['phone'], record['instance_id']
+                contact_name, timestamp = record['contact_name'], record['created_at']
+                key = f"{phone}_{instance_id}"
+                contacts[key] = (key, contact_name, phone, instance_id, timestamp)
+                chat = chats.get(key)
+                if chat is None:
+                    chats[key] = [key, phone, contact_name, instance_id, record['message'][:100], timestamp, 1, timestamp]
+                else:
+                    chat[2], chat[4], chat[5], chat[7] = contact_name, record['message'][:100], timestamp, timestamp
+                    chat[6] += 1
+
+            # Skip contacts whose stored name is already the one we have
+            contact_writes = []
+            new_contacts = 0
+            for row in contacts.values():
+                _, name, phone, instance_id, _ = row
+                known = _CONTACT_NAME_CACHE.get(instance_id, phone)
+                if known is None:
+                    found = conn.execute(
+                        "SELECT name FROM contacts WHERE instance_id = ? AND phone = ?", (instance_id, phone)
+                    ).fetchone()
+                    known = found[0] if found else None
+                    new_contacts += found is None
+                if known != name:
+                    contact_writes.append(row)
+            conn.executemany("""
+                INSERT INTO contacts (id, name, phone, instance_id, created_at)
                 VALUES (?, ?, ?, ?, ?)
-            """, (contact_id, contact_name, phone, instance_id, timestamp))
-            
-            # Save message
-            msg_id = str(uuid.uuid4())
-            cursor.execute("""
-                INSERT INTO messages (id, contact_name, phone, message, direction, instance_id, message_type, whatsapp_id, created_at)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (msg_id, contact_name, phone, message, 'incoming', instance_id, message_type, message_id, timestamp))
-            
-            # Create or update chat conversation
-            chat_id = f"{phone}_{instance_id}"
-            cursor.execute("""
-                INSERT OR REPLACE INTO chats (id, contact_phone, contact_name, instance_id, last_message, last_message_time, unread_count, created_at)
-                VALUES (?, ?, ?, ?, ?, ?, COALESCE((SELECT unread_count FROM chats WHERE id = ?), 0) + 1, ?)
-            """, (chat_id, phone, contact_name, instance_id, message[:100], timestamp, chat_id, timestamp))
-            
-            conn.commit()
-            conn.close()
-            
-            print(f"📥 Mensagem recebida na instância {instance_id}")
-            print(f"👤 Contato: {contact_name} ({phone})")
-            print(f"💬 Mensagem: {message[:50]}...")
-            
-            # Broadcast via WebSocket if available
-            if WEBSOCKETS_AVAILABLE and websocket_clients:
-                asyncio.create_task(broadcast_message({
-                    'type': 'new_message',
-                    'message': {
-                        'id': msg_id,
-                        'contact_name': contact_name,
-                        'phone': phone,
-                        'message': message,
-                        'direction': 'incoming',
-                        'instance_id': instance_id,
-                        'created_at': timestamp
-                    }
-                }))
-            
-            self.send_json_response({"success": True, "instanceId": instance_id})
-            
+                ON CONFLICT(instance_id, phone) DO UPDATE SET name = excluded.name
+            """, contact_writes)
+            conn.executemany("""
+                INSERT INTO chats (id, contact_phone, contact_name, instance_id, last_message, last_message_time, unread_count, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(instance_id, contact_phone) DO UPDATE SET
+                    contact_name = excluded.contact_name,
+                    last_message = excluded.last_message,
+                    last_message_time = excluded.last_message_time,
+                    unread_count = COALESCE(chats.unread_count, 0) + excluded.unread_count
+            """, [tuple(chat) for chat in chats.values()])
+
+        # Only after commit, so a rolled-back write is never remembered
+        for _, name, phone, instance_id, _ in contacts.values():
+            _CONTACT_NAME_CACHE.put(instance_id, phone, name)
+
+        duplicates = len(records) - len(stored)
+        publish_stats_delta(messages_count=len(stored), contacts_count=new_contacts,
+                            conversations_count=new_contacts)
+        with _INBOUND_STATS_LOCK:
+            _INBOUND_STATS['received'] += len(records)
+            _INBOUND_STATS['stored'] += len(stored)
+            _INBOUND_STATS['duplicates'] += duplicates
+            _INBOUND_STATS['contact_writes'] += len(contact_writes)
+            _INBOUND_STATS['contact_writes_skipped'] += len(contacts) - len(contact_writes)
+        return stored, duplicates, invalid
+
+    def handle_get_events(self):
+        """Event stream over plain HTTP: SSE when asked for, long-poll JSON otherwise.
+
+        Query: ``topics`` (comma separated, same patterns as the WebSocket
+        channel), ``since`` (cursor from the previous response) and ``timeout``
+        for long-poll. A ``Last-Event-ID`` header wins over ``since``: it is
+        what EventSource sends on reconnect, while ``since`` in the URL stays
+        at the value the stream was first opened with.
+        """
+        query_params = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+        topics = {
+            topic.strip()
+            for value in query_params.get('topics', [])
+            for topic in value.split(',') if topic.strip()
+        }
+        last_event_id = self.headers.get('Last-Event-ID')
+        since_raw = last_event_id or query_params.get('since', [None])[0]
+        try:
+            since = int(since_raw) if since_raw not in (None, '') else None
+            timeout = float(query_params.get('timeout', [EVENT_LONG_POLL_TIMEOUT])[0])
+        except ValueError:
+            self.send_json_response({"error": "since e timeout devem ser numéricos"}, 400)
+            return
+        timeout = min(max(timeout, 0.0), 60.0)
+        if since is None:
+            since = _EVENT_LOG.cursor
+
+        accept = self.headers.get('Accept') or ''
+        if 'text/event-stream' in accept or query_params.get('stream', [''])[0] == 'sse':
+            self._stream_events(since, topics, resumed=bool(last_event_id))
+            return
+
+        events, cursor, missed = _EVENT_LOG.wait(since, topics, timeout)
+        # Events are stored serialized; splice them instead of re-encoding
+        body = '{"cursor": %d, "reset": %s, "events": [%s]}' % (
+            cursor, 'true' if missed else 'false', ', '.join(message for _, message in events)
+        )
+        self.send_response(200)
+        self.send_header('Content-type', 'application/json; charset=utf-8')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        self.wfile.write(body.encode('utf-8'))
+
+    def _stream_events(self, cursor: int, topics: Set[str], resumed: bool = False):
+        self.send_response(200)
+        self.send_header('Content-type', 'text/event-stream; charset=utf-8')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('X-Accel-Buffering', 'no')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        self.close_connection = True
+        try:
+            # ``ready`` carries the starting cursor so clients can resume from it.
+            # A resumed stream already has that id; repeating it could only move
+            # the client's Last-Event-ID backwards.
+            ready_id = '' if resumed else 'id: %d\n' % cursor
+            self.wfile.write(('retry: 3000\n%sevent: ready\ndata: {"cursor": %d}\n\n' % (ready_id, cursor)).encode('utf-8'))
+            self.wfile.flush()
+            while True:
+                events, cursor, missed = _EVENT_LOG.wait(cursor, topics, EVENT_SSE_HEARTBEAT)
+                chunks = []
+                if missed:
+                    chunks.append('event: reset\ndata: {"cursor": %d}\n\n' % cursor)
+                for seq, message in events:
+                    chunks.append(f"id: {seq}\ndata: {message}\n\n")
+                if not chunks:
+                    chunks.append(": keepalive\n\n")
+                self.wfile.write(''.join(chunks).encode('utf-8'))
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def handle_media_cache(self, head_only: bool = False):
+        """Serve a cached media object, honouring single ``Range: bytes=`` requests."""
+        key = self.path.split('?', 1)[0].rsplit('/', 1)[-1]
+        entry = _MEDIA_CACHE.get(key)
+        if entry is None:
+            self.send_error(404, "Not Found")
+            return
+        size = entry['size']
+        start, end = 0, size - 1
+        status = 200
+        range_header = self.headers.get('Range')
+        if range_header and range_header.startswith('bytes=') and ',' not in range_header:
+            first, _, last = range_header[6:].strip().partition('-')
+            try:
+                if first:
+                    start = int(first)
+                    end = min(int(last), size - 1) if last else size - 1
+                else:
+                    start = max(0, size - int(last))
+            except ValueError:
+                start, end = 0, size - 1
+            else:
+                if start >= size or start > end:
+                    self.send_response(416)
+                    self.send_header('Content-Range', f"bytes */{size}")
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                status = 206
+
+        length = end - start + 1 if size else 0
+        self.send_response(status)
+        self.send_header('Content-Type', entry.get('content_type') or 'application/octet-stream')
+        self.send_header('Content-Length', str(length))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Cache-Control', 'public, max-age=86400')
+        if status == 206:
+            self.send_header('Content-Range', f"bytes {start}-{end}/{size}")
+        self.end_headers()
+        if head_only or not length:
+            return
+        try:
+            with open(entry['path'], 'rb') as handle:
+                handle.seek(start)
+                remaining = length
+                while remaining > 0:
+                    chunk = handle.read(min(UPLOAD_READ_CHUNK, remaining))
+                    if not chunk:
+                        break
+                    self.wfile.write(chunk)
+                    remaining -= len(chunk)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        except OSError as exc:
+            # Evicted while being served; the response is already committed
+            logger.warning("⚠️ Mídia %s indisponível no cache: %s", key, exc)
+            self.close_connection = True
+
+    def handle_get_media_stats(self):
+        """Upload deduplication: counters since start plus totals from media_objects."""
+        try:
+            with _MEDIA_DEDUP_LOCK:
+                stats = dict(_MEDIA_DEDUP_STATS)
+            with sqlite3.connect(DB_FILE, timeout=30) as conn:
+                objects, stored_bytes, hits, saved_bytes = conn.execute(
+                    "SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(hits), 0), "
+                    "COALESCE(SUM(hits * size), 0) FROM media_objects"
+                ).fetchone()
+            stats.update({
+                'objects': objects,
+                'stored_bytes': stored_bytes,
+                'deduplicated_total': hits,
+                'bytes_saved_total': saved_bytes,
+            })
+            self.send_json_response(stats)
         except Exception as e:
-            print(f"❌ Erro ao processar mensagem: {e}")
             self.send_json_response({"error": str(e)}, 500)
+
+    def handle_get_inbound_stats(self):
+        """Counters of inbound deliveries, skipped duplicates and skipped contact writes."""
+        with _INBOUND_STATS_LOCK:
+            stats = dict(_INBOUND_STATS)
+        stats['duplicate_ratio'] = round(stats['duplicates'] / stats['received'], 4) if stats['received'] else 0.0
+        stats['contact_cache'] = _CONTACT_NAME_CACHE.stats()
+        self.send_json_response(stats)
+
+    def _broadcast_inbound_messages(self, records):
+        # Broadcast via WebSocket if available
+        for record in records:
+            publish_event({
+                'type': 'new_message',
+                'message': {
+                    'id': record['id'],
+                    'contact_name': record['contact_name'],
+                    'phone': record['phone'],
+                    'message': record['message'],
+                    'direction': 'incoming',
+                    'instance_id': record['instance_id'],
+                    'created_at': record['created_at']
+                }
+            }, f"chat:{record['instance_id']}:{record['phone']}")
     
     def format_phone_number(self, phone):
         """Format phone number for Brazilian display"""
@@ -10706,35 +16009,54 @@ class WhatsFlowRealHandler(BaseHTTPRequestHandler):
             print(f"❌ Erro ao buscar chats: {e}")
             self.send_json_response({"error": str(e)}, 500)
 
+    def _conversation_filter(self, query_params):
+        """WHERE clause and params for ``phone`` (+ optional ``instance_id``) queries."""
+        phone = query_params.get('phone', [None])[0]
+        instance_id = query_params.get('instance_id', [None])[0]
+        if instance_id:
+            return phone, "phone = ? AND instance_id = ?", [phone, instance_id]
+        return phone, "phone = ?", [phone]
+
     def handle_get_messages_filtered(self):
+        """Messages of one conversation; ``since`` returns only rows after that cursor.
+
+        Every row carries ``cursor`` (its rowid). Clients keep the highest one
+        and ask for ``since=<cursor>`` on the next refresh.
+        """
         try:
             # Parse query parameters
             query_components = urllib.parse.urlparse(self.path)
             query_params = urllib.parse.parse_qs(query_components.query)
             
-            phone = query_params.get('phone', [None])[0]
-            instance_id = query_params.get('instance_id', [None])[0]
+            phone, where, params = self._conversation_filter(query_params)
             
             if not phone:
                 self.send_json_response({"error": "Phone parameter required"}, 400)
                 return
+
+            since = query_params.get('since', [None])[0]
+            try:
+                since = int(since) if since not in (None, '') else None
+            except ValueError:
+                self.send_json_response({"error": "since deve ser numérico"}, 400)
+                return
             
             conn = sqlite3.connect(DB_FILE)
             conn.row_factory = sqlite3.Row
             cursor = conn.cursor()
             
-            if instance_id:
-                cursor.execute("""
-                    SELECT * FROM messages 
-                    WHERE phone = ? AND instance_id = ? 
+            if since is None:
+                cursor.execute(f"""
+                    SELECT rowid AS cursor, * FROM messages 
+                    WHERE {where} 
                     ORDER BY created_at ASC
-                """, (phone, instance_id))
+                """, params)
             else:
-                cursor.execute("""
-                    SELECT * FROM messages 
-                    WHERE phone = ? 
-                    ORDER BY created_at ASC
-                """, (phone,))
+                cursor.execute(f"""
+                    SELECT rowid AS cursor, * FROM messages 
+                    WHERE {where} AND rowid > ? 
+                    ORDER BY rowid ASC
+                """, params + [since])
             
             messages = [dict(row) for row in cursor.fetchall()]
             conn.close()
@@ -10745,6 +16067,31 @@ class WhatsFlowRealHandler(BaseHTTPRequestHandler):
             print(f"❌ Erro ao buscar mensagens filtradas: {e}")
             self.send_json_response({"error": str(e)}, 500)
 
+    def handle_get_message_changes(self):
+        """Cheap refresh check: latest cursor of a conversation and whether it moved past ``since``."""
+        try:
+            query_params = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+            phone, where, params = self._conversation_filter(query_params)
+            if not phone:
+                self.send_json_response({"error": "Phone parameter required"}, 400)
+                return
+            try:
+                since = int(query_params.get('since', ['0'])[0] or 0)
+            except ValueError:
+                self.send_json_response({"error": "since deve ser numérico"}, 400)
+                return
+
+            with sqlite3.connect(DB_FILE, timeout=30) as conn:
+                row = conn.execute(
+                    f"SELECT rowid FROM messages WHERE {where} ORDER BY rowid DESC LIMIT 1", params
+                ).fetchone()
+            latest = row[0] if row else 0
+            # A cursor below ``since`` means messages were removed: also a change
+            self.send_json_response({"changed": latest != since, "cursor": latest})
+        except Exception as e:
+            print(f"❌ Erro ao verificar mensagens novas: {e}")
+            self.send_json_response({"error": str(e)}, 500)
+
     def handle_send_webhook(self):
         try:
             content_length = int(self.headers.get('Content-Length', 0))
@@ -11322,7 +16669,11 @@ class WhatsFlowRealHandler(BaseHTTPRequestHandler):
             cursor = conn.cursor()
             
             cursor.execute("""
-                SELECT * FROM scheduled_messages
+                SELECT id, campaign_id, message_text, message_type, media_url,
+                       schedule_type, schedule_time, schedule_days, schedule_date,
+                       is_active, next_run, created_at,
+                       cron_expression, timezone, catch_up_policy
+                FROM scheduled_messages
                 WHERE campaign_id = ?
                 ORDER BY created_at DESC
             """, (campaign_id,))
@@ -11341,7 +16692,10 @@ class WhatsFlowRealHandler(BaseHTTPRequestHandler):
                     'schedule_date': row[8],
                     'is_active': bool(row[9]),
                     'next_run': row[10],
-                    'created_at': row[11]
+                    'created_at': row[11],
+                    'cron_expression': row[12],
+                    'timezone': row[13],
+                    'catch_up_policy': row[14]
                 })
             
             conn.close()
@@ -11362,6 +16716,12 @@ class WhatsFlowRealHandler(BaseHTTPRequestHandler):
             schedule_time = data['schedule_time']
             print(f"📥 Received schedule_time for campaign schedule: {schedule_time}")
 
+            try:
+                catch_up_policy = normalize_catch_up_policy(data.get('catch_up_policy'))
+            except ValueError as exc:
+                self.send_json_response({"error": str(exc)}, 400)
+                return
+
             conn = sqlite3.connect(DB_FILE)
             cursor = conn.cursor()
 
@@ -11370,18 +16730,22 @@ class WhatsFlowRealHandler(BaseHTTPRequestHandler):
                 data['schedule_type'],
                 schedule_time,
                 data.get('schedule_days'),
-                data.get('schedule_date')
+                data.get('schedule_date'),
+                data.get('cron_expression'),
+                data.get('timezone')
             )
 
             cursor.execute("""
                 INSERT INTO scheduled_messages
                 (id, campaign_id, message_text, schedule_type, schedule_time, schedule_days,
-                 schedule_date, is_active, next_run, created_at)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                 schedule_date, is_active, next_run, created_at,
+                 cron_expression, timezone, catch_up_policy)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
             """, (schedule_id, campaign_id, data['message_text'], data['schedule_type'],
                   schedule_time, json.dumps(data.get('schedule_days')),
                   data.get('schedule_date'), data.get('is_active', True),
-                  next_run, datetime.now(timezone.utc).isoformat()))
+                  next_run, datetime.now(timezone.utc).isoformat(),
+                  data.get('cron_expression'), data.get('timezone'), catch_up_policy))
 
             conn.commit()
             cursor.execute("SELECT schedule_time FROM scheduled_messages WHERE id = ?", (schedule_id,))
@@ -11435,63 +16799,13 @@ class WhatsFlowRealHandler(BaseHTTPRequestHandler):
             print(f"❌ Erro ao obter histórico da campanha: {e}")
             self.send_json_response({"error": str(e)}, 500)
 
-    def calculate_next_run(self, schedule_type, schedule_time, schedule_days=None, schedule_date=None):
+    def calculate_next_run(self, schedule_type, schedule_time, schedule_days=None, schedule_date=None,
+                           cron_expression=None, tz_name=None):
         """Calculate next execution time for scheduled message"""
         try:
-            from datetime import datetime, timedelta
-            import time
-            import pytz
-
-            brazil_tz = pytz.timezone('America/Sao_Paulo')
-            now = datetime.now(brazil_tz)
-            hour, minute = map(int, schedule_time.split(':'))
-
-            if schedule_type == 'once':
-                if schedule_date:
-                    target_date = datetime.strptime(schedule_date, '%Y-%m-%d')
-                    target_datetime = brazil_tz.localize(
-                        target_date.replace(hour=hour, minute=minute, second=0, microsecond=0)
-                    )
-                    if target_datetime > now:
-                        return target_datetime.isoformat()
-                return None
-            
-            elif schedule_type == 'daily':
-                next_run = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
-                if next_run <= now:
-                    next_run += timedelta(days=1)
-                return next_run.isoformat()
-            
-            elif schedule_type == 'weekly':
-                if not schedule_days:
-                    return None
-                
-                weekdays = {
-                    'monday': 0, 'tuesday': 1, 'wednesday': 2, 'thursday': 3,
-                    'friday': 4, 'saturday': 5, 'sunday': 6
-                }
-                
-                current_weekday = now.weekday()
-                target_weekdays = [weekdays[day.lower()] for day in schedule_days if day.lower() in weekdays]
-                
-                if not target_weekdays:
-                    return None
-                
-                # Find next occurrence
-                for i in range(7):
-                    check_date = now + timedelta(days=i)
-                    if check_date.weekday() in target_weekdays:
-                        next_run = check_date.replace(hour=hour, minute=minute, second=0, microsecond=0)
-                        if next_run > now:
-                            return next_run.isoformat()
-                
-                # Fallback to next week
-                next_run = now + timedelta(days=7)
-                next_run = next_run.replace(hour=hour, minute=minute, second=0, microsecond=0)
-                return next_run.isoformat()
-            
-            return None
-            
+            return compute_next_run(
+                schedule_type, schedule_time, schedule_days, schedule_date, cron_expression, tz_name
+            )
         except Exception as e:
             print(f"❌ Erro ao calcular próxima execução: {e}")
             return None
@@ -11534,8 +16848,11 @@ class WhatsFlowRealHandler(BaseHTTPRequestHandler):
             cursor = conn.cursor()
             
             cursor.execute("""
-                SELECT sm.*,
-                       COUNT(smg.group_id) as groups_count
+                SELECT sm.id, sm.campaign_id, sm.message_text, sm.message_type, sm.media_url,
+                       sm.schedule_type, sm.schedule_time, sm.schedule_days, sm.schedule_date,
+                       sm.is_active, sm.next_run, sm.created_at,
+                       COUNT(smg.group_id) as groups_count,
+                       sm.cron_expression, sm.timezone, sm.catch_up_policy
                 FROM scheduled_messages sm
                 LEFT JOIN scheduled_message_groups smg ON sm.id = smg.message_id
                 WHERE sm.campaign_id = ?
@@ -11565,7 +16882,10 @@ class WhatsFlowRealHandler(BaseHTTPRequestHandler):
                     'is_active': is_active,
                     'next_run': next_run,
                     'created_at': created_at,
-                    'groups_count': groups_count
+                    'groups_count': groups_count,
+                    'cron_expression': row[13],
+                    'timezone': row[14],
+                    'catch_up_policy': row[15]
                 })
             
             conn.close()
@@ -11584,7 +16904,11 @@ class WhatsFlowRealHandler(BaseHTTPRequestHandler):
             cursor = conn.cursor()
             
             cursor.execute("""
-                SELECT sm.*, smg.group_id, smg.group_name, smg.instance_id
+                SELECT sm.id, sm.campaign_id, sm.message_text, sm.message_type, sm.media_url,
+                       sm.schedule_type, sm.schedule_time, sm.schedule_days, sm.schedule_date,
+                       sm.is_active, sm.next_run, sm.created_at,
+                       smg.group_id, smg.group_name, smg.instance_id,
+                       sm.cron_expression, sm.timezone, sm.catch_up_policy
                 FROM scheduled_messages sm
                 LEFT JOIN scheduled_message_groups smg ON sm.id = smg.message_id
                 ORDER BY sm.created_at DESC
@@ -11592,7 +16916,7 @@ class WhatsFlowRealHandler(BaseHTTPRequestHandler):
             
             messages = []
             for row in cursor.fetchall():
-                # Map columns from SELECT sm.*, smg.group_id, smg.group_name, smg.instance_id
+                # Map columns from the explicit SELECT list above
                 schedule_date = row[8]
                 is_active = bool(row[9])
                 next_run = row[10]
@@ -11616,7 +16940,10 @@ class WhatsFlowRealHandler(BaseHTTPRequestHandler):
                     'created_at': created_at,
                     'group_id': group_id,
                     'group_name': group_name,
-                    'instance_id': instance_id
+                    'instance_id': instance_id,
+                    'cron_expression': row[15],
+                    'timezone': row[16],
+                    'catch_up_policy': row[17]
                 })
             
             conn.close()
@@ -11657,7 +16984,9 @@ class WhatsFlowRealHandler(BaseHTTPRequestHandler):
                 self.send_json_response({"error": "Tipo de mensagem inválido"}, 400)
                 return
 
-            if not all([group_id, group_name, instance_id, schedule_type, schedule_time]):
+            if not all([group_id, group_name, instance_id, schedule_type]) or (
+                not schedule_time and schedule_type != 'cron'
+            ):
                 self.send_json_response({"error": "Campos obrigatórios faltando"}, 400)
                 return
 
@@ -11667,6 +16996,17 @@ class WhatsFlowRealHandler(BaseHTTPRequestHandler):
                 }, 400)
                 return
 
+            cron_expression = (data.get('cron_expression') or '').strip() or None
+            tz_name = (data.get('timezone') or '').strip() or None
+            try:
+                catch_up_policy = normalize_catch_up_policy(data.get('catch_up_policy'))
+                rule = RecurrenceRule(
+                    schedule_type, schedule_time, schedule_days, schedule_date, cron_expression, tz_name
+                )
+            except ValueError as exc:
+                self.send_json_response({"error": str(exc)}, 400)
+                return
+
             if message_type != 'text':
                 if not media_url:
                     self.send_json_response({"error": "URL de mídia é obrigatória para mensagens de mídia"}, 400)
@@ -11679,64 +17019,14 @@ class WhatsFlowRealHandler(BaseHTTPRequestHandler):
             else:
                 media_url = ''
 
-            # Calculate next run using Brazil timezone
-            from datetime import datetime, timedelta
-            import pytz
-            
-            brazil_tz = pytz.timezone('America/Sao_Paulo')
-            now_brazil = datetime.now(brazil_tz)
-            
-            # Parse schedule time
-            hour, minute = map(int, schedule_time.split(':'))
-            
-            if schedule_type == 'once':
-                if not schedule_date:
-                    self.send_json_response({"error": "Data é obrigatória para envio único"}, 400)
-                    return
-                    
-                target_date = datetime.strptime(schedule_date, '%Y-%m-%d')
-                target_datetime = brazil_tz.localize(target_date.replace(hour=hour, minute=minute, second=0))
-                
-                if target_datetime <= now_brazil:
+            next_occurrence = rule.next_after()
+            if next_occurrence is None:
+                if rule.schedule_type == 'once':
                     self.send_json_response({"error": "Data/horário deve ser no futuro"}, 400)
-                    return
-                    
-                next_run = target_datetime.isoformat()
-                
-            elif schedule_type == 'weekly':
-                if not schedule_days or len(schedule_days) == 0:
-                    self.send_json_response({"error": "Pelo menos um dia da semana é obrigatório"}, 400)
-                    return
-                    
-                # Calculate next weekly occurrence
-                weekdays = {
-                    'monday': 0, 'tuesday': 1, 'wednesday': 2, 'thursday': 3,
-                    'friday': 4, 'saturday': 5, 'sunday': 6
-                }
-                
-                target_weekdays = [weekdays[day] for day in schedule_days if day in weekdays]
-                if not target_weekdays:
-                    self.send_json_response({"error": "Dias da semana inválidos"}, 400)
-                    return
-                
-                # Find next occurrence
-                next_run = None
-                for i in range(7):
-                    check_date = now_brazil + timedelta(days=i)
-                    if check_date.weekday() in target_weekdays:
-                        next_datetime = check_date.replace(hour=hour, minute=minute, second=0, microsecond=0)
-                        if next_datetime > now_brazil:
-                            next_run = next_datetime.isoformat()
-                            break
-                
-                if not next_run:
-                    # Fallback to next week
-                    next_datetime = now_brazil + timedelta(days=7)
-                    next_datetime = next_datetime.replace(hour=hour, minute=minute, second=0, microsecond=0)
-                    next_run = next_datetime.isoformat()
-            else:
-                self.send_json_response({"error": "Tipo de agendamento inválido"}, 400)
+                else:
+                    self.send_json_response({"error": "Regra de agendamento sem próximas execuções"}, 400)
                 return
+            next_run = next_occurrence.isoformat()
             
             # Create scheduled message with robust database connection
             try:
@@ -11753,12 +17043,14 @@ class WhatsFlowRealHandler(BaseHTTPRequestHandler):
                 INSERT INTO scheduled_messages 
                 (id, campaign_id, message_text, message_type, media_url, 
                  schedule_type, schedule_time, schedule_days, schedule_date, 
-                 is_active, next_run, created_at)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                 is_active, next_run, created_at,
+                 cron_expression, timezone, catch_up_policy)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
             """, (
                 message_id, campaign_id, message_text, message_type, media_url,
-                schedule_type, schedule_time, json.dumps(schedule_days), schedule_date,
-                1, next_run, created_at
+                rule.schedule_type, schedule_time or '', json.dumps(schedule_days), schedule_date,
+                1, next_run, created_at,
+                cron_expression, tz_name, catch_up_policy
             ))
             
             # Store group and instance info in separate table for easier querying
@@ -11799,6 +17091,170 @@ class WhatsFlowRealHandler(BaseHTTPRequestHandler):
             traceback.print_exc()
             self.send_json_response({"error": str(e)}, 500)
     
+    def handle_get_scheduler_metrics(self):
+        """Rolling dispatch lag/latency histograms of the message scheduler."""
+        try:
+            self.send_json_response(_SCHEDULER_METRICS.snapshot())
+        except Exception as e:
+            self.send_json_response({"error": str(e)}, 500)
+
+    def handle_get_scheduler_metrics_hourly(self):
+        """Persisted hourly scheduler rollups (?hours=24&scope=instance&scope_id=...)."""
+        try:
+            query_params = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+            scope = query_params.get('scope', ['all'])[0]
+            if scope not in ('all', 'instance', 'campaign'):
+                self.send_json_response({"error": "scope deve ser all, instance ou campaign"}, 400)
+                return
+            try:
+                hours = int(query_params.get('hours', ['24'])[0])
+            except ValueError:
+                self.send_json_response({"error": "hours deve ser um número inteiro"}, 400)
+                return
+            scope_id = query_params.get('scope_id', [None])[0]
+            if scope == 'all':
+                scope_id = ''
+            self.send_json_response({
+                'hours': hours,
+                'scope': scope,
+                'rollups': _SCHEDULER_METRICS.hourly(hours, scope, scope_id),
+            })
+        except Exception as e:
+            self.send_json_response({"error": str(e)}, 500)
+
+    def handle_get_baileys_client_stats(self):
+        """Per-endpoint latency of calls made through the shared Baileys client."""
+        try:
+            self.send_json_response({
+                'base_url': _BAILEYS_CLIENT.base_url,
+                'transport': 'unix' if _BAILEYS_CLIENT.base_url.startswith(UNIX_SOCKET_SCHEME) else 'tcp',
+                'resolver': _BAILEYS_URL_RESOLVER.status(),
+                'pool_size': _BAILEYS_CLIENT.pool_size,
+                'endpoints': _BAILEYS_CLIENT.stats(),
+                'status_monitor': _STATUS_MONITOR.stats(),
+            })
+        except Exception as e:
+            self.send_json_response({"error": str(e)}, 500)
+
+    def handle_get_baileys_process_status(self):
+        """Supervisor state of the local Node process: readiness, restarts, uptime."""
+        if _BAILEYS_MANAGER is None:
+            self.send_json_response({"running": False, "error": "Baileys não é gerenciado por este processo"})
+            return
+        try:
+            self.send_json_response(_BAILEYS_MANAGER.status())
+        except Exception as e:
+            self.send_json_response({"error": str(e)}, 500)
+
+    def handle_get_baileys_workers(self):
+        """Per-worker health, restarts and routed instance counts."""
+        if _BAILEYS_ROUTER is None:
+            self.send_json_response({"workers": [], "sharded": False})
+            return
+        try:
+            self.send_json_response(dict(_BAILEYS_ROUTER.stats(), sharded=True))
+        except Exception as e:
+            self.send_json_response({"error": str(e)}, 500)
+
+    def handle_rebalance_baileys_workers(self):
+        """Move instances off unhealthy workers and even out the load (?dry_run in body)."""
+        if _BAILEYS_ROUTER is None:
+            self.send_json_response({"error": "Apenas um worker Baileys em execução"}, 400)
+            return
+        try:
+            content_length = int(self.headers.get('Content-Length', 0))
+            data = json.loads(self.rfile.read(content_length).decode('utf-8')) if content_length else {}
+            self.send_json_response(_BAILEYS_ROUTER.rebalance(dry_run=bool(data.get('dry_run'))))
+        except json.JSONDecodeError:
+            self.send_json_response({"error": "Invalid JSON"}, 400)
+        except Exception as e:
+            self.send_json_response({"error": str(e)}, 500)
+
+    def handle_baileys_proxy(self, method):
+        """Forward browser calls to the Baileys worker that owns the instance.
+
+        Used as ``window.API_BASE_URL`` when instances are sharded, so the page
+        never has to know which worker port serves which instance. Paths without
+        an instance segment (e.g. ``/send``) are routed on ``instanceId`` from the
+        query string or JSON body; with several workers they are rejected if
+        neither is given, since any worker guess would be wrong for most instances.
+        """
+        try:
+            parsed = urllib.parse.urlsplit(self.path)
+            path = parsed.path[len('/api/baileys'):] or '/'
+            parts = [part for part in path.split('/') if part]
+            if path == '/health':
+                healthy = any(_BAILEYS_CLIENT.health(url) for url in _BAILEYS_CLIENT.service_urls())
+                self.send_json_response({"status": "running" if healthy else "unavailable"}, 200 if healthy else 503)
+                return
+
+            instance_id = urllib.parse.unquote(parts[1]) if len(parts) > 1 else None
+            if not instance_id:
+                instance_id = urllib.parse.parse_qs(parsed.query).get('instanceId', [None])[0]
+            kwargs: Dict[str, Any] = {}
+            if method == 'POST':
+                content_length = int(self.headers.get('Content-Length', 0))
+                kwargs['data'] = self.rfile.read(content_length) if content_length else b''
+                kwargs['headers'] = {'Content-Type': self.headers.get('Content-Type', 'application/json')}
+                if not instance_id and kwargs['data']:
+                    try:
+                        body = json.loads(kwargs['data'].decode('utf-8'))
+                    except (UnicodeDecodeError, ValueError):
+                        body = None
+                    if isinstance(body, dict):
+                        instance_id = body.get('instanceId') or body.get('instance_id')
+            if not instance_id and _BAILEYS_CLIENT.router is not None:
+                self.send_json_response({
+                    "error": "Informe o instanceId (no caminho, na query ou no corpo) para rotear a chamada ao worker Baileys correto"
+                }, 400)
+                return
+            kwargs['base_url'] = _BAILEYS_CLIENT.url_for(str(instance_id) if instance_id else None)
+            operation = parts[0] if parts and parts[0] in BAILEYS_TIMEOUTS else 'proxy'
+            target = path + (f"?{parsed.query}" if parsed.query else '')
+            response = _BAILEYS_CLIENT.request(operation, method, target, **kwargs)
+
+            self.send_response(response.status_code)
+            self.send_header('Content-type', response.headers.get('Content-Type', 'application/json'))
+            self.send_header('Content-Length', str(len(response.content)))
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.end_headers()
+            self.wfile.write(response.content)
+        except BaileysTimeoutError as e:
+            self.send_json_response({"error": str(e)}, 504)
+        except BaileysUnavailableError as e:
+            self.send_json_response({"error": str(e)}, 502)
+        except Exception as e:
+            self.send_json_response({"error": str(e)}, 500)
+
+    def handle_recompute_scheduled_messages(self):
+        """Fill in missing next_run values; ``{"all": true}`` also recomputes past ones.
+
+        Future next_run values are never touched here: they may be pending
+        failure retries, and due rows are left to the scheduler's catch-up policy
+        unless ``all`` is requested.
+        """
+        conn = None
+        try:
+            content_length = int(self.headers.get('Content-Length', 0) or 0)
+            data = {}
+            if content_length:
+                data = json.loads(self.rfile.read(content_length).decode('utf-8') or '{}') or {}
+            recompute_all = bool(data.get('all')) if isinstance(data, dict) else False
+            conn = get_db_connection()
+            updated = recompute_next_runs(conn, only_missing=not recompute_all, keep_future=True)
+            conn.commit()
+            self.send_json_response({
+                "success": True,
+                "updated": updated,
+                "message": f"Próxima execução recalculada para {updated} agendamentos"
+            })
+        except Exception as e:
+            print(f"❌ Erro ao recalcular agendamentos: {e}")
+            self.send_json_response({"error": str(e)}, 500)
+        finally:
+            if conn:
+                conn.close()
+
     def handle_update_scheduled_message(self, message_id):
         """Update scheduled message (toggle active/inactive)"""
         try:
@@ -11933,7 +17389,13 @@ def main():
     
     # Start Baileys service
     print("📱 Iniciando serviço WhatsApp (Baileys)...")
-    baileys_manager = BaileysManager()
+    global _BAILEYS_MANAGER, _BAILEYS_ROUTER
+    if BAILEYS_WORKERS > 1:
+        print(f"🧩 Distribuindo instâncias entre {BAILEYS_WORKERS} workers Baileys")
+        baileys_manager = _BAILEYS_MANAGER = BaileysWorkerPool(BAILEYS_WORKERS)
+        _BAILEYS_ROUTER = _BAILEYS_CLIENT.router = BaileysRouter(baileys_manager)
+    else:
+        baileys_manager = _BAILEYS_MANAGER = BaileysManager()
     
     # Signal handler will be defined later with scheduler
     
@@ -11941,16 +17403,33 @@ def main():
     baileys_thread = threading.Thread(target=baileys_manager.start_baileys)
     baileys_thread.daemon = True
     baileys_thread.start()
+
+    # Discover the Baileys URL in background and fail over when it goes down
+    _BAILEYS_URL_RESOLVER.start()
+
+    # Keep instance states cached and instances.connected up to date
+    _STATUS_MONITOR.start()
     
     # Start Message Scheduler
     print("⏰ Iniciando agendador de mensagens...")
-    scheduler = MessageScheduler(API_BASE_URL)
+    scheduler = MessageScheduler()
+    _SCHEDULER_METRICS.attach(scheduler)
+    scheduler.dispatch_observers.append(publish_dispatch_event)
     scheduler.start()
+
+    # Download media of upcoming schedules before they fire
+    media_prefetcher = MediaPrefetcher(_MEDIA_CACHE)
+    media_prefetcher.start()
     
     def signal_handler_with_scheduler(sig, frame):
         print("\n🛑 Parando serviços...")
         scheduler.stop()
+        media_prefetcher.stop()
+        _SCHEDULER_METRICS.flush()
+        _STATUS_MONITOR.stop()
+        _BAILEYS_URL_RESOLVER.stop()
         baileys_manager.stop_baileys()
+        stop_backend_unix_server()
         sys.exit(0)
     
     signal.signal(signal.SIGINT, signal_handler_with_scheduler)
@@ -11965,7 +17444,9 @@ def main():
     print()
     
     try:
-        server = HTTPServer(('0.0.0.0', PORT), WhatsFlowRealHandler)
+        # Threaded so slow proxy calls do not block the dashboard polls
+        server = ThreadingHTTPServer(('0.0.0.0', PORT), WhatsFlowRealHandler)
+        server.daemon_threads = True
         print(f"✅ Servidor rodando na porta {PORT}")
         print("🔗 Pronto para conectar WhatsApp REAL!")
         print(f"🌐 Acesse: http://localhost:{PORT}")
@@ -11974,7 +17455,14 @@ def main():
     except KeyboardInterrupt:
         print("\n👋 WhatsFlow Professional finalizado!")
         scheduler.stop()
+        media_prefetcher.stop()
+        _SCHEDULER_METRICS.flush()
+        _STATUS_MONITOR.stop()
+        _BAILEYS_URL_RESOLVER.stop()
         baileys_manager.stop_baileys()
+        stop_backend_unix_server()
 
 if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "simulate-scheduler":
+        sys.exit(simulate_scheduler_cli(sys.argv[2:]))
     main()